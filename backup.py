@@ -0,0 +1,195 @@
+"""Онлайн-резервные копии базы SQLite без остановки бота.
+
+Копия снимается через SQLite backup API небольшими порциями страниц в
+отдельном потоке, проверяется PRAGMA integrity_check, сжимается gzip и
+кладется в BACKUP_DIR; старые копии сверх BACKUP_KEEP удаляются.
+
+Примеры:
+    python backup.py                 # снять копию сейчас
+    gunzip -c backups/asu_quiz-20240101-030000.db.gz > asu_quiz.db  # восстановить
+"""
+
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from telegram.ext import ContextTypes
+
+from database import current_engine
+from metrics import registry, Counter, Gauge
+
+# Как часто (в секундах) снимать копию; 0 - не снимать по расписанию
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", "86400"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+# Сколько последних копий хранить
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Страниц за один шаг копирования и пауза между шагами: между шагами
+# соединение бота может писать в базу, а поток - отдавать GIL обработчикам
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+
+BACKUP_SUFFIX = ".db.gz"
+
+# Одновременно снимается не больше одной копии
+_backup_lock = threading.Lock()
+# Выставляется при остановке бота, чтобы не ждать конца копирования
+_stop = threading.Event()
+
+backups = registry.register(
+    Counter("quiz_backups_total", "Резервные копии базы по результату", ("result",))
+)
+backup_duration = registry.register(
+    Gauge("quiz_backup_duration_seconds", "Длительность последней успешной резервной копии")
+)
+backup_size = registry.register(
+    Gauge("quiz_backup_size_bytes", "Размер последней резервной копии после сжатия")
+)
+backup_last_success = registry.register(
+    Gauge(
+        "quiz_backup_last_success_timestamp_seconds",
+        "Время последней успешной резервной копии (unix time)",
+    )
+)
+
+
+class BackupError(Exception):
+    pass
+
+
+def backups_supported() -> bool:
+    """Копии через backup API возможны только для файловой базы SQLite"""
+    db_engine = current_engine()
+    return db_engine.dialect.name == "sqlite" and db_engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def _backup_prefix() -> str:
+    """Копии называются по файлу базы: у каждого бота процесса (hosting.py)
+    своя база, и их копии не путаются при ротации"""
+    name = os.path.splitext(os.path.basename(current_engine().url.database))[0]
+    return f"{name}-"
+
+
+def _copy_pages(source_path: str, target_path: str):
+    """Копирует базу постранично. На источнике держится читающая транзакция:
+    в режиме WAL она фиксирует снимок, и запись бота между шагами не
+    заставляет копирование начинаться заново"""
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        def progress(status, remaining, total):
+            if _stop.is_set():
+                raise BackupError("копирование прервано остановкой бота")
+            time.sleep(BACKUP_STEP_PAUSE)
+
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        source.execute("COMMIT")
+
+        result = target.execute("PRAGMA integrity_check").fetchall()
+        if result != [("ok",)]:
+            problems = "; ".join(row[0] for row in result[:5])
+            raise BackupError(f"копия не прошла integrity_check: {problems}")
+    finally:
+        target.close()
+        source.close()
+
+
+def _compress(path: str, target_path: str):
+    with open(path, "rb") as src, gzip.open(target_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def rotate_backups(keep: int = BACKUP_KEEP):
+    """Удаляет старые копии, оставляя keep последних (имена упорядочены по времени)"""
+    pattern = f"{glob.escape(_backup_prefix())}*{BACKUP_SUFFIX}"
+    paths = sorted(glob.glob(os.path.join(BACKUP_DIR, pattern)))
+    for path in paths[: max(0, len(paths) - keep)]:
+        os.remove(path)
+        logging.info(f"Удалена старая резервная копия {path}")
+
+
+def run_backup() -> dict:
+    """Снимает, проверяет и сжимает копию базы; блокирующая, для потока или CLI.
+
+    Промежуточные файлы получают временные имена и переименовываются только
+    после проверки, поэтому в BACKUP_DIR не бывает недописанных копий.
+    """
+    if not backups_supported():
+        raise BackupError("резервные копии поддерживаются только для файловой базы SQLite")
+    if not _backup_lock.acquire(blocking=False):
+        raise BackupError("копия уже снимается")
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        name = f"{_backup_prefix()}{datetime.utcnow():%Y%m%d-%H%M%S}"
+        snapshot = os.path.join(BACKUP_DIR, f".{name}.db")
+        compressed = os.path.join(BACKUP_DIR, f".{name}{BACKUP_SUFFIX}")
+        path = os.path.join(BACKUP_DIR, f"{name}{BACKUP_SUFFIX}")
+
+        start = time.perf_counter()
+        try:
+            _copy_pages(current_engine().url.database, snapshot)
+            _compress(snapshot, compressed)
+            os.replace(compressed, path)
+        except Exception:
+            backups.inc("error")
+            raise
+        finally:
+            for leftover in (snapshot, compressed):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        duration = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        backups.inc("ok")
+        backup_duration.set(value=duration)
+        backup_size.set(value=size)
+        backup_last_success.set(value=time.time())
+        rotate_backups()
+        logging.info(
+            f"Резервная копия {path} снята за {duration:.1f} с, {size / 1024 / 1024:.1f} МБ"
+        )
+        return {"path": path, "size": size, "duration": duration}
+    finally:
+        _backup_lock.release()
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: снимает копию в отдельном потоке"""
+    try:
+        await asyncio.to_thread(run_backup)
+    except Exception as e:
+        logging.error(f"Не удалось снять резервную копию: {e}")
+
+
+def stop_backups():
+    """Прерывает идущее копирование при остановке бота"""
+    _stop.set()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        result = run_backup()
+    except BackupError as e:
+        raise SystemExit(f"Ошибка резервного копирования: {e}")
+    print(
+        f"Готово: {result['path']}, {result['size'] / 1024 / 1024:.1f} МБ "
+        f"({result['duration']:.2f} с)"
+    )
+
+
+if __name__ == "__main__":
+    main()
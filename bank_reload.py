@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import seen
+from bot_scope import current_bot
+from export import ADMIN_IDS
+from metrics import registry, Counter
+from question_bank import QuestionBankError, bank_files, sync_question_bank
+from seed import question_bank_fingerprint, save_question_bank_fingerprint
+
+# Как часто (в секундах) проверять, не изменились ли файлы questions/*.json;
+# 0 - не следить, перезагрузка только командой /reload_questions
+QUESTION_BANK_WATCH_SECONDS = float(os.getenv("QUESTION_BANK_WATCH_SECONDS", "0"))
+
+# Одновременно идет не больше одной перезагрузки
+_reload_lock = asyncio.Lock()
+# Имена, размеры и время изменения файлов банка на момент последней проверки
+_bank_signature = None
+
+bank_reloads = registry.register(
+    Counter(
+        "quiz_question_bank_reloads_total",
+        "Перезагрузки банка вопросов без перезапуска бота по результату",
+        ("result",),
+    )
+)
+
+
+def bank_signature():
+    """Дешевый признак изменения файлов банка: только stat, без чтения"""
+    signature = []
+    for path in bank_files():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Файл удалили между glob и stat
+        signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _sync_and_index():
+    """Синхронизирует базу с файлами и строит новые индексы уровней.
+
+    Выполняется в отдельном потоке. Отпечаток снимается до чтения файлов:
+    если их поменяют во время синхронизации, при следующем запуске бот
+    увидит несовпадение и синхронизирует банк еще раз.
+    """
+    # Банк общий для всех ботов процесса (hosting.py) и живет в основной базе;
+    # поток выполняется в копии контекста, задача бота не затрагивается
+    current_bot.set(None)
+    fingerprint = question_bank_fingerprint()
+    stats = sync_question_bank()
+    changed = stats["inserted"] or stats["updated"] or stats["retired"]
+    indexes = seen.build_level_indexes() if changed else None
+    # Чтобы следующий запуск не синхронизировал банк повторно
+    save_question_bank_fingerprint(fingerprint)
+    return stats, indexes
+
+
+async def reload_question_bank() -> dict:
+    """Загружает новую версию банка вопросов, не останавливая бота.
+
+    Синхронизация и построение индексов идут вне event loop, в основном
+    потоке остается только подмена индексов одним присваиванием. Вопросы не
+    удаляются, а выводятся из оборота, поэтому начатые тесты (UserProgress
+    хранит id вопросов) дорешиваются по тем же id. При ошибке в файлах
+    бросается QuestionBankError, а база и индексы остаются прежними.
+    """
+    global _bank_signature
+    async with _reload_lock:
+        signature = bank_signature()
+        try:
+            stats, indexes = await asyncio.to_thread(_sync_and_index)
+        except QuestionBankError:
+            bank_reloads.inc("invalid")
+            raise
+        except Exception:
+            bank_reloads.inc("error")
+            raise
+        _bank_signature = signature
+        if indexes is None:
+            bank_reloads.inc("unchanged")
+            return stats
+        seen.install_level_indexes(indexes)
+        bank_reloads.inc("reloaded")
+        logging.info(f"Банк вопросов перезагружен, индексы уровней: {len(indexes)}")
+        return stats
+
+
+def _stats_text(stats: dict) -> str:
+    return (
+        f"добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+        f"выведено из оборота {stats['retired']}, без изменений {stats['unchanged']}"
+    )
+
+
+async def reload_questions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reload_questions - перечитать questions/*.json без перезапуска (только для админов)"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text(
+            "⛔ Перезагрузка вопросов доступна только администраторам."
+        )
+        return
+    if _reload_lock.locked():
+        await update.message.reply_text("⏳ Банк вопросов уже перезагружается.")
+        return
+
+    start = time.perf_counter()
+    try:
+        stats = await reload_question_bank()
+    except QuestionBankError as e:
+        await update.message.reply_text(
+            f"❌ Ошибка в банке вопросов, ничего не изменено:\n{e}"
+        )
+        return
+    except Exception as e:
+        logging.error(f"Ошибка перезагрузки банка вопросов: {e}")
+        await update.message.reply_text(
+            "❌ Не удалось перезагрузить банк вопросов. Подробности в логе."
+        )
+        return
+
+    logging.info(f"Администратор {user_id} перезагрузил банк вопросов: {_stats_text(stats)}")
+    await update.message.reply_text(
+        f"✅ Банк вопросов перезагружен за {time.perf_counter() - start:.2f} с: "
+        f"{_stats_text(stats)}"
+    )
+
+
+async def watch_question_bank(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: перезагружает банк, если его файлы изменились"""
+    global _bank_signature
+    signature = bank_signature()
+    if _bank_signature is None:
+        # Первая проверка после запуска: банк уже синхронизирован prepare_database
+        _bank_signature = signature
+        return
+    if signature == _bank_signature or _reload_lock.locked():
+        return
+
+    logging.info("Файлы банка вопросов изменились, перезагружаем")
+    try:
+        stats = await reload_question_bank()
+    except QuestionBankError as e:
+        # Не повторяем, пока файлы не изменят снова
+        _bank_signature = signature
+        logging.error(f"Банк вопросов не перезагружен, ошибка в файлах: {e}")
+        return
+    except Exception as e:
+        logging.error(f"Ошибка перезагрузки банка вопросов: {e}")
+        return
+    logging.info(f"Банк вопросов перезагружен по изменению файлов: {_stats_text(stats)}")
@@ -0,0 +1,513 @@
+"""Микробенчмарки обработчиков бота с контролем регрессий.
+
+Настоящие корутины обработчиков вызываются напрямую с синтетическими
+Update/CallbackQuery (telegram.Update.de_json) и фейковым ботом, который
+только записывает вызовы. Для каждого размера данных создается отдельная
+временная база (пользователи в user_stats и кастомные тесты), и замеры
+выполняются в отдельном процессе, чтобы размеры не влияли друг на друга.
+
+Для каждого обработчика измеряются время вызова (медиана и p90), число
+SQL-запросов и объем памяти, выделенной за вызов (tracemalloc).
+
+Примеры:
+    python benchmark.py --users 1000,100000,1000000 --custom-tests 100,100000
+    python benchmark.py --save-baseline          # сохранить текущие результаты
+    python benchmark.py --threshold 20           # упасть при регрессии > 20%
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+SEED_CHUNK = 50_000
+
+
+# --- Фейковые объекты Telegram ---
+
+
+class RecordingBot:
+    """Заменяет ExtBot: любой метод Bot API только записывается"""
+
+    # Атрибуты ExtBot, которые читают объекты telegram при разборе апдейтов
+    defaults = None
+    callback_data_cache = None
+    username = "bench_bot"
+
+    def __init__(self):
+        self.calls = []
+        self._message_id = 0
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            self.calls.append(name)
+            self._message_id += 1
+            return SimpleNamespace(message_id=self._message_id, chat_id=kwargs.get("chat_id"))
+
+        return method
+
+
+class FakeApplication:
+    def __init__(self):
+        self.user_data = {}
+        self.bot_data = {}
+        self.job_queue = None
+
+    def mark_data_for_update_persistence(self, chat_ids=None, user_ids=None):
+        pass
+
+
+class BenchContext:
+    def __init__(self, bot, application, user_id):
+        self.bot = bot
+        self.application = application
+        self.user_data = application.user_data.setdefault(user_id, {})
+        self.args = []
+
+
+def make_callback_update(bot, user_id: int, data: str, update_id: int = 1):
+    from telegram import Update
+
+    user = {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"}
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "bench",
+                },
+            },
+        },
+        bot,
+    )
+
+
+def make_inline_update(bot, user_id: int, query: str, update_id: int = 1):
+    from telegram import Update
+
+    user = {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"}
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "inline_query": {
+                "id": str(update_id),
+                "from": user,
+                "query": query,
+                "offset": "",
+            },
+        },
+        bot,
+    )
+
+
+# --- Подготовка базы ---
+
+
+def seed_database(users: int, custom_tests: int):
+    import database
+    from database import CustomQuestion, CustomTest, UserStats
+    from seed import prepare_database
+
+    prepare_database()
+    with database.get_db() as db:
+        if db.query(UserStats).count() >= users:
+            return  # База этого размера уже подготовлена ранее
+
+    rng = random.Random(42)
+    with database.engine.begin() as conn:
+        for start in range(0, users, SEED_CHUNK):
+            conn.execute(
+                UserStats.__table__.insert(),
+                [
+                    {
+                        "user_id": user_id,
+                        "username": f"user{user_id}",
+                        "mmr": rng.randint(400, 2600),
+                        "total_tests": rng.randint(0, 40),
+                    }
+                    for user_id in range(start + 1, min(start + SEED_CHUNK, users) + 1)
+                ],
+            )
+        for start in range(0, custom_tests, SEED_CHUNK // 5):
+            test_ids = range(start + 1, min(start + SEED_CHUNK // 5, custom_tests) + 1)
+            conn.execute(
+                CustomTest.__table__.insert(),
+                [
+                    {
+                        "id": test_id,
+                        "name": f"Тест {test_id}",
+                        "author_id": rng.randint(1, users),
+                        "author_username": None,
+                    }
+                    for test_id in test_ids
+                ],
+            )
+            conn.execute(
+                CustomQuestion.__table__.insert(),
+                [
+                    {
+                        "test_id": test_id,
+                        "question_text": f"Вопрос {n} теста {test_id}?",
+                        "option1": "Первый",
+                        "option2": "Второй",
+                        "option3": "Третий",
+                        "option4": "Четвертый",
+                        "correct_option": rng.randint(1, 4),
+                    }
+                    for test_id in test_ids
+                    for n in range(5)
+                ],
+            )
+
+
+# --- Замеры ---
+
+
+async def measure(setup, call, iterations: int, alloc_iterations: int):
+    from metrics import HandlerScope, current_scope
+    from sql_audit import check_query_budget
+
+    times, queries, allocations = [], [], []
+
+    for i in range(iterations):
+        args = await setup(i)
+        scope = HandlerScope(call.__name__, i)
+        token = current_scope.set(scope)
+        start = time.perf_counter()
+        try:
+            await call(*args)
+        finally:
+            times.append(time.perf_counter() - start)
+            current_scope.reset(token)
+        queries.append(scope.queries)
+        check_query_budget(scope)
+
+    tracemalloc.start()
+    try:
+        for i in range(iterations, iterations + alloc_iterations):
+            args = await setup(i)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await call(*args)
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "p90_ms": times[int(0.9 * (len(times) - 1))] * 1000,
+        "queries": max(queries),
+        "alloc_kib": statistics.median(allocations) / 1024 if allocations else 0,
+    }
+
+
+async def run_cases(users: int, iterations: int, alloc_iterations: int):
+    import bot
+    import custom_tests
+    import daily
+    import inline
+    from database import get_db, UserProgress
+
+    fake_bot = RecordingBot()
+    application = FakeApplication()
+    rng = random.Random(7)
+
+    def pick_user(i):
+        return rng.randint(1, users)
+
+    def ctx(user_id):
+        return BenchContext(fake_bot, application, user_id)
+
+    async def start_standard(user_id):
+        update = make_callback_update(fake_bot, user_id, "level_python_junior")
+        await bot.handle_level_selection(update, ctx(user_id))
+        return update
+
+    def catalog_entries():
+        return [
+            (author_id, index)
+            for author_id, tests in custom_tests.get_custom_tests_storage().items()
+            for index in range(len(tests))
+        ]
+
+    daily.ensure_daily_challenge()
+    # Вызов дня проходится один раз: каждой итерации нужен новый участник
+    daily_users = iter(range(users + 1, users + 1_000_000))
+
+    entries = catalog_entries()
+    total_pages = max(1, (len(entries) + custom_tests.TESTS_PER_PAGE - 1) // custom_tests.TESTS_PER_PAGE)
+
+    async def start_custom(user_id):
+        author_id, index = rng.choice(entries)
+        update = make_callback_update(fake_bot, user_id, f"run_custom_{author_id}_{index}")
+        await custom_tests.run_custom_test(update, ctx(user_id))
+        return update
+
+    # --- setup-функции: готовят аргументы, их время не учитывается ---
+
+    async def setup_level_selection(i):
+        user_id = pick_user(i)
+        return make_callback_update(fake_bot, user_id, "level_python_junior"), ctx(user_id)
+
+    async def setup_send_question(i):
+        user_id = pick_user(i)
+        update = await start_standard(user_id)
+        return update, ctx(user_id), user_id
+
+    async def setup_answer(i):
+        user_id = pick_user(i)
+        await start_standard(user_id)
+        return (
+            make_callback_update(fake_bot, user_id, f"answer_{rng.randint(1, 4)}"),
+            ctx(user_id),
+        )
+
+    async def setup_last_answer(i):
+        # Ответ на последний вопрос: запись ответа и завершение теста в одном обработчике
+        user_id = pick_user(i)
+        await start_standard(user_id)
+        with get_db() as db:
+            db.query(UserProgress).filter(UserProgress.user_id == user_id).update(
+                {UserProgress.current_question: 9}
+            )
+            db.commit()
+        return (
+            make_callback_update(fake_bot, user_id, f"answer_{rng.randint(1, 4)}_9"),
+            ctx(user_id),
+        )
+
+    async def setup_finish(i):
+        user_id = pick_user(i)
+        update = await start_standard(user_id)
+        with get_db() as db:
+            db.query(UserProgress).filter(UserProgress.user_id == user_id).update(
+                {UserProgress.current_question: 10}
+            )
+            db.commit()
+        return update, ctx(user_id), user_id, rng.randint(0, 10)
+
+    async def setup_catalog(i):
+        user_id = pick_user(i)
+        page = rng.randrange(total_pages)
+        return make_callback_update(fake_bot, user_id, f"test_catalog_{page}"), ctx(user_id)
+
+    async def setup_run_custom(i):
+        user_id = pick_user(i)
+        author_id, index = rng.choice(entries)
+        return (
+            make_callback_update(fake_bot, user_id, f"run_custom_{author_id}_{index}"),
+            ctx(user_id),
+        )
+
+    async def setup_custom_answer(i):
+        user_id = pick_user(i)
+        await start_custom(user_id)
+        return (
+            make_callback_update(fake_bot, user_id, f"custom_answer_{rng.randint(1, 4)}"),
+            ctx(user_id),
+        )
+
+    # Запросы как при наборе: префиксы названий случайных тестов
+    inline_queries = [
+        test["name"][:length]
+        for tests in custom_tests.get_custom_tests_storage().values()
+        for test in tests[:1]
+        for length in (1, 3, 5)
+    ] or [""]
+
+    async def setup_inline(i):
+        user_id = pick_user(i)
+        return make_inline_update(fake_bot, user_id, rng.choice(inline_queries)), ctx(user_id)
+
+    async def setup_leaderboard(i):
+        user_id = pick_user(i)
+        return make_callback_update(fake_bot, user_id, "leaderboard"), ctx(user_id)
+
+    async def setup_show_daily(i):
+        user_id = next(daily_users)
+        return make_callback_update(fake_bot, user_id, "daily"), ctx(user_id)
+
+    async def setup_start_daily(i):
+        user_id = next(daily_users)
+        return make_callback_update(fake_bot, user_id, "daily_start"), ctx(user_id)
+
+    async def setup_daily_answer(i):
+        user_id = next(daily_users)
+        await daily.start_daily(make_callback_update(fake_bot, user_id, "daily_start"), ctx(user_id))
+        return (
+            make_callback_update(fake_bot, user_id, f"daily_answer_0_{rng.randint(1, 4)}"),
+            ctx(user_id),
+        )
+
+    cases = {
+        "handle_level_selection": (setup_level_selection, bot.handle_level_selection),
+        "send_question": (setup_send_question, bot.send_question),
+        "handle_answer": (setup_answer, bot.handle_answer),
+        "handle_last_answer": (setup_last_answer, bot.handle_answer),
+        "finish_test": (setup_finish, bot.finish_test),
+        "show_test_catalog": (setup_catalog, custom_tests.show_test_catalog),
+        "run_custom_test": (setup_run_custom, custom_tests.run_custom_test),
+        "handle_custom_answer": (setup_custom_answer, custom_tests.handle_custom_answer),
+        "show_leaderboard": (setup_leaderboard, bot.show_leaderboard),
+        "inline_query": (setup_inline, inline.inline_query),
+        "show_daily": (setup_show_daily, daily.show_daily),
+        "start_daily": (setup_start_daily, daily.start_daily),
+        "handle_daily_answer": (setup_daily_answer, daily.handle_daily_answer),
+    }
+
+    results = {}
+    for name, (setup, call) in cases.items():
+        if not entries and setup in (setup_run_custom, setup_custom_answer):
+            continue
+        results[name] = await measure(setup, call, iterations, alloc_iterations)
+    return results
+
+
+def run_child(args):
+    """Выполняется в дочернем процессе для одного размера данных"""
+    import logging
+
+    logging.getLogger().setLevel(logging.ERROR)
+    seed_database(args.child_users, args.child_tests)
+
+    import database
+    import metrics
+    import sql_audit
+
+    for engine in {database.engine, database.read_engine}:
+        metrics.instrument_engine(engine)
+        sql_audit.install(engine)
+
+    results = asyncio.run(run_cases(args.child_users, args.iterations, args.alloc_iterations))
+    print(json.dumps(results))
+
+
+# --- Родительский процесс ---
+
+
+def run_size(args, users: int, tests: int):
+    db_path = os.path.join(args.db_dir, f"bench_{users}u_{tests}t.db")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        QUERY_BUDGET_STRICT="1",
+        METRICS_PORT="0",
+    )
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child-users",
+        str(users),
+        "--child-tests",
+        str(tests),
+        "--iterations",
+        str(args.iterations),
+        "--alloc-iterations",
+        str(args.alloc_iterations),
+    ]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Бенчмарк для {users} пользователей / {tests} тестов упал")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold: float):
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        limit = previous["median_ms"] * (1 + threshold / 100)
+        if current["median_ms"] > limit:
+            regressions.append(
+                f"{key}: {current['median_ms']:.2f} мс против {previous['median_ms']:.2f} мс"
+            )
+        if current["queries"] > previous["queries"]:
+            regressions.append(
+                f"{key}: {current['queries']} SQL-запросов против {previous['queries']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="1000", help="размеры user_stats через запятую")
+    parser.add_argument(
+        "--custom-tests", default="100", help="размеры каталога тестов через запятую"
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--alloc-iterations", type=int, default=20)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--threshold", type=float, default=25.0, help="допустимый рост медианы, %%"
+    )
+    parser.add_argument(
+        "--db-dir", default=os.path.join(tempfile.gettempdir(), "quiz_benchmark")
+    )
+    parser.add_argument("--child-users", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-tests", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_users is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        run_child(args)
+        return
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    results = {}
+    for users in map(int, args.users.split(",")):
+        for tests in map(int, args.custom_tests.split(",")):
+            print(f"Размер: {users} пользователей, {tests} кастомных тестов...", flush=True)
+            for handler, values in run_size(args, users, tests).items():
+                results[f"{users}u/{tests}t/{handler}"] = values
+
+    print(f"\n{'случай':<48}{'медиана мс':>12}{'p90 мс':>10}{'SQL':>6}{'KiB':>10}")
+    for key, values in results.items():
+        print(
+            f"{key:<48}{values['median_ms']:>12.3f}{values['p90_ms']:>10.3f}"
+            f"{values['queries']:>6}{values['alloc_kib']:>10.1f}"
+        )
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False)
+        print(f"\nБазовые значения сохранены в {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nРегрессии относительно базовых значений:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
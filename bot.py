@@ -1,6 +1,5 @@
 import logging
 import asyncio
-import random
 import os
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -11,12 +10,92 @@ from telegram.ext import (
     CallbackQueryHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
-from database import create_tables, get_db, Question, UserProgress, UserStats
+from database import (
+    engine,
+    get_db,
+    get_read_db,
+    read_engine,
+    Question,
+    SeenQuestions,
+    UserProgress,
+    UserStats,
+    UserSummary,
+)
+from metrics import (
+    METRICS_PORT,
+    InstrumentedHTTPXRequest,
+    count_update,
+    instrument_engine,
+    instrument_handlers,
+    start_metrics_server,
+)
+from persistence import SQLitePersistence
+from maintenance import MAINTENANCE_INTERVAL_SECONDS, maintenance_job, stop_maintenance
+from backup import BACKUP_INTERVAL_SECONDS, backup_job, backups_supported, stop_backups
+from bank_reload import (
+    QUESTION_BANK_WATCH_SECONDS,
+    reload_questions_command,
+    watch_question_bank,
+)
+from broadcast import broadcast_command, resume_broadcasts, stop_broadcast_tasks
+from custom_import import show_import_help, handle_test_document
+from daily import (
+    DAILY_CHECKPOINT_SECONDS,
+    checkpoint_daily_results,
+    ensure_daily_challenge,
+    flush_daily_results,
+    handle_daily_answer,
+    prepare_daily_challenge,
+    show_daily,
+    show_daily_top,
+    start_daily,
+)
+from duels import (
+    MATCH_INTERVAL_SECONDS,
+    cancel_duel_search,
+    duel_timeout,
+    handle_duel_answer,
+    join_duel_queue,
+    match_duel_queue,
+    show_duel_levels,
+    show_duel_menu,
+)
+from export import export_command
+from group_quiz import (
+    GROUP_TALLY_INTERVAL,
+    flush_group_tallies,
+    group_round_timeout,
+    handle_group_answer,
+    start_group_quiz,
+)
+from history import record_result, show_my_stats, stats_command
+from inline import inline_query, TEST_LINK_PREFIX
+from search import search_command, show_search_page
+from review import (
+    handle_review_answer,
+    record_miss,
+    show_review_menu,
+    start_review,
+    stop_review,
+)
+from seed import prepare_database
+from seen import record_seen, select_questions
+import sql_audit
+from sessions import reap_sessions, standard_sessions, REAP_INTERVAL_SECONDS
+from timers import (
+    QUESTION_TIME_LIMIT,
+    TIMEOUT_HANDLERS,
+    cancel_question_timer,
+    run_question_timers,
+    start_question_timer,
+)
 from sqlalchemy import select, desc, func
-from datetime import datetime
+from datetime import datetime, time as dtime, timezone
 
 # Импортируем все необходимое из custom_tests
 from custom_tests import (
@@ -48,6 +127,8 @@ from custom_tests import (
     cancel_custom_test,
     # Добавляем отмену создания теста
     cancel_test_creation,
+    start_linked_test,
+    custom_question_timeout,
 )
 
 # Загрузка переменных окружения из .env файла
@@ -68,9 +149,14 @@ LANGUAGE_DISPLAY = {"python": "Python", "sql": "SQL", "java": "Java"}
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message=None):
     keyboard = [
         [InlineKeyboardButton("🎯 Начать тестирование", callback_data="start_test")],
+        [InlineKeyboardButton("⚔️ Дуэль", callback_data="duel")],
+        [InlineKeyboardButton("🗓 Вызов дня", callback_data="daily")],
+        [InlineKeyboardButton("🔁 Повторение ошибок", callback_data="review")],
         [InlineKeyboardButton("📝 Создать свой тест", callback_data="create_test")],
+        [InlineKeyboardButton("📥 Импорт теста из файла", callback_data="import_test")],
         [InlineKeyboardButton("📚 Каталог тестов", callback_data="test_catalog")],
         [InlineKeyboardButton("📊 Таблица лидеров", callback_data="leaderboard")],
+        [InlineKeyboardButton("📈 Моя статистика", callback_data="my_stats")],
         [InlineKeyboardButton("ℹ️ Помощь", callback_data="help")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -90,6 +176,19 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message=
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /start test_<id> - переход по кнопке из инлайн-сообщения с тестом
+    if context.args and context.args[0].startswith(TEST_LINK_PREFIX):
+        test_id = context.args[0][len(TEST_LINK_PREFIX):]
+        if test_id.isdigit():
+            await start_linked_test(update, context, int(test_id))
+            return
+    # Пользователь снова пишет боту - значит, рассылки опять могут до него дойти
+    with get_db() as db:
+        db.query(UserStats).filter(
+            UserStats.user_id == update.effective_user.id,
+            UserStats.blocked_at.is_not(None),
+        ).update({UserStats.blocked_at: None}, synchronize_session=False)
+        db.commit()
     await main_menu(update, context)
 
 
@@ -163,12 +262,9 @@ async def handle_level_selection(update: Update, context: ContextTypes.DEFAULT_T
         # Очищаем предыдущий прогресс
         db.query(UserProgress).filter(UserProgress.user_id == user_id).delete()
 
-        # Получаем все вопросы для выбранного языка и уровня
-        questions = db.query(Question).filter(Question.level == level_key).all()
-
-        # Выбираем 10 случайных вопросов
-        selected_questions = random.sample(questions, min(10, len(questions)))
-        selected_question_ids = [q.id for q in selected_questions]
+        # Выбираем 10 случайных вопросов, в первую очередь тех, что пользователь
+        # на этом уровне еще не видел
+        selected_question_ids = select_questions(db, user_id, level_key, 10)
 
         # Создаем новый прогресс с выбранными вопросами
         progress = UserProgress(
@@ -176,6 +272,7 @@ async def handle_level_selection(update: Update, context: ContextTypes.DEFAULT_T
             level=level_key,
             is_testing=True,
             question_ids=",".join(map(str, selected_question_ids)),
+            started_at=datetime.utcnow(),
         )
         db.add(progress)
 
@@ -186,22 +283,23 @@ async def handle_level_selection(update: Update, context: ContextTypes.DEFAULT_T
             db.add(stats)
 
         db.commit()
+        standard_sessions.started(user_id)
 
-    lang_name = LANGUAGE_DISPLAY.get(language, "Java")
+        lang_name = LANGUAGE_DISPLAY.get(language, "Java")
 
-    await query.edit_message_text(
-        f"📚 Вы выбрали {lang_name}, уровень: {level.capitalize()}\n"
-        "Начинаем тестирование! Удачи! 🍀\n\n"
-        "Всего будет 10 вопросов. На каждый вопрос дается 4 варианта ответа."
-    )
+        await query.edit_message_text(
+            f"📚 Вы выбрали {lang_name}, уровень: {level.capitalize()}\n"
+            "Начинаем тестирование! Удачи! 🍀\n\n"
+            "Всего будет 10 вопросов. На каждый вопрос дается 4 варианта ответа."
+        )
 
-    # Отправляем первый вопрос
-    await send_question(update, context, user_id)
+        # Отправляем первый вопрос в той же сессии
+        await send_question(update, context, user_id, db=db, progress=progress)
 
 
 async def get_question_message(question, progress):
     """Форматирует сообщение с вопросом"""
-    return (
+    message = (
         f"❓ Вопрос {progress.current_question + 1}/10:\n\n"
         f"{question.question_text}\n\n"
         f"Варианты ответов:\n"
@@ -210,52 +308,79 @@ async def get_question_message(question, progress):
         f"3️⃣ {question.option3}\n"
         f"4️⃣ {question.option4}"
     )
+    if QUESTION_TIME_LIMIT:
+        message += f"\n\n⏱ На ответ {QUESTION_TIME_LIMIT} сек."
+    return message
 
 
 async def send_question(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int,
+    db=None,
+    progress=None,
 ):
-    with get_db() as db:
+    """Отправляет текущий вопрос. Если вызывающий уже открыл сессию и загрузил
+    прогресс, они передаются через db и progress, чтобы не читать их повторно."""
+    if db is None:
+        with get_db() as db:
+            await send_question(update, context, user_id, db=db, progress=progress)
+        return
+
+    if progress is None:
         progress = (
             db.query(UserProgress).filter(UserProgress.user_id == user_id).first()
         )
-        if not progress or not progress.is_testing:
-            return
+    if not progress or not progress.is_testing:
+        return
+
+    # Получаем список ID выбранных вопросов
+    question_ids = list(map(int, progress.question_ids.split(",")))
+    if progress.current_question >= len(question_ids):
+        # Тест завершен
+        await finish_test(
+            update,
+            context,
+            user_id,
+            progress.correct_answers,
+            db=db,
+            progress=progress,
+        )
+        return
 
-        # Получаем список ID выбранных вопросов
-        question_ids = list(map(int, progress.question_ids.split(",")))
-        if progress.current_question >= len(question_ids):
-            # Тест завершен
-            await finish_test(update, context, user_id, progress.correct_answers)
-            return
+    # Получаем текущий вопрос по его ID
+    current_question_id = question_ids[progress.current_question]
+    question = db.query(Question).filter(Question.id == current_question_id).first()
+    # Завершаем читающую транзакцию, чтобы не держать соединение из пула
+    # на время запроса к Telegram
+    db.commit()
 
-        # Получаем текущий вопрос по его ID
-        current_question_id = question_ids[progress.current_question]
-        question = db.query(Question).filter(Question.id == current_question_id).first()
+    # Создаем текст сообщения с вопросом
+    message_text = await get_question_message(question, progress)
 
-        # Создаем текст сообщения с вопросом
-        message_text = await get_question_message(question, progress)
-
-        # Создаем кнопки с номерами
-        keyboard = [
-            [
-                InlineKeyboardButton("1️⃣", callback_data="answer_1"),
-                InlineKeyboardButton("2️⃣", callback_data="answer_2"),
-                InlineKeyboardButton("3️⃣", callback_data="answer_3"),
-                InlineKeyboardButton("4️⃣", callback_data="answer_4"),
-            ],
-            [
-                InlineKeyboardButton(
-                    "❌ Отменить тест", callback_data="cancel_standard_test"
-                )
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Создаем кнопки с номерами; номер вопроса в callback_data отсекает
+    # нажатия на вопрос, время на который уже вышло
+    question_index = progress.current_question
+    keyboard = [
+        [
+            InlineKeyboardButton("1️⃣", callback_data=f"answer_1_{question_index}"),
+            InlineKeyboardButton("2️⃣", callback_data=f"answer_2_{question_index}"),
+            InlineKeyboardButton("3️⃣", callback_data=f"answer_3_{question_index}"),
+            InlineKeyboardButton("4️⃣", callback_data=f"answer_4_{question_index}"),
+        ],
+        [
+            InlineKeyboardButton(
+                "❌ Отменить тест", callback_data="cancel_standard_test"
+            )
+        ],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        # Отправляем новое сообщение с вопросом
-        await context.bot.send_message(
-            chat_id=user_id, text=message_text, reply_markup=reply_markup
-        )
+    # Отправляем новое сообщение с вопросом
+    message = await context.bot.send_message(
+        chat_id=user_id, text=message_text, reply_markup=reply_markup
+    )
+    start_question_timer("standard", user_id, (question_index, message.message_id))
 
 
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -263,7 +388,9 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = query.from_user.id
-    selected_option = int(query.data.split("_")[1])
+    # answer_<вариант>_<номер вопроса>
+    parts = query.data.split("_")
+    selected_option = int(parts[1])
 
     with get_db() as db:
         progress = (
@@ -271,6 +398,9 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         if not progress or not progress.is_testing:
             return
+        if len(parts) > 2 and int(parts[2]) != progress.current_question:
+            return  # Ответ на вопрос, время на который уже вышло
+        cancel_question_timer("standard", user_id)
 
         # Получаем список ID выбранных вопросов
         question_ids = list(map(int, progress.question_ids.split(",")))
@@ -294,6 +424,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Ваш ответ: {selected_answer_text}"
             )
         else:
+            # Вопрос вернется в режиме повторения
+            record_miss(db, user_id, question.id)
             feedback = (
                 f"{question_text}\n\n"
                 "❌ Неправильно!\n\n"
@@ -305,11 +437,11 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         progress.last_answer_time = datetime.utcnow()
         db.commit()
 
-    # Обновляем текущее сообщение, убирая кнопки и показывая результат
-    await query.edit_message_text(text=feedback)
+        # Обновляем текущее сообщение, убирая кнопки и показывая результат
+        await query.edit_message_text(text=feedback)
 
-    # Отправляем следующий вопрос в новом сообщении
-    await send_question(update, context, user_id)
+        # Отправляем следующий вопрос в новом сообщении, не перечитывая прогресс
+        await send_question(update, context, user_id, db=db, progress=progress)
 
 
 async def finish_test(
@@ -317,37 +449,80 @@ async def finish_test(
     context: ContextTypes.DEFAULT_TYPE,
     user_id: int,
     correct_answers: int,
+    db=None,
+    progress=None,
 ):
-    # Объявляем переменные за пределами контекстного менеджера
+    if db is None:
+        with get_db() as db:
+            await finish_test(
+                update, context, user_id, correct_answers, db=db, progress=progress
+            )
+        return
+
+    # Значения по умолчанию, если статистики пользователя нет
     level = ""
     mmr_change = 0
     old_mmr = 0
     new_mmr = 0
 
-    with get_db() as db:
+    if progress is None:
         progress = (
             db.query(UserProgress).filter(UserProgress.user_id == user_id).first()
         )
-        if not progress:
-            return
-
-        level = progress.level
-        progress.is_testing = False
-
-        # Обновляем статистику пользователя
-        stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
-        if stats:
-            # Рассчитываем изменение MMR
-            mmr_change = stats.calculate_mmr_change(correct_answers, level)
-            old_mmr = stats.mmr
-            stats.mmr = max(
-                0, stats.mmr + mmr_change
-            )  # MMR не может быть отрицательным
-            new_mmr = stats.mmr  # Сохраняем новый MMR в локальную переменную
-            stats.total_tests += 1
-            stats.last_test_date = datetime.utcnow()
+    if not progress:
+        return
+
+    level = progress.level
+    progress.is_testing = False
+
+    # Статистика, сводка и просмотренные вопросы уровня - одним запросом:
+    # последний ответ теста иначе не укладывается в бюджет запросов
+    loaded = (
+        db.query(UserStats, UserSummary, SeenQuestions)
+        .outerjoin(UserSummary, UserSummary.user_id == UserStats.user_id)
+        .outerjoin(
+            SeenQuestions,
+            (SeenQuestions.user_id == UserStats.user_id) & (SeenQuestions.level == level),
+        )
+        .filter(UserStats.user_id == user_id)
+        .first()
+    )
+    if progress.question_ids:
+        question_ids = map(int, progress.question_ids.split(","))
+        if loaded:
+            record_seen(db, user_id, level, question_ids, row=loaded.SeenQuestions)
+        else:
+            record_seen(db, user_id, level, question_ids)
+
+    # Обновляем статистику пользователя
+    stats = loaded.UserStats if loaded else None
+    if stats:
+        # Рассчитываем изменение MMR
+        mmr_change = stats.calculate_mmr_change(correct_answers, level)
+        old_mmr = stats.mmr
+        stats.mmr = max(0, stats.mmr + mmr_change)  # MMR не может быть отрицательным
+        new_mmr = stats.mmr  # Сохраняем новый MMR в локальную переменную
+        stats.total_tests += 1
+        stats.last_test_date = datetime.utcnow()
+        record_result(
+            db,
+            user_id,
+            "standard",
+            correct_answers,
+            len(progress.question_ids.split(",")) if progress.question_ids else 0,
+            old_mmr,
+            new_mmr,
+            level=level,
+            duration_seconds=(
+                (stats.last_test_date - progress.started_at).total_seconds()
+                if progress.started_at
+                else None
+            ),
+            summary=loaded.UserSummary,
+        )
 
-        db.commit()
+    db.commit()
+    standard_sessions.finished(user_id)
 
     percentage = (correct_answers / 10) * 100
 
@@ -395,7 +570,7 @@ async def finish_test(
 
 
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with get_db() as db:
+    with get_read_db() as db:
         # Получаем топ-5 пользователей по MMR
         top_users = (
             db.query(UserStats)
@@ -445,12 +620,25 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "   • Нажмите '🎯 Начать тестирование'\n"
         "   • Выберите язык (Java, Python или SQL)\n"
         "   • Выберите уровень сложности\n"
-        "   • Ответьте на 10 вопросов\n\n"
+        "   • Ответьте на 10 вопросов\n"
+        "   • Ошибки вернутся в '🔁 Повторение ошибок' по расписанию\n\n"
         "2. Уровни сложности для каждого языка:\n"
         "   👶 Junior - базовые концепции\n"
         "   👨‍💻 Middle - продвинутые темы\n"
         "   🧙‍♂️ Senior - архитектура и паттерны\n\n"
-        "3. Навигация:\n"
+        "3. Дуэли:\n"
+        "   • '⚔️ Дуэль' - соперник с близким MMR и те же вопросы\n"
+        "   • Очки за правильные ответы и скорость, MMR меняется по итогам\n"
+        "   • /quiz [язык] [уровень] в группе - викторина для всего чата\n"
+        "   • '🗓 Вызов дня' - 10 вопросов, одинаковых для всех, и рейтинг дня\n\n"
+        "4. Свои тесты:\n"
+        "   • '📝 Создать свой тест' - пошагово, вопрос за вопросом\n"
+        "   • '📥 Импорт теста из файла' - сразу весь тест из CSV или JSON\n"
+        "   • /search <запрос> - поиск тестов по названию и вопросам\n"
+        "   • @имя_бота <запрос> в любом чате - поделиться тестом\n\n"
+        "5. Статистика:\n"
+        "   • '📈 Моя статистика' или /stats - точность по языкам, график MMR, последние тесты\n\n"
+        "6. Навигация:\n"
         "   • Кнопка '🏠 Главное меню' доступна везде(кроме процесса тестирования)\n"
         "   • Можно прервать тест в любой момент\n\n"
         "Удачи в изучении программирования! 🚀"
@@ -477,6 +665,8 @@ async def cancel_standard_test(update: Update, context: ContextTypes.DEFAULT_TYP
         if progress:
             progress.is_testing = False
             db.commit()
+    standard_sessions.finished(user_id)
+    cancel_question_timer("standard", user_id)
 
     await query.edit_message_text(
         "Тест отменен. Вы можете выбрать другой тест или вернуться в главное меню.",
@@ -493,6 +683,51 @@ async def cancel_standard_test(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
 
+async def standard_question_timeout(application, user_id: int, payload):
+    """Время на вопрос обычного теста вышло: ответ засчитывается как неправильный"""
+    question_index, message_id = payload
+    context = application.context_types.context(
+        application, chat_id=user_id, user_id=user_id
+    )
+    with get_db() as db:
+        progress = (
+            db.query(UserProgress).filter(UserProgress.user_id == user_id).first()
+        )
+        if (
+            not progress
+            or not progress.is_testing
+            or progress.current_question != question_index
+        ):
+            return  # Пользователь успел ответить или тест уже закончен
+
+        question_ids = list(map(int, progress.question_ids.split(",")))
+        question = (
+            db.query(Question).filter(Question.id == question_ids[question_index]).first()
+        )
+        question_text = await get_question_message(question, progress)
+        correct_answer_text = getattr(question, f"option{question.correct_option}")
+
+        record_miss(db, user_id, question.id)
+        progress.current_question += 1
+        progress.last_answer_time = datetime.utcnow()
+        db.commit()
+
+        try:
+            await context.bot.edit_message_text(
+                chat_id=user_id,
+                message_id=message_id,
+                text=(
+                    f"{question_text}\n\n"
+                    "⏰ Время вышло! Ответ засчитан как неправильный.\n\n"
+                    f"Правильный ответ: {correct_answer_text}"
+                ),
+            )
+        except Exception as e:
+            logging.warning(f"Не удалось обновить просроченный вопрос user_id={user_id}: {e}")
+
+        await send_question(None, context, user_id, db=db, progress=progress)
+
+
 def setup_handlers(application):
     """Настройка обработчиков сообщений"""
     # Обработчик диалога для создания теста
@@ -548,11 +783,25 @@ def setup_handlers(application):
         },
         fallbacks=[CommandHandler("cancel", cancel_creation)],
         per_message=False,  # Используем один обработчик на пользователя
+        name="test_creation",
+        # Черновик теста переживает перезапуск бота
+        persistent=application.persistence is not None,
     )
 
     application.add_handler(conv_handler)  # Добавляем обработчик диалога
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(
+        CommandHandler("reload_questions", reload_questions_command)
+    )
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(
+        CallbackQueryHandler(show_search_page, pattern=r"^search_page_\d+$")
+    )
     application.add_handler(
         CallbackQueryHandler(show_language_selection, pattern="^start_test$")
     )
@@ -564,16 +813,54 @@ def setup_handlers(application):
     )
     application.add_handler(CallbackQueryHandler(handle_answer, pattern="^answer_"))
     application.add_handler(CallbackQueryHandler(main_menu, pattern="^main_menu$"))
+    # Дуэли
+    application.add_handler(CallbackQueryHandler(show_duel_menu, pattern="^duel$"))
+    application.add_handler(
+        CallbackQueryHandler(show_duel_levels, pattern="^duel_lang_")
+    )
+    application.add_handler(
+        CallbackQueryHandler(join_duel_queue, pattern="^duel_level_")
+    )
+    application.add_handler(
+        CallbackQueryHandler(handle_duel_answer, pattern="^duel_answer_")
+    )
+    application.add_handler(
+        CallbackQueryHandler(cancel_duel_search, pattern="^duel_cancel$")
+    )
+    # Вызов дня
+    application.add_handler(CallbackQueryHandler(show_daily, pattern="^daily$"))
+    application.add_handler(CallbackQueryHandler(start_daily, pattern="^daily_start$"))
+    application.add_handler(
+        CallbackQueryHandler(handle_daily_answer, pattern="^daily_answer_")
+    )
+    application.add_handler(CallbackQueryHandler(show_daily_top, pattern="^daily_top$"))
+    # Повторение ошибок
+    application.add_handler(CallbackQueryHandler(show_review_menu, pattern="^review$"))
+    application.add_handler(
+        CallbackQueryHandler(start_review, pattern="^review_start$")
+    )
+    application.add_handler(
+        CallbackQueryHandler(handle_review_answer, pattern="^review_answer_")
+    )
+    application.add_handler(CallbackQueryHandler(stop_review, pattern="^review_stop$"))
+    # Групповые викторины
+    application.add_handler(
+        CommandHandler("quiz", start_group_quiz, filters=filters.ChatType.GROUPS)
+    )
+    application.add_handler(
+        CallbackQueryHandler(handle_group_answer, pattern="^group_answer_")
+    )
     application.add_handler(
         CallbackQueryHandler(show_leaderboard, pattern="^leaderboard$")
     )
+    application.add_handler(CallbackQueryHandler(show_my_stats, pattern="^my_stats$"))
     application.add_handler(CallbackQueryHandler(show_help, pattern="^help$"))
     application.add_handler(
         CallbackQueryHandler(show_test_catalog, pattern="^test_catalog(?:_\d+)?$")
     )  # Добавляем обработчик каталога
     # Добавляем обработчик для запуска кастомного теста
     application.add_handler(
-        CallbackQueryHandler(run_custom_test, pattern="^run_custom_")
+        CallbackQueryHandler(run_custom_test, pattern="^run_(?:custom|test)_")
     )
     # Добавляем обработчик для ответов на кастомный тест
     application.add_handler(
@@ -587,18 +874,140 @@ def setup_handlers(application):
     application.add_handler(
         CallbackQueryHandler(cancel_standard_test, pattern="^cancel_standard_test$")
     )
+    # Импорт кастомного теста из CSV/JSON-документа
+    application.add_handler(
+        CallbackQueryHandler(show_import_help, pattern="^import_test$")
+    )
+    application.add_handler(
+        MessageHandler(
+            filters.Document.ALL & filters.ChatType.PRIVATE, handle_test_document
+        )
+    )
 
+    # Что делать, когда время на вопрос истекло
+    TIMEOUT_HANDLERS["standard"] = standard_question_timeout
+    TIMEOUT_HANDLERS["custom"] = custom_question_timeout
+    TIMEOUT_HANDLERS["duel"] = duel_timeout
+    TIMEOUT_HANDLERS["group"] = group_round_timeout
 
-def main():
-    # Создаем таблицы базы данных
-    create_tables()
+    # Метрики: время, ошибки и SQL-запросы каждого обработчика
+    instrument_handlers(application)
+    application.add_handler(TypeHandler(Update, count_update), group=-1)
 
-    # Инициализируем бота
-    application = Application.builder().token(TOKEN).build()
+
+async def post_init(application: Application):
+    if METRICS_PORT and application.bot_data["standalone"]:
+        application.bot_data["metrics_server"] = await start_metrics_server()
+    # Одна фоновая задача обслуживает дедлайны всех сессий и дуэлей
+    application.bot_data["question_timers"] = asyncio.create_task(
+        run_question_timers(application)
+    )
+    # Вопросы вызова дня держатся в памяти, чтобы его начало не стоило запросов
+    ensure_daily_challenge()
+    # Метрика активных тестов считает их в памяти, начиная с сохраненных в базе
+    standard_sessions.load()
+    # Рассылки, прерванные остановкой бота, продолжаются с сохраненного места
+    resume_broadcasts(application)
+
+
+async def post_shutdown(application: Application):
+    stop_broadcast_tasks()
+    if application.bot_data["standalone"]:
+        stop_backups()
+        stop_maintenance()
+    flush_daily_results()
+    timers_task = application.bot_data.get("question_timers")
+    if timers_task:
+        timers_task.cancel()
+    server = application.bot_data.get("metrics_server")
+    if server:
+        server.close()
+        await server.wait_closed()
+
+
+def build_application(token: str, standalone: bool = True) -> Application:
+    """Собирает Application бота с обработчиками и периодическими задачами.
+
+    standalone=False - бот работает в общем процессе (hosting.py): сервер
+    метрик, резервные копии, обслуживание базы и слежение за банком вопросов
+    относятся ко всему процессу и запускаются hosting.py один раз.
+    """
+    application = (
+        Application.builder()
+        .token(token)
+        .persistence(SQLitePersistence())
+        .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    application.bot_data["standalone"] = standalone
 
     # Настраиваем обработчики
     setup_handlers(application)
 
+    # Периодически завершаем брошенные тесты
+    application.job_queue.run_repeating(
+        reap_sessions, interval=REAP_INTERVAL_SECONDS, first=REAP_INTERVAL_SECONDS
+    )
+
+    # Сводим игроков, ждущих дуэли
+    application.job_queue.run_repeating(
+        match_duel_queue, interval=MATCH_INTERVAL_SECONDS, first=MATCH_INTERVAL_SECONDS
+    )
+
+    # Новый вызов дня в полночь UTC и сохранение его результатов из памяти
+    application.job_queue.run_daily(
+        prepare_daily_challenge, time=dtime(0, 0, tzinfo=timezone.utc)
+    )
+    application.job_queue.run_repeating(
+        checkpoint_daily_results,
+        interval=DAILY_CHECKPOINT_SECONDS,
+        first=DAILY_CHECKPOINT_SECONDS,
+    )
+
+    # Обновляем счетчики ответивших в групповых викторинах
+    application.job_queue.run_repeating(
+        flush_group_tallies, interval=GROUP_TALLY_INTERVAL, first=GROUP_TALLY_INTERVAL
+    )
+
+    if not standalone:
+        return application
+
+    # Перезагружаем банк вопросов, когда меняются его файлы
+    if QUESTION_BANK_WATCH_SECONDS:
+        application.job_queue.run_repeating(
+            watch_question_bank, interval=QUESTION_BANK_WATCH_SECONDS, first=0
+        )
+
+    # Резервные копии базы без остановки бота
+    if BACKUP_INTERVAL_SECONDS and backups_supported():
+        application.job_queue.run_repeating(
+            backup_job, interval=BACKUP_INTERVAL_SECONDS, first=BACKUP_INTERVAL_SECONDS
+        )
+
+    # Перенос старых строк в архив и постепенное освобождение места в файле базы
+    if MAINTENANCE_INTERVAL_SECONDS:
+        application.job_queue.run_repeating(
+            maintenance_job,
+            interval=MAINTENANCE_INTERVAL_SECONDS,
+            first=MAINTENANCE_INTERVAL_SECONDS,
+        )
+
+    return application
+
+
+def main():
+    # Создаем таблицы и заливаем вопросы, если схема или банк вопросов изменились
+    prepare_database()
+
+    # Инициализируем бота
+    for db_engine in {engine, read_engine}:
+        instrument_engine(db_engine)
+        sql_audit.install(db_engine)
+
+    application = build_application(TOKEN)
+
     # Запускаем бота
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
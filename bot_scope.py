@@ -0,0 +1,69 @@
+"""Текущий бот процесса, когда в одном процессе работает несколько ботов (hosting.py).
+
+Бот задается переменной контекста: hosting.py выставляет ее в задаче, в
+которой живет Application, и ее наследуют все задачи бота - обработка
+апдейтов, JobQueue, таймеры и потоки asyncio.to_thread. Без hosting.py
+переменная не выставлена, и все работает как с единственным ботом.
+"""
+
+from contextvars import ContextVar
+
+# database.BotDatabase текущего бота или None (единственный бот процесса)
+current_bot = ContextVar("current_bot", default=None)
+
+
+def current_bot_name() -> str:
+    scope = current_bot.get()
+    return scope.name if scope is not None else ""
+
+
+class BotLocal:
+    """Объект в памяти, у каждого бота процесса свой экземпляр.
+
+    Обращения к атрибутам и элементам передаются экземпляру текущего бота,
+    который создается factory при первом обращении. Так модульные словари
+    и очереди (дуэли, групповые игры, таймеры) не смешиваются между ботами,
+    а код, который ими пользуется, не меняется.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instances", {})
+
+    def current(self):
+        name = current_bot_name()
+        instance = self._instances.get(name)
+        if instance is None:
+            instance = self._instances[name] = self._factory()
+        return instance
+
+    def instances(self):
+        """Экземпляры всех ботов - для метрик процесса"""
+        return list(self._instances.values())
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.current(), name, value)
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __setitem__(self, key, value):
+        self.current()[key] = value
+
+    def __delitem__(self, key):
+        del self.current()[key]
+
+    def __contains__(self, key):
+        return key in self.current()
+
+    def __iter__(self):
+        return iter(self.current())
+
+    def __len__(self):
+        return len(self.current())
+
+    def __bool__(self):
+        return bool(self.current())
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import ContextTypes
+
+from bot_scope import BotLocal
+from database import get_db, Broadcast, UserStats
+from export import ADMIN_IDS
+from metrics import registry, Counter, Gauge
+
+# Сообщений рассылки в секунду. Общий лимит Telegram - около 30 в секунду,
+# запас оставляем для ответов обычным пользователям, которые идут параллельно
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+# Как часто (в секундах) обновляется сообщение с прогрессом у администратора
+BROADCAST_PROGRESS_SECONDS = 10
+# Сколько раз повторять отправку одному пользователю после RetryAfter
+BROADCAST_MAX_RETRIES = 3
+
+# broadcast_id -> asyncio.Task. Одновременно идет не больше одной рассылки
+broadcast_tasks = BotLocal(dict)
+
+broadcast_messages = registry.register(
+    Counter(
+        "quiz_broadcast_messages_total",
+        "Сообщения рассылок по результату отправки",
+        ("result",),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_broadcasts_running",
+        "Идущие рассылки",
+        function=lambda: sum(len(tasks) for tasks in broadcast_tasks.instances()),
+    )
+)
+
+
+def _batch_size() -> int:
+    """Пачка - секунда рассылки: одна выборка получателей и один checkpoint на пачку"""
+    return max(1, math.ceil(BROADCAST_RATE))
+
+
+def _progress_text(broadcast: Broadcast) -> str:
+    processed = broadcast.sent + broadcast.blocked + broadcast.failed
+    status = {
+        "running": "⏳ идет",
+        "done": "✅ завершена",
+        "cancelled": "⛔ остановлена",
+    }.get(broadcast.status, broadcast.status)
+    return (
+        f"📣 Рассылка #{broadcast.id}: {status}\n\n"
+        f"Обработано: {processed} из {broadcast.total}\n"
+        f"Доставлено: {broadcast.sent}\n"
+        f"Заблокировали бота или удалили аккаунт: {broadcast.blocked}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+async def _deliver(bot, user_id: int, text: str) -> str:
+    """Отправляет одно сообщение; возвращает sent, blocked или failed"""
+    for _ in range(BROADCAST_MAX_RETRIES + 1):
+        try:
+            await bot.send_message(chat_id=user_id, text=text)
+            return "sent"
+        except RetryAfter as e:
+            # Telegram просит подождать: ждем и повторяем этому же пользователю
+            logging.warning(f"Рассылка уперлась в лимит, пауза {e.retry_after} сек.")
+            await asyncio.sleep(e.retry_after)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            logging.warning(f"Рассылка: не удалось отправить user_id={user_id}: {e}")
+            return "failed"
+        except Exception as e:
+            logging.warning(f"Рассылка: не удалось отправить user_id={user_id}: {e}")
+            return "failed"
+    return "failed"
+
+
+async def _send_batch(bot, text: str, recipients):
+    """Рассылает пачку с равномерным темпом BROADCAST_RATE: отправки идут
+    параллельно, но каждая стартует в свой момент, поэтому задержка ответа
+    Telegram не снижает темп, а всплесков выше лимита не бывает"""
+    started = time.monotonic()
+
+    async def send(i, user_id):
+        await asyncio.sleep(i / BROADCAST_RATE)
+        return await _deliver(bot, user_id, text)
+
+    results = await asyncio.gather(
+        *(send(i, user_id) for i, (_, user_id) in enumerate(recipients))
+    )
+    # Следующая пачка не должна начаться раньше, чем истечет время этой
+    await asyncio.sleep(max(0.0, started + len(recipients) / BROADCAST_RATE - time.monotonic()))
+    return results
+
+
+def _next_recipients(db, last_stats_id: int, limit: int):
+    """Следующие получатели по ключу (user_stats.id > курсора): страница
+    стоит одинаково в начале и в конце таблицы, в отличие от OFFSET"""
+    return db.execute(
+        select(UserStats.id, UserStats.user_id)
+        .where(UserStats.id > last_stats_id, UserStats.blocked_at.is_(None))
+        .order_by(UserStats.id)
+        .limit(limit)
+    ).all()
+
+
+async def _report(bot, broadcast: Broadcast):
+    if not broadcast.report_chat_id or not broadcast.report_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=broadcast.report_chat_id,
+            message_id=broadcast.report_message_id,
+            text=_progress_text(broadcast),
+        )
+    except Exception as e:
+        logging.warning(f"Не удалось обновить прогресс рассылки #{broadcast.id}: {e}")
+
+
+async def run_broadcast(bot, broadcast_id: int):
+    """Рассылает сообщение пачками, сохраняя курсор после каждой пачки.
+
+    После перезапуска рассылка продолжается с сохраненного курсора: повторно
+    сообщение могут получить только адресаты пачки, прерванной на середине.
+    """
+    batch_size = _batch_size()
+    last_report = time.monotonic()
+    try:
+        while True:
+            with get_db() as db:
+                broadcast = db.get(Broadcast, broadcast_id)
+                if broadcast is None or broadcast.status != "running":
+                    return
+                recipients = _next_recipients(db, broadcast.last_stats_id, batch_size)
+
+            if not recipients:
+                with get_db() as db:
+                    broadcast = db.get(Broadcast, broadcast_id)
+                    broadcast.status = "done"
+                    broadcast.finished_at = datetime.utcnow()
+                    db.commit()
+                logging.info(
+                    f"Рассылка #{broadcast_id} завершена: доставлено {broadcast.sent}, "
+                    f"недоступны {broadcast.blocked}, ошибок {broadcast.failed}"
+                )
+                await _report(bot, broadcast)
+                return
+
+            results = await _send_batch(bot, broadcast.text, recipients)
+
+            now = datetime.utcnow()
+            blocked = [
+                {"id": stats_id, "blocked_at": now}
+                for (stats_id, _), result in zip(recipients, results)
+                if result == "blocked"
+            ]
+            with get_db() as db:
+                broadcast = db.get(Broadcast, broadcast_id)
+                for result in ("sent", "blocked", "failed"):
+                    count = results.count(result)
+                    broadcast_messages.inc(result, amount=count)
+                    setattr(broadcast, result, getattr(broadcast, result) + count)
+                broadcast.last_stats_id = recipients[-1][0]
+                # Недоступных помечаем в той же транзакции, что и курсор
+                if blocked:
+                    db.execute(update(UserStats), blocked)
+                db.commit()
+
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_SECONDS:
+                last_report = time.monotonic()
+                await _report(bot, broadcast)
+    except asyncio.CancelledError:
+        logging.info(f"Рассылка #{broadcast_id} прервана")
+        raise
+    except Exception as e:
+        logging.error(f"Ошибка рассылки #{broadcast_id}: {e}")
+    finally:
+        broadcast_tasks.pop(broadcast_id, None)
+
+
+def _start_task(application, broadcast_id: int):
+    broadcast_tasks[broadcast_id] = asyncio.create_task(
+        run_broadcast(application.bot, broadcast_id)
+    )
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <текст> - рассылка всем пользователям (только для админов),
+    /broadcast status - прогресс последней рассылки, /broadcast stop - остановить"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Рассылка доступна только администраторам.")
+        return
+
+    # Текст берем из сообщения целиком, а не из context.args: так сохраняются переносы строк
+    text = update.message.text.partition(" ")[2].strip()
+    command = text.lower()
+
+    if command in ("status", "stop"):
+        with get_db() as db:
+            broadcast = db.execute(
+                select(Broadcast).order_by(Broadcast.id.desc()).limit(1)
+            ).scalar_one_or_none()
+            if broadcast is None:
+                await update.message.reply_text("Рассылок еще не было.")
+                return
+            if command == "stop" and broadcast.status == "running":
+                broadcast.status = "cancelled"
+                broadcast.finished_at = datetime.utcnow()
+                db.commit()
+                task = broadcast_tasks.pop(broadcast.id, None)
+                if task:
+                    task.cancel()
+                logging.info(f"Администратор {user_id} остановил рассылку #{broadcast.id}")
+        await update.message.reply_text(_progress_text(broadcast))
+        return
+
+    if not text:
+        await update.message.reply_text(
+            "Использование:\n"
+            "/broadcast <текст> - отправить сообщение всем пользователям\n"
+            "/broadcast status - прогресс последней рассылки\n"
+            "/broadcast stop - остановить рассылку"
+        )
+        return
+    if broadcast_tasks:
+        await update.message.reply_text(
+            "⏳ Предыдущая рассылка еще идет. Прогресс: /broadcast status"
+        )
+        return
+
+    with get_db() as db:
+        total = db.execute(
+            select(func.count(UserStats.id)).where(UserStats.blocked_at.is_(None))
+        ).scalar()
+        broadcast = Broadcast(text=text, created_by=user_id, total=total)
+        db.add(broadcast)
+        db.commit()
+        report = await update.message.reply_text(_progress_text(broadcast))
+        broadcast.report_chat_id = report.chat_id
+        broadcast.report_message_id = report.message_id
+        db.commit()
+
+    logging.info(
+        f"Администратор {user_id} начал рассылку #{broadcast.id} на {total} пользователей"
+    )
+    _start_task(context.application, broadcast.id)
+
+
+def stop_broadcast_tasks():
+    """Прерывает рассылки при остановке бота; в базе они остаются running"""
+    for task in list(broadcast_tasks.values()):
+        task.cancel()
+
+
+def resume_broadcasts(application):
+    """Продолжает рассылки, прерванные остановкой бота (вызывается в post_init)"""
+    with get_db() as db:
+        broadcast_ids = db.execute(
+            select(Broadcast.id).where(Broadcast.status == "running")
+        ).scalars().all()
+    for broadcast_id in broadcast_ids:
+        logging.info(f"Продолжаем рассылку #{broadcast_id} после перезапуска")
+        _start_task(application, broadcast_id)
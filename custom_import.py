@@ -0,0 +1,324 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from custom_tests import add_custom_test, register_custom_test
+
+# Ограничения на загружаемый файл
+MAX_IMPORT_BYTES = 1024 * 1024
+MAX_IMPORT_QUESTIONS = 200
+MAX_TEST_NAME_LENGTH = 100
+MAX_QUESTION_LENGTH = 1000
+MAX_OPTION_LENGTH = 200
+# Сколько ошибок в строках показываем автору (остальные только считаем)
+MAX_REPORTED_ERRORS = 15
+
+SUPPORTED_EXTENSIONS = (".csv", ".json", ".jsonl")
+QUESTION_FIELDS = ("text", "option1", "option2", "option3", "option4", "correct_option")
+# Допустимые альтернативные названия колонок CSV
+_CSV_ALIASES = {"question": "text", "вопрос": "text", "correct": "correct_option"}
+
+_CHUNK_SIZE = 16 * 1024
+# Один вопрос в JSON не может быть длиннее этого (защита от бесконечного буфера)
+_MAX_ITEM_CHARS = 16 * 1024
+
+
+class CustomImportError(Exception):
+    """Файл нельзя импортировать целиком (формат, размер, число вопросов)"""
+
+
+class _LimitedReader(io.RawIOBase):
+    """Поток байтов, который обрывает чтение после лимита размера"""
+
+    def __init__(self, raw, limit: int):
+        self._raw = raw
+        self._limit = limit
+        self._read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._raw.readinto(buffer)
+        self._read += count or 0
+        if self._read > self._limit:
+            raise CustomImportError(
+                f"Файл больше {MAX_IMPORT_BYTES // 1024} КБ"
+            )
+        return count
+
+
+def _open_text(raw) -> io.TextIOWrapper:
+    limited = io.BufferedReader(_LimitedReader(raw, MAX_IMPORT_BYTES))
+    # utf-8-sig убирает BOM, который добавляет Excel
+    return io.TextIOWrapper(limited, encoding="utf-8-sig", newline="")
+
+
+def _iter_csv_rows(stream):
+    header_line = stream.readline()
+    if not header_line.strip():
+        raise CustomImportError("Файл пуст")
+    # Excel в русской локали сохраняет CSV через точку с запятой
+    delimiter = ";" if header_line.count(";") > header_line.count(",") else ","
+    reader = csv.reader(itertools.chain([header_line], stream), delimiter=delimiter)
+
+    header = [
+        _CSV_ALIASES.get(column.strip().lower(), column.strip().lower())
+        for column in next(reader)
+    ]
+    missing = [field for field in QUESTION_FIELDS if field not in header]
+    if missing:
+        raise CustomImportError(f"В заголовке CSV нет колонок: {', '.join(missing)}")
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield f"строка {reader.line_num}", dict(zip(header, row))
+
+
+def _iter_json_lines(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield f"строка {line_number}", json.loads(line)
+        except json.JSONDecodeError as e:
+            yield f"строка {line_number}", CustomImportError(f"некорректный JSON: {e.msg}")
+
+
+def _iter_json_array(stream):
+    """Разбирает JSON-массив по одному элементу, не читая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+
+    def skip_whitespace():
+        nonlocal buffer, eof
+        buffer = buffer.lstrip()
+        while not buffer and not eof:
+            chunk = stream.read(_CHUNK_SIZE)
+            eof = not chunk
+            buffer = chunk.lstrip()
+
+    skip_whitespace()
+    if not buffer.startswith("["):
+        raise CustomImportError("JSON должен быть массивом вопросов")
+    buffer = buffer[1:]
+
+    index = 0
+    while True:
+        skip_whitespace()
+        if not buffer:
+            raise CustomImportError("JSON оборван: нет закрывающей скобки ]")
+        if buffer[0] == "]":
+            return
+        if index:
+            if buffer[0] != ",":
+                raise CustomImportError(f"Ожидалась запятая после вопроса #{index}")
+            buffer = buffer[1:]
+            skip_whitespace()
+
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer)
+                break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise CustomImportError(
+                        f"Некорректный JSON в вопросе #{index + 1}: {e.msg}"
+                    )
+                if len(buffer) > _MAX_ITEM_CHARS:
+                    raise CustomImportError(f"Вопрос #{index + 1} слишком большой")
+                chunk = stream.read(_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+
+        index += 1
+        buffer = buffer[end:]
+        yield f"вопрос #{index}", item
+
+
+def validate_question(raw):
+    """Проверяет один вопрос из файла. Возвращает (вопрос, None) или (None, ошибка)"""
+    if isinstance(raw, CustomImportError):
+        return None, str(raw)
+    if not isinstance(raw, dict):
+        return None, "ожидается объект с полями вопроса"
+
+    missing = [field for field in QUESTION_FIELDS if raw.get(field) in (None, "")]
+    if missing:
+        return None, f"не заполнены поля: {', '.join(missing)}"
+
+    question = {}
+    for field in QUESTION_FIELDS[:-1]:
+        value = str(raw[field]).strip()
+        limit = MAX_QUESTION_LENGTH if field == "text" else MAX_OPTION_LENGTH
+        if not value:
+            return None, f"поле {field} пустое"
+        if len(value) > limit:
+            return None, f"поле {field} длиннее {limit} символов"
+        question[field] = value
+    if len(question["text"]) < 5:
+        return None, "текст вопроса должен быть не менее 5 символов"
+
+    try:
+        correct_option = int(str(raw["correct_option"]).strip())
+    except ValueError:
+        correct_option = None
+    if correct_option not in (1, 2, 3, 4):
+        return None, "correct_option должен быть числом от 1 до 4"
+    question["correct_option"] = correct_option
+    return question, None
+
+
+def parse_test_document(raw, extension: str):
+    """Потоково разбирает файл с вопросами.
+
+    Возвращает (вопросы, ошибки), где ошибки - список строк с указанием места
+    в файле. Превышение лимитов размера и числа вопросов прерывает разбор
+    сразу, через CustomImportError.
+    """
+    stream = _open_text(raw)
+    try:
+        if extension == ".csv":
+            rows = _iter_csv_rows(stream)
+        elif extension == ".jsonl":
+            rows = _iter_json_lines(stream)
+        else:
+            rows = _iter_json_array(stream)
+
+        questions, errors = [], []
+        for count, (where, item) in enumerate(rows, 1):
+            if count > MAX_IMPORT_QUESTIONS:
+                raise CustomImportError(
+                    f"В файле больше {MAX_IMPORT_QUESTIONS} вопросов"
+                )
+            question, error = validate_question(item)
+            if error:
+                errors.append(f"{where}: {error}")
+            else:
+                questions.append(question)
+        return questions, errors
+    except UnicodeDecodeError:
+        raise CustomImportError("Файл должен быть в кодировке UTF-8")
+    except csv.Error as e:
+        raise CustomImportError(f"Некорректный CSV: {e}")
+
+
+# --- Обработчики ---
+
+
+IMPORT_HELP_TEXT = (
+    "📥 Импорт теста из файла\n\n"
+    "Отправьте боту документ .csv, .json или .jsonl. Название теста берется из "
+    "подписи к файлу, а если ее нет - из имени файла.\n\n"
+    "CSV - первая строка заголовок:\n"
+    "text,option1,option2,option3,option4,correct_option\n"
+    "Что выведет print(2**3)?,6,8,9,5,2\n\n"
+    "JSON - массив объектов с теми же полями, JSONL - по объекту на строку.\n\n"
+    f"Ограничения: до {MAX_IMPORT_QUESTIONS} вопросов и {MAX_IMPORT_BYTES // 1024} КБ, "
+    "correct_option - номер правильного варианта от 1 до 4."
+)
+
+
+async def show_import_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает формат файла для импорта теста"""
+    await update.callback_query.answer()
+    await update.callback_query.edit_message_text(
+        IMPORT_HELP_TEXT,
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
+        ),
+    )
+
+
+async def handle_test_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импортирует кастомный тест из присланного документа одной транзакцией"""
+    message = update.message
+    document = message.document
+    user_id = message.from_user.id
+    username = message.from_user.username or f"User_{user_id}"
+
+    file_name = document.file_name or ""
+    stem, extension = os.path.splitext(file_name)
+    extension = extension.lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        await message.reply_text(
+            "Для импорта теста нужен файл .csv, .json или .jsonl. "
+            "Формат описан в разделе '📥 Импорт теста из файла' главного меню."
+        )
+        return
+
+    # Размер известен до скачивания: слишком большой файл даже не загружаем
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await message.reply_text(
+            f"❌ Файл слишком большой: максимум {MAX_IMPORT_BYTES // 1024} КБ."
+        )
+        return
+
+    test_name = (message.caption or stem).strip()
+    if len(test_name) < 3 or len(test_name) > MAX_TEST_NAME_LENGTH:
+        await message.reply_text(
+            f"❌ Название теста должно быть от 3 до {MAX_TEST_NAME_LENGTH} символов. "
+            "Укажите его в подписи к файлу."
+        )
+        return
+
+    telegram_file = await document.get_file()
+    raw = io.BytesIO()
+    await telegram_file.download_to_memory(raw)
+    raw.seek(0)
+
+    try:
+        questions, errors = parse_test_document(raw, extension)
+    except CustomImportError as e:
+        await message.reply_text(f"❌ Не удалось импортировать тест: {e}")
+        return
+
+    if errors:
+        report = "\n".join(f"• {error}" for error in errors[:MAX_REPORTED_ERRORS])
+        if len(errors) > MAX_REPORTED_ERRORS:
+            report += f"\n... и еще {len(errors) - MAX_REPORTED_ERRORS}"
+        await message.reply_text(
+            f"❌ В файле {len(errors)} ошибок, тест не сохранен. "
+            f"Исправьте их и отправьте файл снова:\n\n{report}"
+        )
+        return
+
+    if not questions:
+        await message.reply_text("❌ В файле нет ни одного вопроса.")
+        return
+
+    test_data = {
+        "name": test_name,
+        "author_id": user_id,
+        "author_username": username,
+        "questions": questions,
+    }
+    try:
+        test_data["id"] = add_custom_test(test_data)
+    except Exception as e:
+        logging.error(f"Ошибка при импорте теста пользователя {user_id}: {e}")
+        await message.reply_text("❌ Не удалось сохранить тест. Попробуйте позже.")
+        return
+
+    register_custom_test(test_data)
+    logging.info(
+        f"Пользователь {user_id} импортировал тест '{test_name}' "
+        f"из {len(questions)} вопросов"
+    )
+    await message.reply_text(
+        f"🎉 Тест '{test_name}' импортирован! В нем {len(questions)} вопросов.",
+        reply_markup=InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("📚 Каталог тестов", callback_data="test_catalog")],
+                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
+            ]
+        ),
+    )
@@ -8,10 +8,17 @@ from telegram import (
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler
 import json
 import os
+import time
 from datetime import datetime
 
 # Импортируем get_db_session и UserStats из database.py
+from sqlalchemy import insert
+from sqlalchemy.orm import selectinload
+
 from database import get_db, UserStats, CustomTest, CustomQuestion
+from history import record_result
+from sessions import session_tracker, estimate_state_size, is_session_expired
+from timers import QUESTION_TIME_LIMIT, cancel_question_timer, start_question_timer
 
 # Импортируем main_menu из bot.py
 # Это может создать цикл импорта, если bot.py тоже импортирует что-то из custom_tests.py
@@ -37,35 +44,56 @@ TESTS_PER_PAGE = 5
 # --- Функции для работы с хранилищем тестов ---
 
 
+def _question_to_dict(question):
+    return {
+        "text": question.question_text,
+        "option1": question.option1,
+        "option2": question.option2,
+        "option3": question.option3,
+        "option4": question.option4,
+        "correct_option": question.correct_option,
+    }
+
+
+def _question_rows(test_id, questions):
+    """Строки для массовой вставки вопросов теста через executemany"""
+    return [
+        {
+            "test_id": test_id,
+            "question_text": question_data.get("text", ""),
+            "option1": question_data.get("option1", ""),
+            "option2": question_data.get("option2", ""),
+            "option3": question_data.get("option3", ""),
+            "option4": question_data.get("option4", ""),
+            "correct_option": question_data.get("correct_option", 1),
+        }
+        for question_data in questions
+    ]
+
+
 def load_custom_tests():
     """Загружает тесты из базы данных и группирует их по user_id"""
     tests_data = {}
 
     with get_db() as db:
-        # Получаем все тесты
-        all_tests = db.query(CustomTest).all()
+        # Вопросы всех тестов загружаются одним дополнительным запросом
+        all_tests = (
+            db.query(CustomTest)
+            .options(selectinload(CustomTest.questions))
+            .order_by(CustomTest.id)
+            .all()
+        )
 
         for test in all_tests:
             # Преобразуем объект теста в словарь
             test_dict = {
+                "id": test.id,
                 "name": test.name,
                 "author_id": test.author_id,
                 "author_username": test.author_username,
-                "questions": [],
+                "questions": [_question_to_dict(q) for q in test.questions],
             }
 
-            # Получаем все вопросы для теста
-            for question in test.questions:
-                question_dict = {
-                    "text": question.question_text,
-                    "option1": question.option1,
-                    "option2": question.option2,
-                    "option3": question.option3,
-                    "option4": question.option4,
-                    "correct_option": question.correct_option,
-                }
-                test_dict["questions"].append(question_dict)
-
             # Добавляем тест в словарь, группируя по user_id
             if test.author_id not in tests_data:
                 tests_data[test.author_id] = []
@@ -74,43 +102,58 @@ def load_custom_tests():
     return tests_data
 
 
+def add_custom_test(test_data):
+    """Сохраняет один новый тест и его вопросы, возвращает ID теста"""
+    with get_db() as db:
+        new_test = CustomTest(
+            name=test_data["name"],
+            author_id=test_data["author_id"],
+            author_username=test_data.get("author_username"),
+        )
+        db.add(new_test)
+        db.flush()  # Чтобы получить ID
+
+        questions = _question_rows(new_test.id, test_data.get("questions", []))
+        if questions:
+            db.execute(insert(CustomQuestion), questions)
+        db.commit()
+        return new_test.id
+
+
 def save_custom_tests(tests_data):
     """Сохраняет тесты в базу данных"""
     with get_db() as db:
-        # Для каждого пользователя
-        for author_id, tests in tests_data.items():
-            # Проверяем, существует ли автор
-            author_exists = (
-                db.query(UserStats).filter(UserStats.user_id == author_id).first()
+        author_ids = list(tests_data.keys())
+        # Авторов и существующие тесты получаем по одному запросу на всех
+        usernames = dict(
+            db.query(UserStats.user_id, UserStats.username).filter(
+                UserStats.user_id.in_(author_ids)
             )
-            author_username = (
-                author_exists.username if author_exists else f"User_{author_id}"
+        )
+        existing_tests = {
+            (test.author_id, test.name): test
+            for test in db.query(CustomTest).filter(
+                CustomTest.author_id.in_(author_ids)
             )
+        }
+
+        question_rows = []
+        replaced_test_ids = []
+        # Для каждого пользователя
+        for author_id, tests in tests_data.items():
+            author_username = usernames.get(author_id) or f"User_{author_id}"
 
             # Для каждого теста пользователя
             for test_data in tests:
-                # Проверяем, существует ли тест с таким именем у данного пользователя
-                existing_test = (
-                    db.query(CustomTest)
-                    .filter(
-                        CustomTest.author_id == author_id,
-                        CustomTest.name == test_data["name"],
-                    )
-                    .first()
-                )
+                existing_test = existing_tests.get((author_id, test_data["name"]))
 
                 if existing_test:
-                    # Если тест существует, обновляем его имя
-                    existing_test.name = test_data["name"]
+                    # Если тест существует, обновляем автора
                     existing_test.author_username = test_data.get(
                         "author_username", author_username
                     )
-
-                    # Удаляем существующие вопросы (они будут пересозданы)
-                    db.query(CustomQuestion).filter(
-                        CustomQuestion.test_id == existing_test.id
-                    ).delete()
-
+                    # Существующие вопросы будут пересозданы
+                    replaced_test_ids.append(existing_test.id)
                     test_id = existing_test.id
                 else:
                     # Создаем новый тест
@@ -125,26 +168,67 @@ def save_custom_tests(tests_data):
                     db.flush()  # Чтобы получить ID
 
                     test_id = new_test.id
+                    existing_tests[(author_id, test_data["name"])] = new_test
 
-                # Добавляем вопросы
-                for question_data in test_data.get("questions", []):
-                    new_question = CustomQuestion(
-                        test_id=test_id,
-                        question_text=question_data.get("text", ""),
-                        option1=question_data.get("option1", ""),
-                        option2=question_data.get("option2", ""),
-                        option3=question_data.get("option3", ""),
-                        option4=question_data.get("option4", ""),
-                        correct_option=question_data.get("correct_option", 1),
-                    )
-                    db.add(new_question)
+                test_data["id"] = test_id
+                question_rows.extend(
+                    _question_rows(test_id, test_data.get("questions", []))
+                )
+
+        if replaced_test_ids:
+            db.query(CustomQuestion).filter(
+                CustomQuestion.test_id.in_(replaced_test_ids)
+            ).delete(synchronize_session=False)
+        if question_rows:
+            db.execute(insert(CustomQuestion), question_rows)
 
         db.commit()
 
 
 # Глобальный словарь для хранения всех кастомных тестов (user_id -> list of tests)
-# Загружаем тесты при старте
-custom_tests_storage = load_custom_tests()
+# Заполняется при первом обращении к каталогу, а не при импорте модуля
+custom_tests_storage = {}
+# Те же тесты по ID из базы (для поиска и ссылок на конкретный тест)
+custom_tests_by_id = {}
+_storage_loaded = False
+# Растет при каждом изменении каталога: по ней производные индексы
+# (например, инлайн-поиск) понимают, что их пора перестроить
+catalog_version = 0
+
+
+def get_custom_tests_storage():
+    """Возвращает каталог тестов, при первом вызове загружая его из базы"""
+    global _storage_loaded
+    if not _storage_loaded:
+        custom_tests_storage.update(load_custom_tests())
+        for tests in custom_tests_storage.values():
+            for test in tests:
+                custom_tests_by_id[test["id"]] = test
+        _storage_loaded = True
+    return custom_tests_storage
+
+
+def reload_custom_tests():
+    """Перечитывает каталог из базы (например, после массовой записи в обход бота)"""
+    global _storage_loaded, catalog_version
+    custom_tests_storage.clear()
+    custom_tests_by_id.clear()
+    _storage_loaded = False
+    catalog_version += 1
+    return get_custom_tests_storage()
+
+
+def register_custom_test(test_data):
+    """Добавляет в каталог тест, уже сохраненный в базе (с заполненным id)"""
+    global catalog_version
+    get_custom_tests_storage().setdefault(test_data["author_id"], []).append(test_data)
+    custom_tests_by_id[test_data["id"]] = test_data
+    catalog_version += 1
+
+
+def find_custom_test(test_id: int):
+    get_custom_tests_storage()
+    return custom_tests_by_id.get(test_id)
 
 
 # --- Обработчики для ConversationHandler ---
@@ -384,13 +468,11 @@ async def finish_test_creation(
     new_test_data["author_id"] = user_id
     new_test_data["author_username"] = username
 
-    # Добавляем тест в хранилище
-    if user_id not in custom_tests_storage:
-        custom_tests_storage[user_id] = []
-    custom_tests_storage[user_id].append(new_test_data)
+    # Сохраняем только новый тест, а не все хранилище
+    new_test_data["id"] = add_custom_test(new_test_data)
 
-    # Сохраняем все тесты в файл
-    save_custom_tests(custom_tests_storage)
+    # Добавляем тест в хранилище
+    register_custom_test(new_test_data)
 
     await update.callback_query.edit_message_text(
         f"🎉 Тест '{new_test_data['name']}' успешно создан и сохранен! В нем {len(new_test_data['questions'])} вопросов.",
@@ -465,7 +547,7 @@ async def show_test_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Собираем все тесты в один список
     all_tests_flat = []
-    for author_id, tests in custom_tests_storage.items():
+    for author_id, tests in get_custom_tests_storage().items():
         for index, test in enumerate(tests):
             test_info = test.copy()  # Копируем, чтобы добавить author_id и index
             test_info["author_id"] = author_id
@@ -541,6 +623,51 @@ async def show_test_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Обработчик для запуска кастомного теста ---
 
 
+def _begin_custom_test(context, user_id: int, test_data):
+    """Инициализирует состояние кастомного теста в user_data"""
+    questions = test_data.get("questions", [])
+    context.user_data["custom_test"] = {
+        "name": test_data.get("name", "Без названия"),
+        "test_id": test_data.get("id"),
+        "questions": questions,
+        "current_question_index": 0,
+        "correct_answers": 0,
+        "total_questions": len(questions),
+        "last_activity": time.time(),
+        "started_at": time.time(),
+    }
+    test_state = context.user_data["custom_test"]
+    session_tracker.touch(
+        context.application,
+        user_id,
+        test_state["last_activity"],
+        size=estimate_state_size(test_state),
+    )
+
+
+async def start_linked_test(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, test_id: int
+):
+    """Запускает тест по ссылке /start test_<id> (например, из инлайн-сообщения)"""
+    user_id = update.effective_user.id
+    test_data = find_custom_test(test_id)
+    if test_data is None or not test_data.get("questions"):
+        await update.message.reply_text(
+            "❌ Тест по этой ссылке не найден. Возможно, он был удален.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("📚 Каталог тестов", callback_data="test_catalog")]]
+            ),
+        )
+        return
+
+    _begin_custom_test(context, user_id, test_data)
+    await update.message.reply_text(
+        f"📚 Начинаем кастомный тест '{test_data.get('name', 'Без названия')}'!\n"
+        f"Всего вопросов: {len(test_data['questions'])}. Удачи! 🍀"
+    )
+    await send_custom_question(update, context, user_id)
+
+
 async def run_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Инициализирует и запускает кастомный тест."""
     query = update.callback_query
@@ -549,12 +676,18 @@ async def run_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
 
     try:
-        _, _, author_id_str, test_index_str = callback_data.split("_")
-        author_id = int(author_id_str)
-        test_index = int(test_index_str)
+        if callback_data.startswith("run_test_"):
+            # Ссылка на тест по ID (из поиска)
+            test_data = find_custom_test(int(callback_data.split("_")[2]))
+            if test_data is None:
+                raise KeyError(callback_data)
+        else:
+            _, _, author_id_str, test_index_str = callback_data.split("_")
+            author_id = int(author_id_str)
+            test_index = int(test_index_str)
 
-        # Находим тест в хранилище
-        test_data = custom_tests_storage.get(author_id, [])[test_index]
+            # Находим тест в хранилище
+            test_data = get_custom_tests_storage().get(author_id, [])[test_index]
         test_name = test_data.get("name", "Без названия")
         questions = test_data.get("questions", [])
 
@@ -573,14 +706,7 @@ async def run_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Инициализируем состояние теста в user_data
-        context.user_data["custom_test"] = {
-            "name": test_name,
-            "questions": questions,
-            "current_question_index": 0,
-            "correct_answers": 0,
-            "total_questions": len(questions),
-        }
+        _begin_custom_test(context, user_id, test_data)
 
         await query.edit_message_text(
             f"📚 Начинаем кастомный тест '{test_name}'!\n"
@@ -606,6 +732,18 @@ async def run_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+def _custom_question_text(question_data, index: int, total_questions: int) -> str:
+    return (
+        f"❓ Вопрос {index + 1}/{total_questions}:\n\n"
+        f"{question_data['text']}\n\n"
+        f"Варианты ответов:\n"
+        f"1️⃣ {question_data['option1']}\n"
+        f"2️⃣ {question_data['option2']}\n"
+        f"3️⃣ {question_data['option3']}\n"
+        f"4️⃣ {question_data['option4']}"
+    )
+
+
 async def send_custom_question(
     update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int
 ):
@@ -629,32 +767,27 @@ async def send_custom_question(
     question_data = test_state["questions"][current_index]
 
     # Формируем текст вопроса
-    question_text = (
-        f"❓ Вопрос {current_index + 1}/{total_questions}:\n\n"
-        f"{question_data['text']}\n\n"
-        f"Варианты ответов:\n"
-        f"1️⃣ {question_data['option1']}\n"
-        f"2️⃣ {question_data['option2']}\n"
-        f"3️⃣ {question_data['option3']}\n"
-        f"4️⃣ {question_data['option4']}"
-    )
+    question_text = _custom_question_text(question_data, current_index, total_questions)
+    if QUESTION_TIME_LIMIT:
+        question_text += f"\n\n⏱ На ответ {QUESTION_TIME_LIMIT} сек."
 
-    # Формируем кнопки ответов
+    # Формируем кнопки ответов (с номером вопроса, см. handle_custom_answer)
     keyboard = [
         [
-            InlineKeyboardButton("1️⃣", callback_data="custom_answer_1"),
-            InlineKeyboardButton("2️⃣", callback_data="custom_answer_2"),
-            InlineKeyboardButton("3️⃣", callback_data="custom_answer_3"),
-            InlineKeyboardButton("4️⃣", callback_data="custom_answer_4"),
+            InlineKeyboardButton("1️⃣", callback_data=f"custom_answer_1_{current_index}"),
+            InlineKeyboardButton("2️⃣", callback_data=f"custom_answer_2_{current_index}"),
+            InlineKeyboardButton("3️⃣", callback_data=f"custom_answer_3_{current_index}"),
+            InlineKeyboardButton("4️⃣", callback_data=f"custom_answer_4_{current_index}"),
         ],
         [InlineKeyboardButton("❌ Отменить тест", callback_data="cancel_custom_test")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Отправляем вопрос новым сообщением
-    await context.bot.send_message(
+    message = await context.bot.send_message(
         chat_id=user_id, text=question_text, reply_markup=reply_markup
     )
+    start_question_timer("custom", user_id, (current_index, message.message_id))
 
 
 async def handle_custom_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -662,9 +795,14 @@ async def handle_custom_answer(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    selected_option = int(query.data.split("_")[2])  # custom_answer_X
+    parts = query.data.split("_")  # custom_answer_X_<номер вопроса>
+    selected_option = int(parts[2])
 
     test_state = context.user_data.get("custom_test")
+    if test_state and is_session_expired(test_state):
+        # Состояние пережило перезапуск, но сессия давно брошена
+        del context.user_data["custom_test"]
+        test_state = None
     if not test_state:
         logging.warning(
             f"Получен ответ на кастомный тест без состояния теста для user_id={user_id}"
@@ -680,21 +818,17 @@ async def handle_custom_answer(update: Update, context: ContextTypes.DEFAULT_TYP
         logging.warning(f"Получен лишний ответ на кастомный тест для user_id={user_id}")
         await query.edit_message_text("Тест уже завершен.")
         return  # Тест уже завершен
+    if len(parts) > 3 and int(parts[3]) != current_index:
+        return  # Ответ на вопрос, время на который уже вышло
+    cancel_question_timer("custom", user_id)
 
     question_data = test_state["questions"][current_index]
     correct_option = question_data["correct_option"]
     is_correct = selected_option == correct_option
 
     # Формируем текст вопроса для обратной связи
-    total_questions = test_state["total_questions"]
-    question_text_feedback = (
-        f"❓ Вопрос {current_index + 1}/{total_questions}:\n\n"
-        f"{question_data['text']}\n\n"
-        f"Варианты ответов:\n"
-        f"1️⃣ {question_data['option1']}\n"
-        f"2️⃣ {question_data['option2']}\n"
-        f"3️⃣ {question_data['option3']}\n"
-        f"4️⃣ {question_data['option4']}"
+    question_text_feedback = _custom_question_text(
+        question_data, current_index, test_state["total_questions"]
     )
 
     # Формируем обратную связь
@@ -724,6 +858,14 @@ async def handle_custom_answer(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Переходим к следующему вопросу
     test_state["current_question_index"] += 1
+    test_state["last_activity"] = time.time()
+    session_tracker.touch(
+        context.application,
+        user_id,
+        test_state["last_activity"],
+        # Тест, восстановленный из персистентности, трекер видит впервые
+        size=None if user_id in session_tracker else estimate_state_size(test_state),
+    )
     await send_custom_question(update, context, user_id)
 
 
@@ -741,7 +883,9 @@ async def finish_custom_test(
     correct_answers = test_state["correct_answers"]
     total_questions = test_state["total_questions"]
     test_name = test_state["name"]
-    username = update.effective_user.username or f"User_{user_id}"
+    # При истечении времени на последний вопрос апдейта нет
+    user = update.effective_user if update else None
+    username = (user.username if user else None) or f"User_{user_id}"
 
     percentage = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
 
@@ -769,8 +913,22 @@ async def finish_custom_test(
                 )  # MMR не может быть отрицательным
                 stats.total_tests += 1
                 stats.last_test_date = datetime.utcnow()
-                stats.username = username  # Обновляем имя пользователя на всякий случай
+                if user:
+                    stats.username = username  # Обновляем имя пользователя на всякий случай
                 new_mmr = stats.mmr
+                started_at = test_state.get("started_at")
+                record_result(
+                    db,
+                    user_id,
+                    "custom",
+                    correct_answers,
+                    total_questions,
+                    old_mmr,
+                    new_mmr,
+                    custom_test_id=test_state.get("test_id"),
+                    name=test_name,
+                    duration_seconds=time.time() - started_at if started_at else None,
+                )
                 db.commit()
 
                 # Формируем текст об изменении MMR
@@ -807,7 +965,7 @@ async def finish_custom_test(
     # Сначала отправляем сообщение с результатами
     # Используем исходный query для отправки ответа, если он есть
     final_message_target = (
-        update.callback_query.message if update.callback_query else None
+        update.callback_query.message if update and update.callback_query else None
     )
     try:
         if final_message_target:
@@ -836,6 +994,8 @@ async def finish_custom_test(
     # Очищаем состояние теста из user_data
     if "custom_test" in context.user_data:
         del context.user_data["custom_test"]
+    session_tracker.forget(user_id)
+    cancel_question_timer("custom", user_id)
 
 
 async def cancel_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -847,6 +1007,8 @@ async def cancel_custom_test(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Очищаем состояние теста из user_data
     if "custom_test" in context.user_data:
         del context.user_data["custom_test"]
+    session_tracker.forget(user_id)
+    cancel_question_timer("custom", user_id)
 
     await query.edit_message_text(
         "Тест отменен. Вы можете выбрать другой тест или вернуться в главное меню.",
@@ -883,3 +1045,47 @@ async def cancel_test_creation(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     
     return ConversationHandler.END
+
+
+async def custom_question_timeout(application, user_id: int, payload):
+    """Время на вопрос кастомного теста вышло: ответ засчитывается как неправильный"""
+    question_index, message_id = payload
+    context = application.context_types.context(
+        application, chat_id=user_id, user_id=user_id
+    )
+    test_state = context.user_data.get("custom_test")
+    if not test_state or test_state["current_question_index"] != question_index:
+        return  # Пользователь успел ответить или тест уже закончен
+
+    question_data = test_state["questions"][question_index]
+    test_state["current_question_index"] += 1
+    test_state["last_activity"] = time.time()
+    session_tracker.touch(
+        application,
+        user_id,
+        test_state["last_activity"],
+        # Тест, восстановленный из персистентности, трекер видит впервые
+        size=None if user_id in session_tracker else estimate_state_size(test_state),
+    )
+    # Изменение пришло не из апдейта, поэтому о нем сообщаем персистентности сами
+    application.mark_data_for_update_persistence(user_ids=user_id)
+
+    correct_answer_text = question_data.get(
+        f"option{question_data['correct_option']}", "Неизвестный вариант"
+    )
+    try:
+        await context.bot.edit_message_text(
+            chat_id=user_id,
+            message_id=message_id,
+            text=(
+                _custom_question_text(
+                    question_data, question_index, test_state["total_questions"]
+                )
+                + "\n\n⏰ Время вышло! Ответ засчитан как неправильный.\n\n"
+                f"Правильный ответ: {correct_answer_text}"
+            ),
+        )
+    except Exception as e:
+        logging.warning(f"Не удалось обновить просроченный вопрос user_id={user_id}: {e}")
+
+    await send_custom_question(None, context, user_id)
@@ -0,0 +1,372 @@
+import bisect
+import logging
+import random
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from bot_scope import BotLocal
+from database import get_db, DailyChallenge, DailyResult, Question
+from metrics import registry, Gauge
+
+# Вопросов в вызове дня
+DAILY_QUESTIONS = 10
+# Как часто результаты из памяти сохраняются в базу
+DAILY_CHECKPOINT_SECONDS = 30
+# Сколько строк показывает рейтинг дня
+DAILY_TOP_SIZE = 10
+
+LANGUAGE_NAMES = {"java": "Java", "python": "Python", "sql": "SQL"}
+
+# state.challenge - вызов текущего дня (у каждого бота процесса свой);
+# заменяется задачей prepare_daily_challenge в полночь UTC
+state = BotLocal(lambda: SimpleNamespace(challenge=None))
+
+registry.register(
+    Gauge(
+        "quiz_daily_participants",
+        "Участники вызова дня, завершившие попытку",
+        function=lambda: sum(
+            len(bot_state.challenge.results)
+            for bot_state in state.instances()
+            if bot_state.challenge
+        ),
+    )
+)
+
+
+class ChallengeDay:
+    """Вопросы и рейтинг вызова одного дня в памяти.
+
+    Рейтинг - отсортированный список ключей (-верных, время, user_id):
+    новый результат вставляется bisect-ом, место пользователя ищется за
+    O(log n), топ - срез начала списка. Результаты, еще не сохраненные в
+    базу, копятся в pending и пишутся пачкой задачей checkpoint_daily_results.
+    """
+
+    def __init__(self, day: str, questions):
+        self.day = day
+        self.questions = questions
+        self.results = {}  # user_id -> (верных, секунд, имя)
+        self._ranking = []
+        self.pending = []
+
+    def add_result(
+        self, user_id: int, username: str, correct: int, duration: float, saved=False
+    ):
+        if user_id in self.results:
+            return
+        self.results[user_id] = (correct, duration, username)
+        bisect.insort(self._ranking, (-correct, duration, user_id))
+        if not saved:
+            self.pending.append(user_id)
+
+    def rank(self, user_id: int) -> int:
+        correct, duration, _ = self.results[user_id]
+        return bisect.bisect_left(self._ranking, (-correct, duration, user_id)) + 1
+
+    def top(self, size: int):
+        return [
+            (user_id, self.results[user_id]) for _, _, user_id in self._ranking[:size]
+        ]
+
+
+def today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _load_questions(db, question_ids):
+    rows = {
+        question.id: question
+        for question in db.query(Question).filter(Question.id.in_(question_ids))
+    }
+    return [
+        {
+            "level": rows[question_id].level,
+            "question_text": rows[question_id].question_text,
+            "option1": rows[question_id].option1,
+            "option2": rows[question_id].option2,
+            "option3": rows[question_id].option3,
+            "option4": rows[question_id].option4,
+            "correct_option": rows[question_id].correct_option,
+        }
+        for question_id in question_ids
+        if question_id in rows
+    ]
+
+
+def load_daily_challenge(day: str) -> ChallengeDay:
+    """Выбирает (или читает уже выбранный) набор вопросов дня и результаты,
+    сохраненные до перезапуска. Набор пишется в базу, поэтому после
+    перезапуска и на соседних процессах он тот же."""
+    with get_db() as db:
+        challenge = db.get(DailyChallenge, day)
+        if challenge is None:
+            question_ids = [
+                row.id
+                for row in db.query(Question.id).filter(
+                    Question.retired == False  # noqa: E712
+                )
+            ]
+            selected_ids = random.sample(
+                question_ids, min(DAILY_QUESTIONS, len(question_ids))
+            )
+            challenge = DailyChallenge(
+                day=day, question_ids=",".join(map(str, selected_ids))
+            )
+            db.add(challenge)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Набор на этот день уже выбрал другой процесс
+                db.rollback()
+                challenge = db.get(DailyChallenge, day)
+
+        question_ids = [int(i) for i in challenge.question_ids.split(",") if i]
+        loaded = ChallengeDay(day, _load_questions(db, question_ids))
+        for row in db.execute(select(DailyResult).where(DailyResult.day == day)).scalars():
+            loaded.add_result(
+                row.user_id,
+                row.username,
+                row.correct_answers,
+                row.duration_seconds,
+                saved=True,
+            )
+    logging.info(
+        f"Вызов дня {day}: {len(loaded.questions)} вопросов, "
+        f"уже завершили {len(loaded.results)}"
+    )
+    return loaded
+
+
+def save_pending_results(challenge: ChallengeDay):
+    """Сохраняет накопленные результаты одной пачкой (executemany, один commit)"""
+    if challenge is None or not challenge.pending:
+        return
+    pending, challenge.pending = challenge.pending, []
+    rows = [
+        {
+            "day": challenge.day,
+            "user_id": user_id,
+            "username": challenge.results[user_id][2],
+            "correct_answers": challenge.results[user_id][0],
+            "duration_seconds": challenge.results[user_id][1],
+        }
+        for user_id in pending
+    ]
+    try:
+        with get_db() as db:
+            db.execute(insert(DailyResult), rows)
+            db.commit()
+    except Exception as e:
+        # Вернем в очередь, попробуем при следующем сохранении
+        challenge.pending = pending + challenge.pending
+        logging.error(f"Не удалось сохранить результаты вызова дня {challenge.day}: {e}")
+
+
+def ensure_daily_challenge():
+    """Загружает вызов текущего дня, если он еще не загружен (при запуске бота)"""
+    day = today()
+    if state.challenge is None or state.challenge.day != day:
+        save_pending_results(state.challenge)
+        state.challenge = load_daily_challenge(day)
+
+
+def flush_daily_results():
+    """Сохраняет несохраненные результаты при остановке бота"""
+    save_pending_results(state.challenge)
+
+
+async def prepare_daily_challenge(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue в полночь UTC: выбирает вопросы нового дня"""
+    ensure_daily_challenge()
+
+
+async def checkpoint_daily_results(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: сохраняет результаты вызова дня, накопленные в памяти"""
+    save_pending_results(state.challenge)
+
+
+def _menu_keyboard():
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("🏆 Рейтинг дня", callback_data="daily_top")],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
+        ]
+    )
+
+
+def _question_text(question, index: int, total_questions: int) -> str:
+    difficulty, _, language = question["level"].partition("_")
+    return (
+        f"🗓 Вызов дня, вопрос {index + 1}/{total_questions} "
+        f"({LANGUAGE_NAMES.get(language, language)} {difficulty.capitalize()}):\n\n"
+        f"{question['question_text']}\n\n"
+        f"Варианты ответов:\n"
+        f"1️⃣ {question['option1']}\n"
+        f"2️⃣ {question['option2']}\n"
+        f"3️⃣ {question['option3']}\n"
+        f"4️⃣ {question['option4']}"
+    )
+
+
+def _result_text(challenge: ChallengeDay, user_id: int) -> str:
+    correct, duration, _ = challenge.results[user_id]
+    return (
+        f"Ваш результат: {correct}/{len(challenge.questions)} за {duration:.0f} сек.\n"
+        f"Место в рейтинге дня: {challenge.rank(user_id)} из {len(challenge.results)}"
+    )
+
+
+async def show_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экран вызова дня; все данные - из памяти, без запросов к базе"""
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    challenge = state.challenge
+
+    if challenge is None or not challenge.questions:
+        await query.edit_message_text(
+            "🗓 Вызов дня пока не готов, загляните чуть позже.",
+            reply_markup=_menu_keyboard(),
+        )
+        return
+
+    text = (
+        f"🗓 Вызов дня {challenge.day}\n\n"
+        f"{len(challenge.questions)} вопросов, одинаковых для всех. Рейтинг - по числу "
+        "верных ответов, при равенстве выше тот, кто ответил быстрее. "
+        "Попытка одна, новые вопросы - в полночь по UTC.\n\n"
+    )
+    if user_id in challenge.results:
+        text += _result_text(challenge, user_id)
+        keyboard = _menu_keyboard()
+    else:
+        text += f"Уже участвовали: {len(challenge.results)}"
+        keyboard = InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("▶️ Начать", callback_data="daily_start")],
+                *_menu_keyboard().inline_keyboard,
+            ]
+        )
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+
+async def start_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    challenge = state.challenge
+    if challenge is None or user_id in challenge.results:
+        await query.edit_message_text(
+            "Вы уже прошли вызов дня.", reply_markup=_menu_keyboard()
+        )
+        return
+
+    attempt = context.user_data.get("daily")
+    # Начатая сегодня попытка продолжается с текущего вопроса, а не заново
+    if attempt is None or attempt["day"] != challenge.day:
+        attempt = context.user_data["daily"] = {
+            "day": challenge.day,
+            "index": 0,
+            "correct": 0,
+            "started_at": time.time(),
+        }
+    await query.edit_message_text("🗓 Вызов дня начался, время пошло!")
+    await _send_daily_question(context, user_id, challenge, attempt)
+
+
+async def _send_daily_question(context, user_id: int, challenge: ChallengeDay, attempt):
+    index = attempt["index"]
+    keyboard = [
+        [
+            InlineKeyboardButton(emoji, callback_data=f"daily_answer_{index}_{option}")
+            for option, emoji in enumerate(("1️⃣", "2️⃣", "3️⃣", "4️⃣"), start=1)
+        ]
+    ]
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=_question_text(challenge.questions[index], index, len(challenge.questions)),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def handle_daily_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    # daily_answer_<номер вопроса>_<вариант>
+    _, _, index, selected_option = query.data.split("_")
+    challenge = state.challenge
+    attempt = context.user_data.get("daily")
+    if attempt is None or attempt["index"] != int(index):
+        return  # Повторное нажатие
+    if challenge is None or attempt["day"] != challenge.day:
+        context.user_data.pop("daily", None)
+        await query.edit_message_text(
+            "⏰ Вызов дня уже сменился, попробуйте новый.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("🗓 Вызов дня", callback_data="daily")]]
+            ),
+        )
+        return
+
+    question = challenge.questions[attempt["index"]]
+    is_correct = question["correct_option"] == int(selected_option)
+    attempt["correct"] += int(is_correct)
+    attempt["index"] += 1
+    if is_correct:
+        feedback = "✅ Правильно!"
+    else:
+        correct_answer_text = question[f"option{question['correct_option']}"]
+        feedback = f"❌ Неправильно! Правильный ответ: {correct_answer_text}"
+    await query.edit_message_text(
+        f"{_question_text(question, int(index), len(challenge.questions))}\n\n{feedback}"
+    )
+
+    if attempt["index"] < len(challenge.questions):
+        await _send_daily_question(context, user_id, challenge, attempt)
+        return
+
+    context.user_data.pop("daily", None)
+    username = query.from_user.username or f"User{user_id}"
+    challenge.add_result(
+        user_id, username, attempt["correct"], time.time() - attempt["started_at"]
+    )
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=f"🏁 Вызов дня пройден!\n\n{_result_text(challenge, user_id)}",
+        reply_markup=_menu_keyboard(),
+    )
+
+
+async def show_daily_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    challenge = state.challenge
+    if challenge is None or not challenge.results:
+        text = "🏆 Рейтинг дня пока пуст - станьте первым!"
+    else:
+        text = f"🏆 Рейтинг вызова дня {challenge.day}:\n\n"
+        for place, (_, (correct, duration, username)) in enumerate(
+            challenge.top(DAILY_TOP_SIZE), 1
+        ):
+            medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(place, "👤")
+            text += f"{medal} {username}: {correct}/{len(challenge.questions)}, {duration:.0f} сек.\n"
+        if user_id in challenge.results:
+            text += f"\n{_result_text(challenge, user_id)}"
+    await query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("🗓 Вызов дня", callback_data="daily")],
+                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
+            ]
+        ),
+    )
@@ -1,5 +1,8 @@
 from sqlalchemy import (
     create_engine,
+    event,
+    inspect,
+    text,
     Column,
     Integer,
     String,
@@ -7,11 +10,17 @@ from sqlalchemy import (
     Float,
     DateTime,
     ForeignKey,
+    Index,
+    LargeBinary,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from datetime import datetime, timedelta
 from contextlib import contextmanager
+from urllib.parse import quote
+import os
+
+from bot_scope import current_bot
 
 Base = declarative_base()
 
@@ -20,13 +29,18 @@ class Question(Base):
     __tablename__ = "questions"
 
     id = Column(Integer, primary_key=True)
-    level = Column(String, nullable=False)  # junior, middle, senior
+    level = Column(String, nullable=False, index=True)  # junior, middle, senior
     question_text = Column(String, nullable=False)
     option1 = Column(String, nullable=False)
     option2 = Column(String, nullable=False)
     option3 = Column(String, nullable=False)
     option4 = Column(String, nullable=False)
     correct_option = Column(Integer, nullable=False)  # 1-4
+    # Стабильный ключ вопроса из файла банка (questions/*.json), см. question_bank.py
+    key = Column(String, nullable=True, unique=True, index=True)
+    content_hash = Column(String, nullable=True)
+    # Убранные из банка вопросы не удаляются: на них могут ссылаться начатые тесты
+    retired = Column(Boolean, nullable=False, default=False, server_default="0")
 
 
 class UserProgress(Base):
@@ -38,10 +52,12 @@ class UserProgress(Base):
     current_question = Column(Integer, default=0)
     correct_answers = Column(Integer, default=0)
     is_testing = Column(Boolean, default=False)
-    last_answer_time = Column(DateTime, default=datetime.utcnow)
+    # Индекс нужен сборщику брошенных сессий (sessions.py)
+    last_answer_time = Column(DateTime, default=datetime.utcnow, index=True)
     question_ids = Column(
         String, nullable=True
     )  # Хранит ID выбранных вопросов через запятую
+    started_at = Column(DateTime, nullable=True)  # Для длительности теста в истории
 
 
 class UserStats(Base):
@@ -53,6 +69,9 @@ class UserStats(Base):
     mmr = Column(Integer, default=1000)  # Начальный MMR
     total_tests = Column(Integer, default=0)
     last_test_date = Column(DateTime)
+    # Когда рассылка обнаружила, что бот заблокирован или аккаунт удален;
+    # такие пользователи пропускаются, пока снова не напишут боту
+    blocked_at = Column(DateTime, nullable=True)
 
     def calculate_mmr_change(
         self, correct_answers: int, difficulty_level: str, opponent_mmr: int = 1500
@@ -141,6 +160,145 @@ class UserStats(Base):
 
         return mmr_change
 
+    def calculate_duel_mmr_change(
+        self, opponent_mmr: int, result: float, k_factor: int = 32
+    ):
+        """Изменение MMR по итогам дуэли по формуле Эло.
+
+        result - 1 за победу, 0.5 за ничью, 0 за поражение. Чем сильнее
+        соперник, тем больше очков за победу над ним и меньше штраф за
+        поражение.
+        """
+        expected = 1 / (1 + 10 ** ((opponent_mmr - self.mmr) / 400))
+        mmr_change = round(k_factor * (result - expected))
+
+        # Применяем общие правила (защита новичков, штрафы для опытных)
+        if self.mmr < 800:
+            if mmr_change < 0:
+                mmr_change = int(mmr_change * 0.5)
+        elif self.mmr > 2000:
+            if mmr_change < 0:
+                mmr_change = int(mmr_change * 1.5)
+
+        return mmr_change
+
+
+class TestResult(Base):
+    """Итог одного пройденного теста или дуэли (см. history.py)"""
+
+    __tablename__ = "test_results"
+    __table_args__ = (Index("ix_test_results_user_created", "user_id", "created_at"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # standard, custom, duel
+    level = Column(String, nullable=True)  # junior_python и т.п.; для кастомных пусто
+    custom_test_id = Column(Integer, nullable=True)
+    correct_answers = Column(Integer, nullable=False)
+    total_questions = Column(Integer, nullable=False)
+    duration_seconds = Column(Float, nullable=True)
+    mmr_before = Column(Integer, nullable=False)
+    mmr_after = Column(Integer, nullable=False)
+    # Индекс нужен переносу старой истории в архив (maintenance.py)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class UserSummary(Base):
+    """Сводка для экрана /stats: пересчитывается при записи каждого результата,
+    поэтому экран читает одну строку независимо от длины истории"""
+
+    __tablename__ = "user_summaries"
+
+    user_id = Column(Integer, primary_key=True)
+    data = Column(String, nullable=False)  # JSON, см. history.empty_summary
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DailyChallenge(Base):
+    """Вопросы вызова дня: один набор на всех (см. daily.py)"""
+
+    __tablename__ = "daily_challenges"
+
+    day = Column(String, primary_key=True)  # YYYY-MM-DD по UTC
+    question_ids = Column(String, nullable=False)  # ID вопросов через запятую
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DailyResult(Base):
+    """Результат пользователя в вызове дня"""
+
+    __tablename__ = "daily_results"
+
+    day = Column(String, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String)
+    correct_answers = Column(Integer, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    finished_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ReviewItem(Base):
+    """Вопрос, на который пользователь ошибся, с расписанием повторения по SM-2
+    (см. review.py)"""
+
+    __tablename__ = "review_items"
+    __table_args__ = (
+        Index("ix_review_items_user_question", "user_id", "question_id", unique=True),
+        # Следующий вопрос к повторению - первая строка диапазона индекса,
+        # история пользователя целиком не читается
+        Index("ix_review_items_user_due", "user_id", "due_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    repetitions = Column(Integer, nullable=False, default=0)
+    interval_days = Column(Integer, nullable=False, default=0)
+    ease_factor = Column(Float, nullable=False, default=2.5)
+    lapses = Column(Integer, nullable=False, default=0)
+    due_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_reviewed_at = Column(DateTime, nullable=True)
+
+    def apply_review(self, quality: int, now: datetime = None):
+        """Пересчитывает расписание по алгоритму SM-2.
+
+        quality - оценка ответа от 0 до 5; меньше 3 - ошибка: повторения
+        начинаются заново с интервала в 1 день. После верных ответов интервал
+        растет 1 -> 6 -> интервал × фактор легкости.
+        """
+        now = now or datetime.utcnow()
+        if quality < 3:
+            self.repetitions = 0
+            self.interval_days = 1
+            self.lapses = (self.lapses or 0) + 1
+        else:
+            if not self.repetitions:
+                self.interval_days = 1
+            elif self.repetitions == 1:
+                self.interval_days = 6
+            else:
+                self.interval_days = round(self.interval_days * self.ease_factor)
+            self.repetitions = (self.repetitions or 0) + 1
+
+        self.ease_factor = max(
+            1.3,
+            self.ease_factor + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02),
+        )
+        self.last_reviewed_at = now
+        self.due_at = now + timedelta(days=self.interval_days)
+
+
+class SeenQuestions(Base):
+    """Вопросы уровня, которые пользователь уже видел: битовая карта по
+    плотным номерам вопросов уровня (см. seen.py)"""
+
+    __tablename__ = "seen_questions"
+
+    user_id = Column(Integer, primary_key=True)
+    level = Column(String, primary_key=True)
+    bitmap = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 class CustomTest(Base):
     __tablename__ = "custom_tests"
@@ -173,19 +331,310 @@ class CustomQuestion(Base):
     test = relationship("CustomTest", back_populates="questions")
 
 
+class GroupScore(Base):
+    """Результаты участника групповых викторин в одном чате (см. group_quiz.py)"""
+
+    __tablename__ = "group_scores"
+    __table_args__ = (
+        Index("ix_group_scores_chat_user", "chat_id", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String)
+    answered = Column(Integer, nullable=False, default=0)
+    correct_answers = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Broadcast(Base):
+    """Рассылка администратора всем пользователям (см. broadcast.py)"""
+
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(String, nullable=False)
+    created_by = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String, nullable=False, default="running", index=True)
+    # Курсор: id последней обработанной строки user_stats, с него рассылка
+    # продолжается после перезапуска
+    last_stats_id = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    # Сообщение у администратора, в котором обновляется прогресс
+    report_chat_id = Column(Integer, nullable=True)
+    report_message_id = Column(Integer, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class PersistedUserData(Base):
+    """Значение одного ключа context.user_data пользователя (см. persistence.py)"""
+
+    __tablename__ = "persisted_user_data"
+
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(LargeBinary, nullable=False)  # pickle значения
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class PersistedConversation(Base):
+    """Состояние ConversationHandler для одного ключа диалога"""
+
+    __tablename__ = "persisted_conversations"
+
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)  # JSON-кортеж (chat_id, user_id)
+    state = Column(LargeBinary, nullable=False)
+
+
+class AppMetadata(Base):
+    """Служебные значения приложения, например отпечатки схемы и банка вопросов"""
+
+    __tablename__ = "app_metadata"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # Создаем подключение к базе данных
-engine = create_engine("sqlite:///asu_quiz.db")
-SessionLocal = sessionmaker(bind=engine)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///asu_quiz.db")
+engine = create_engine(DATABASE_URL)
+
+
+# Таблицы, общие для всех ботов процесса (см. hosting.py): банк вопросов и
+# каталог кастомных тестов. Они живут в основной базе, которую база каждого
+# бота подключает через ATTACH под этим именем
+SHARED_TABLES = ("questions", "custom_tests", "custom_questions", "app_metadata")
+SHARED_SCHEMA = "shared"
+
+
+def _is_sqlite_file(db_engine) -> bool:
+    return db_engine.dialect.name == "sqlite" and db_engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def _install_sqlite_pragmas(db_engine, attach_path: str = None):
+    @event.listens_for(db_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # В режиме WAL длинные чтения (экспорт, статистика) не блокируют запись
+        cursor = dbapi_connection.cursor()
+        # Действует только для новой базы (до создания таблиц): освободившиеся
+        # страницы возвращаются постепенно, см. maintenance.py
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        if attach_path:
+            cursor.execute(f"ATTACH DATABASE ? AS {SHARED_SCHEMA}", (attach_path,))
+        cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    _install_sqlite_pragmas(engine)
+
+
+# Чистые чтения (таблица лидеров, поиск, статистика, выгрузка) идут через
+# отдельный engine и не делят пул соединений с путем ответ - commit. Можно
+# указать реплику; иначе для файловой SQLite открываются соединения только
+# для чтения к той же базе (в режиме WAL они не ждут писателей)
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "")
+
+
+def _read_only_engine(path: str, attach_path: str = None):
+    """Соединения только для чтения к файловой SQLite"""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro&uri=true"
+    read_only = create_engine(f"sqlite:///{uri}")
+
+    @event.listens_for(read_only, "connect")
+    def _set_read_only_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if attach_path:
+            cursor.execute(
+                f"ATTACH DATABASE ? AS {SHARED_SCHEMA}",
+                (f"file:{quote(attach_path)}?mode=ro",),
+            )
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return read_only
+
+
+def _create_read_engine():
+    if READ_DATABASE_URL:
+        return create_engine(READ_DATABASE_URL)
+    if not _is_sqlite_file(engine):
+        return engine
+    return _read_only_engine(engine.url.database)
+
+
+read_engine = _create_read_engine()
+
+# Сессии короткие, поэтому после commit объекты не нужно перечитывать из базы
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, expire_on_commit=False)
+
+
+def _add_missing_columns(db_engine=engine, tables=None):
+    """Добавляет в существующие таблицы колонки, появившиеся в моделях позже.
+
+    create_all создает только отсутствующие таблицы, поэтому новые колонки
+    добавляются через ALTER TABLE. Ограничения (например, unique) задаются
+    отдельными индексами, которые создаются ниже в create_tables.
+    """
+    inspector = inspect(db_engine)
+    with db_engine.begin() as conn:
+        for table in tables or Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db_engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.server_default is not None:
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+
+
+# Полнотекстовый поиск по каталогу кастомных тестов (SQLite FTS5, см. search.py).
+# Индексы с внешним содержимым: текст хранится только в исходных таблицах,
+# а триггеры обновляют индекс при вставке, изменении и удалении строк.
+SEARCH_INDEXES = {
+    "custom_tests_fts": ("custom_tests", "name"),
+    "custom_questions_fts": ("custom_questions", "question_text"),
+}
+
+
+def _search_index_ddl(index_name, table, column):
+    return (
+        f"CREATE VIRTUAL TABLE {index_name} USING fts5({column}, "
+        f"content='{table}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {index_name}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {index_name}({index_name}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_au AFTER UPDATE OF {column} ON {table} "
+        f"BEGIN INSERT INTO {index_name}({index_name}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {index_name}(rowid, {column}) VALUES (new.id, new.{column}); END",
+    )
+
+
+SEARCH_INDEX_DDL = tuple(
+    statement
+    for index_name, (table, column) in SEARCH_INDEXES.items()
+    for statement in _search_index_ddl(index_name, table, column)
+)
+
+
+def _create_search_indexes():
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for index_name, (table, column) in SEARCH_INDEXES.items():
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": index_name},
+            ).first()
+            if exists:
+                continue
+            for statement in _search_index_ddl(index_name, table, column):
+                conn.execute(text(statement))
+            # Индексируем строки, которые уже были в таблице
+            conn.execute(
+                text(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')")
+            )
 
 
 # Создаем таблицы
 def create_tables():
     Base.metadata.create_all(engine)
+    _add_missing_columns()
+    _create_search_indexes()
+    # create_all не добавляет индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+class BotDatabase:
+    """Собственная база бота, когда в одном процессе работает несколько ботов.
+
+    В ней хранятся пользовательские данные бота: статистика, прогресс,
+    история, user_data. Общие таблицы (SHARED_TABLES) остаются в основной
+    базе, подключенной через ATTACH: таблицу без схемы SQLite ищет сначала
+    в main, затем в подключенных базах, поэтому запросы не меняются, а id
+    вопросов у всех ботов одни и те же. Только для файловой SQLite.
+    """
+
+    def __init__(self, name: str, url: str, archive_url: str = None):
+        self.name = name
+        self.engine = create_engine(url)
+        if not (_is_sqlite_file(self.engine) and _is_sqlite_file(engine)):
+            raise ValueError(
+                f"Бот {name}: отдельная база бота поддерживается только для "
+                "файловой SQLite (и основная база тоже должна быть файловой SQLite)"
+            )
+        shared_path = os.path.abspath(engine.url.database)
+        _install_sqlite_pragmas(self.engine, attach_path=shared_path)
+        self.read_engine = _read_only_engine(self.engine.url.database, shared_path)
+        self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.ReadSessionLocal = sessionmaker(bind=self.read_engine, expire_on_commit=False)
+        stem = os.path.splitext(self.engine.url.database)[0]
+        self.archive_url = archive_url or f"sqlite:///{stem}_archive.db"
+
+    def create_tables(self):
+        """Создает в базе бота его таблицы - все, кроме общих"""
+        tables = [
+            table
+            for table in Base.metadata.sorted_tables
+            if table.name not in SHARED_TABLES
+        ]
+        Base.metadata.create_all(self.engine, tables=tables)
+        _add_missing_columns(self.engine, tables)
+        for table in tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
+
+def current_engine():
+    """Engine базы текущего бота (см. bot_scope.py)"""
+    scope = current_bot.get()
+    return scope.engine if scope is not None else engine
+
+
+def current_read_engine():
+    scope = current_bot.get()
+    return scope.read_engine if scope is not None else read_engine
 
 
 @contextmanager
 def get_db():
-    db = SessionLocal()
+    scope = current_bot.get()
+    db = (scope.SessionLocal if scope is not None else SessionLocal)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def get_read_db():
+    """Сессия для обработчиков, которые только читают. Запись через нее
+    невозможна (query_only), а с репликой данные могут немного отставать -
+    читать сразу после своей записи нужно через get_db"""
+    scope = current_bot.get()
+    db = (scope.ReadSessionLocal if scope is not None else ReadSessionLocal)()
     try:
         yield db
     finally:
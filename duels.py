@@ -0,0 +1,465 @@
+import itertools
+import logging
+import random
+import time
+from datetime import datetime
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from bot_scope import BotLocal
+from database import get_db, Question, UserStats
+from history import record_result
+from matchmaking import Matchmaker
+from metrics import registry, Counter, Gauge
+from timers import question_timers
+
+# Вопросов в одной дуэли
+DUEL_QUESTIONS = 5
+# За правильный ответ быстрее этого времени начисляется бонус за скорость
+DUEL_SPEED_WINDOW_SECONDS = 20
+# Базовые очки за правильный ответ и максимальный бонус за скорость
+DUEL_CORRECT_POINTS = 100
+DUEL_SPEED_BONUS = 100
+# Время на всю дуэль; неотвеченные к этому моменту вопросы считаются неправильными
+DUEL_TIME_LIMIT = 5 * 60
+# Сколько игрок ждет соперника, прежде чем поиск отменится
+DUEL_QUEUE_TIMEOUT = 2 * 60
+# Как часто сводятся игроки, чьи окна подбора расширились
+MATCH_INTERVAL_SECONDS = 2
+
+LANGUAGES = {"java": "Java", "python": "Python", "sql": "SQL"}
+LEVELS = {"junior": "👶 Junior", "middle": "👨‍💻 Middle", "senior": "🧙‍♂️ Senior"}
+
+matchmaker = BotLocal(Matchmaker)
+# duel_id -> Duel; user_id -> duel_id. Дуэли живут только в памяти
+active_duels = BotLocal(dict)
+user_duels = BotLocal(dict)
+_duel_ids = itertools.count(1)
+
+duels_finished = registry.register(
+    Counter(
+        "quiz_duels_total",
+        "Завершенные дуэли",
+        ("outcome",),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_duel_queue",
+        "Игроки в очереди на дуэль",
+        function=lambda: sum(len(queue) for queue in matchmaker.instances()),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_active_duels",
+        "Идущие дуэли",
+        function=lambda: sum(len(duels) for duels in active_duels.instances()),
+    )
+)
+
+
+class Duel:
+    """Дуэль двух игроков на одном наборе вопросов.
+
+    Каждый отвечает в своем темпе; очки начисляются за правильный ответ и
+    за скорость. Итог подводится, когда оба ответили на все вопросы или
+    когда истекло DUEL_TIME_LIMIT.
+    """
+
+    def __init__(self, duel_id: int, level: str, questions, players):
+        self.id = duel_id
+        self.level = level
+        self.questions = questions
+        # user_id -> прогресс игрока
+        self.players = {
+            user_id: {
+                "username": username,
+                "mmr": mmr,
+                "index": 0,
+                "correct": 0,
+                "score": 0,
+                "sent_at": None,
+            }
+            for user_id, (username, mmr) in players.items()
+        }
+        self.settled = False
+        self.started_at = time.monotonic()
+
+    def opponent(self, user_id: int) -> int:
+        return next(other for other in self.players if other != user_id)
+
+    def is_finished(self, user_id: int) -> bool:
+        return self.players[user_id]["index"] >= len(self.questions)
+
+
+def answer_points(is_correct: bool, elapsed: float) -> int:
+    """Очки за ответ: за правильный - базовые плюс бонус, убывающий со временем"""
+    if not is_correct:
+        return 0
+    speed = max(0.0, 1 - elapsed / DUEL_SPEED_WINDOW_SECONDS)
+    return DUEL_CORRECT_POINTS + int(DUEL_SPEED_BONUS * speed)
+
+
+def _menu_keyboard():
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("⚔️ Новая дуэль", callback_data="duel")],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
+        ]
+    )
+
+
+def _question_text(question, index: int, total_questions: int) -> str:
+    return (
+        f"⚔️ Вопрос {index + 1}/{total_questions}:\n\n"
+        f"{question['question_text']}\n\n"
+        f"Варианты ответов:\n"
+        f"1️⃣ {question['option1']}\n"
+        f"2️⃣ {question['option2']}\n"
+        f"3️⃣ {question['option3']}\n"
+        f"4️⃣ {question['option4']}"
+    )
+
+
+async def show_duel_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор языка для дуэли"""
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+
+    if user_id in user_duels:
+        await query.edit_message_text(
+            "⚔️ Вы уже участвуете в дуэли - ответьте на ее вопросы."
+        )
+        return
+    if user_id in matchmaker:
+        await query.edit_message_text(
+            "🔎 Мы уже ищем вам соперника.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("❌ Отменить поиск", callback_data="duel_cancel")]]
+            ),
+        )
+        return
+
+    keyboard = [
+        [InlineKeyboardButton(name, callback_data=f"duel_lang_{language}")]
+        for language, name in LANGUAGES.items()
+    ]
+    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
+    await query.edit_message_text(
+        "⚔️ Дуэль: два игрока отвечают на одни и те же вопросы, очки даются за "
+        "правильность и скорость, MMR победителя растет за счет проигравшего.\n\n"
+        "Выберите язык:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def show_duel_levels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    language = query.data.split("_")[2]
+    lang_name = LANGUAGES.get(language, "Java")
+
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"{name} {lang_name}", callback_data=f"duel_level_{language}_{level}"
+            )
+        ]
+        for level, name in LEVELS.items()
+    ]
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="duel")])
+    await query.edit_message_text(
+        f"⚔️ Выберите уровень дуэли по {lang_name}:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def join_duel_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ставит пользователя в очередь или сразу начинает дуэль с ждущим соперником"""
+    query = update.callback_query
+    await query.answer()
+    _, _, language, level = query.data.split("_")
+    user_id = query.from_user.id
+    username = query.from_user.username or f"User{user_id}"
+    level_key = f"{level}_{language}"
+
+    if user_id in user_duels:
+        await query.edit_message_text("⚔️ Сначала закончите текущую дуэль.")
+        return
+
+    with get_db() as db:
+        stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
+        if not stats:
+            stats = UserStats(user_id=user_id, username=username)
+            db.add(stats)
+            db.commit()
+        mmr = stats.mmr
+
+    partner_id = matchmaker.add(user_id, level_key, mmr)
+    if partner_id is None:
+        await query.edit_message_text(
+            f"🔎 Ищем соперника: {LANGUAGES.get(language, 'Java')} {level.capitalize()}, "
+            f"ваш MMR {mmr}.\n"
+            "Чем дольше ожидание, тем шире допустимая разница в рейтинге. "
+            f"Поиск длится не больше {DUEL_QUEUE_TIMEOUT // 60} мин.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("❌ Отменить поиск", callback_data="duel_cancel")]]
+            ),
+        )
+        return
+
+    await query.edit_message_text("⚔️ Соперник найден!")
+    await start_duel(context.bot, level_key, partner_id, user_id)
+
+
+async def cancel_duel_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if matchmaker.remove(query.from_user.id):
+        text = "Поиск соперника отменен."
+    else:
+        text = "Поиск уже завершен."
+    await query.edit_message_text(text, reply_markup=_menu_keyboard())
+
+
+def pick_questions(db, level: str, count: int):
+    """Случайные действующие вопросы уровня в виде словарей: игра не держит
+    сессию базы открытой и не зависит от последующих правок банка"""
+    question_ids = [
+        row.id
+        for row in db.query(Question.id).filter(
+            Question.level == level,
+            Question.retired == False,  # noqa: E712
+        )
+    ]
+    selected_ids = random.sample(question_ids, min(count, len(question_ids)))
+    rows = {
+        question.id: question
+        for question in db.query(Question).filter(Question.id.in_(selected_ids))
+    }
+    return [
+        {
+            "question_text": rows[question_id].question_text,
+            "option1": rows[question_id].option1,
+            "option2": rows[question_id].option2,
+            "option3": rows[question_id].option3,
+            "option4": rows[question_id].option4,
+            "correct_option": rows[question_id].correct_option,
+        }
+        for question_id in selected_ids
+    ]
+
+
+async def start_duel(bot, level: str, first_id: int, second_id: int):
+    """Создает дуэль и отправляет обоим игрокам первый вопрос"""
+    with get_db() as db:
+        questions = pick_questions(db, level, DUEL_QUESTIONS)
+        players = {
+            stats.user_id: (stats.username or f"User{stats.user_id}", stats.mmr)
+            for stats in db.query(UserStats).filter(
+                UserStats.user_id.in_((first_id, second_id))
+            )
+        }
+
+    if not questions:
+        for user_id in (first_id, second_id):
+            await bot.send_message(
+                chat_id=user_id,
+                text="❌ Для этого уровня нет вопросов, дуэль отменена.",
+                reply_markup=_menu_keyboard(),
+            )
+        return
+
+    duel = Duel(next(_duel_ids), level, questions, players)
+    active_duels[duel.id] = duel
+    for user_id in duel.players:
+        user_duels[user_id] = duel.id
+    question_timers.schedule(("duel", duel.id), DUEL_TIME_LIMIT)
+    logging.info(f"Дуэль {duel.id} ({level}): {first_id} против {second_id}")
+
+    for user_id in duel.players:
+        opponent = duel.players[duel.opponent(user_id)]
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                f"⚔️ Дуэль началась! Соперник: {opponent['username']} "
+                f"(MMR {opponent['mmr']}).\n"
+                f"Вопросов: {len(questions)}. За правильный ответ {DUEL_CORRECT_POINTS} "
+                f"очков и до {DUEL_SPEED_BONUS} за скорость. "
+                f"На всю дуэль {DUEL_TIME_LIMIT // 60} мин."
+            ),
+        )
+        await _send_duel_question(bot, duel, user_id)
+
+
+async def _send_duel_question(bot, duel: Duel, user_id: int):
+    player = duel.players[user_id]
+    index = player["index"]
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                emoji, callback_data=f"duel_answer_{duel.id}_{index}_{option}"
+            )
+            for option, emoji in enumerate(("1️⃣", "2️⃣", "3️⃣", "4️⃣"), start=1)
+        ]
+    ]
+    # Время ответа считаем с момента отправки вопроса; отметка ставится до
+    # запроса к Telegram, чтобы быстрый ответ не пришел раньше нее
+    player["sent_at"] = time.monotonic()
+    await bot.send_message(
+        chat_id=user_id,
+        text=_question_text(duel.questions[index], index, len(duel.questions)),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def handle_duel_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    # duel_answer_<дуэль>_<номер вопроса>_<вариант>
+    _, _, duel_id, index, selected_option = query.data.split("_")
+    duel = active_duels.get(int(duel_id))
+    if duel is None or user_id not in duel.players:
+        await query.edit_message_text("Эта дуэль уже завершена.")
+        return
+
+    player = duel.players[user_id]
+    if player["index"] != int(index):
+        return  # Повторное нажатие на уже отвеченный вопрос
+
+    question = duel.questions[player["index"]]
+    is_correct = question["correct_option"] == int(selected_option)
+    points = answer_points(is_correct, time.monotonic() - player["sent_at"])
+    player["index"] += 1
+    player["correct"] += int(is_correct)
+    player["score"] += points
+
+    if is_correct:
+        feedback = f"✅ Правильно! +{points} очков"
+    else:
+        correct_answer_text = question[f"option{question['correct_option']}"]
+        feedback = f"❌ Неправильно! Правильный ответ: {correct_answer_text}"
+    await query.edit_message_text(
+        f"{_question_text(question, int(index), len(duel.questions))}\n\n{feedback}"
+    )
+
+    if not duel.is_finished(user_id):
+        await _send_duel_question(context.bot, duel, user_id)
+    elif duel.is_finished(duel.opponent(user_id)):
+        await _settle_duel(context.bot, duel)
+    else:
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=f"🏁 Вы ответили на все вопросы: {player['score']} очков. Ждем соперника...",
+        )
+
+
+async def _settle_duel(bot, duel: Duel, timed_out: bool = False):
+    """Подводит итог дуэли и обновляет MMR обоих игроков друг относительно друга"""
+    if duel.settled:
+        return
+    duel.settled = True
+    question_timers.cancel(("duel", duel.id))
+    active_duels.pop(duel.id, None)
+    for user_id in duel.players:
+        user_duels.pop(user_id, None)
+    duels_finished.inc("timeout" if timed_out else "finished")
+
+    first_id, second_id = duel.players
+    first, second = duel.players[first_id], duel.players[second_id]
+    if first["score"] == second["score"]:
+        results = {first_id: 0.5, second_id: 0.5}
+    else:
+        first_won = first["score"] > second["score"]
+        results = {first_id: float(first_won), second_id: float(not first_won)}
+
+    changes = {}
+    try:
+        with get_db() as db:
+            stats = {
+                row.user_id: row
+                for row in db.query(UserStats).filter(
+                    UserStats.user_id.in_((first_id, second_id))
+                )
+            }
+            # Оба изменения считаются от рейтингов до дуэли
+            for user_id, row in stats.items():
+                opponent_mmr = stats[duel.opponent(user_id)].mmr
+                changes[user_id] = (
+                    row.mmr,
+                    row.calculate_duel_mmr_change(opponent_mmr, results[user_id]),
+                )
+            for user_id, row in stats.items():
+                row.mmr = max(0, row.mmr + changes[user_id][1])
+                row.total_tests += 1
+                row.last_test_date = datetime.utcnow()
+                record_result(
+                    db,
+                    user_id,
+                    "duel",
+                    duel.players[user_id]["correct"],
+                    len(duel.questions),
+                    changes[user_id][0],
+                    row.mmr,
+                    level=duel.level,
+                    duration_seconds=time.monotonic() - duel.started_at,
+                )
+            db.commit()
+    except Exception as e:
+        logging.error(f"Ошибка при подведении итогов дуэли {duel.id}: {e}")
+
+    for user_id in duel.players:
+        player = duel.players[user_id]
+        opponent = duel.players[duel.opponent(user_id)]
+        outcome = {1.0: "🏆 Победа!", 0.5: "🤝 Ничья!", 0.0: "😔 Поражение."}[
+            results[user_id]
+        ]
+        text = f"⚔️ Дуэль завершена. {outcome}\n\n"
+        if timed_out:
+            text += "⏰ Время вышло: неотвеченные вопросы засчитаны как неправильные.\n\n"
+        text += (
+            f"Вы: {player['score']} очков ({player['correct']}/{len(duel.questions)} верно)\n"
+            f"{opponent['username']}: {opponent['score']} очков "
+            f"({opponent['correct']}/{len(duel.questions)} верно)"
+        )
+        if user_id in changes:
+            old_mmr, mmr_change = changes[user_id]
+            mmr_symbol = "🔺" if mmr_change > 0 else "🔻" if mmr_change < 0 else "➖"
+            text += (
+                f"\n\nMMR: {old_mmr} {mmr_symbol} {abs(mmr_change)} = "
+                f"{max(0, old_mmr + mmr_change)}"
+            )
+        try:
+            await bot.send_message(chat_id=user_id, text=text, reply_markup=_menu_keyboard())
+        except Exception as e:
+            logging.error(f"Не удалось отправить итог дуэли {duel.id} user_id={user_id}: {e}")
+
+
+async def duel_timeout(application, duel_id: int, payload):
+    """Время дуэли истекло (вызывается колесом таймеров)"""
+    duel = active_duels.get(duel_id)
+    if duel is not None:
+        await _settle_duel(application.bot, duel, timed_out=True)
+
+
+async def match_duel_queue(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: сводит ждущих игроков и снимает тех, кто ждет слишком долго"""
+    for user_id in matchmaker.pop_expired(DUEL_QUEUE_TIMEOUT):
+        try:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="😔 Соперник не нашелся. Попробуйте еще раз чуть позже.",
+                reply_markup=_menu_keyboard(),
+            )
+        except Exception as e:
+            logging.error(f"Не удалось сообщить user_id={user_id} об отмене поиска: {e}")
+
+    for level, first_id, second_id in matchmaker.match_waiting():
+        try:
+            await start_duel(context.bot, level, first_id, second_id)
+        except Exception as e:
+            logging.error(f"Ошибка при запуске дуэли {first_id} против {second_id}: {e}")
@@ -0,0 +1,277 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import select
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from database import (
+    current_read_engine,
+    CustomTest,
+    CustomQuestion,
+    TestResult,
+    UserStats,
+)
+
+# Администраторы, которым доступен полный экспорт (ID через запятую)
+ADMIN_IDS = {
+    int(user_id)
+    for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",")
+    if user_id
+}
+# Сколько строк читается из курсора за раз
+EXPORT_CHUNK_SIZE = 1000
+# До этого размера файл экспорта держится в памяти, дальше уходит на диск
+EXPORT_SPOOL_BYTES = 1024 * 1024
+# Bot API не принимает документы больше 50 МБ
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+EXPORT_FORMATS = ("csv", "json")
+
+CUSTOM_TEST_COLUMNS = (
+    "test_id",
+    "test_name",
+    "created_at",
+    "text",
+    "option1",
+    "option2",
+    "option3",
+    "option4",
+    "correct_option",
+)
+USER_STATS_COLUMNS = ("user_id", "username", "mmr", "total_tests", "last_test_date")
+TEST_RESULTS_COLUMNS = (
+    "created_at",
+    "kind",
+    "level",
+    "custom_test_id",
+    "correct_answers",
+    "total_questions",
+    "duration_seconds",
+    "mmr_before",
+    "mmr_after",
+)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_export(statement, columns, export_format: str, out, compress: bool = False):
+    """Пишет результат запроса в файл out порциями по EXPORT_CHUNK_SIZE строк.
+
+    Запрос читается курсором (stream_results + yield_per), поэтому память не
+    зависит от числа строк. Возвращает число выгруженных строк.
+    """
+    raw = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) if compress else out
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    rows_written = 0
+    try:
+        if export_format == "csv":
+            writer = csv.writer(text)
+            writer.writerow(columns)
+        else:
+            text.write("[")
+
+        with current_read_engine().connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=EXPORT_CHUNK_SIZE
+            ).execute(statement)
+            for partition in result.partitions():
+                if export_format == "csv":
+                    writer.writerows(
+                        [_format_value(value) for value in row] for row in partition
+                    )
+                else:
+                    text.write(
+                        ("," if rows_written else "")
+                        + ",".join(
+                            json.dumps(
+                                dict(zip(columns, row)),
+                                ensure_ascii=False,
+                                default=_json_default,
+                            )
+                            for row in partition
+                        )
+                    )
+                rows_written += len(partition)
+
+        if export_format == "json":
+            text.write("]")
+        text.flush()
+    finally:
+        # Отсоединяем обертку, чтобы ее закрытие не закрыло сам файл
+        text.detach()
+        if compress:
+            raw.close()
+    return rows_written
+
+
+def custom_tests_statement(author_id: int):
+    return (
+        select(
+            CustomTest.id,
+            CustomTest.name,
+            CustomTest.created_at,
+            CustomQuestion.question_text,
+            CustomQuestion.option1,
+            CustomQuestion.option2,
+            CustomQuestion.option3,
+            CustomQuestion.option4,
+            CustomQuestion.correct_option,
+        )
+        .join(CustomQuestion, CustomQuestion.test_id == CustomTest.id)
+        .where(CustomTest.author_id == author_id)
+        .order_by(CustomTest.id, CustomQuestion.id)
+    )
+
+
+def user_stats_statement(user_id: int = None):
+    statement = select(
+        UserStats.user_id,
+        UserStats.username,
+        UserStats.mmr,
+        UserStats.total_tests,
+        UserStats.last_test_date,
+    ).order_by(UserStats.id)
+    if user_id is not None:
+        statement = statement.where(UserStats.user_id == user_id)
+    return statement
+
+
+def test_results_statement(user_id: int):
+    """История пройденных тестов пользователя; порядок совпадает с индексом
+    ix_test_results_user_created, поэтому курсор идет по индексу без сортировки"""
+    return (
+        select(
+            TestResult.created_at,
+            TestResult.kind,
+            TestResult.level,
+            TestResult.custom_test_id,
+            TestResult.correct_answers,
+            TestResult.total_questions,
+            TestResult.duration_seconds,
+            TestResult.mmr_before,
+            TestResult.mmr_after,
+        )
+        .where(TestResult.user_id == user_id)
+        .order_by(TestResult.created_at)
+    )
+
+
+def _build_export(statement, columns, export_format: str, compress: bool):
+    """Собирает экспорт во временный файл (выполняется в отдельном потоке)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    try:
+        rows = write_export(statement, columns, export_format, spool, compress)
+        size = spool.tell()
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    return spool, rows, size
+
+
+async def _send_export(
+    update, context, statement, columns, export_format, filename, compress=False
+):
+    # Чтение курсора синхронное, поэтому не блокируем им цикл событий
+    spool, rows, size = await asyncio.to_thread(
+        _build_export, statement, columns, export_format, compress
+    )
+    with spool:
+        if not rows:
+            return 0
+        if size > MAX_DOCUMENT_BYTES:
+            await update.message.reply_text(
+                f"❌ Файл {filename} получился больше 50 МБ, Telegram его не примет."
+            )
+            return rows
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=spool,
+            filename=filename,
+            caption=f"{filename}: {rows} строк",
+        )
+    return rows
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|json] - свои тесты, результаты и история тестов,
+    /export users [csv|json] - вся таблица user_stats (только для админов)"""
+    user_id = update.effective_user.id
+    args = [arg.lower() for arg in (context.args or [])]
+    full_export = "users" in args
+    export_format = next((arg for arg in args if arg in EXPORT_FORMATS), "csv")
+
+    try:
+        if full_export:
+            if user_id not in ADMIN_IDS:
+                await update.message.reply_text(
+                    "⛔ Полный экспорт доступен только администраторам."
+                )
+                return
+            await update.message.reply_text("⏳ Готовлю выгрузку user_stats...")
+            # Полная таблица может быть большой, поэтому она сжимается
+            rows = await _send_export(
+                update,
+                context,
+                user_stats_statement(),
+                USER_STATS_COLUMNS,
+                export_format,
+                f"user_stats.{export_format}.gz",
+                compress=True,
+            )
+            logging.info(f"Администратор {user_id} выгрузил user_stats: {rows} строк")
+            if not rows:
+                await update.message.reply_text("Таблица user_stats пуста.")
+            return
+
+        tests_rows = await _send_export(
+            update,
+            context,
+            custom_tests_statement(user_id),
+            CUSTOM_TEST_COLUMNS,
+            export_format,
+            f"my_tests.{export_format}",
+        )
+        results_rows = await _send_export(
+            update,
+            context,
+            user_stats_statement(user_id),
+            USER_STATS_COLUMNS,
+            export_format,
+            f"my_results.{export_format}",
+        )
+        history_rows = await _send_export(
+            update,
+            context,
+            test_results_statement(user_id),
+            TEST_RESULTS_COLUMNS,
+            export_format,
+            f"my_history.{export_format}",
+        )
+    except Exception as e:
+        logging.error(f"Ошибка при экспорте для пользователя {user_id}: {e}")
+        await update.message.reply_text(
+            "❌ Не удалось подготовить выгрузку. Попробуйте позже."
+        )
+        return
+
+    if not tests_rows and not results_rows and not history_rows:
+        await update.message.reply_text(
+            "У вас пока нет ни своих тестов, ни результатов для выгрузки."
+        )
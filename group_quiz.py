@@ -0,0 +1,394 @@
+import itertools
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import desc, insert, select, update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from bot_scope import BotLocal
+from database import get_db, get_read_db, GroupScore
+from duels import LANGUAGES, LEVELS, pick_questions
+from metrics import registry, Counter, Gauge
+from timers import question_timers
+
+# Вопросов в одной групповой викторине
+GROUP_QUIZ_QUESTIONS = 5
+# Сколько длится раунд (один вопрос) в секундах
+GROUP_ROUND_SECONDS = int(os.getenv("GROUP_ROUND_SECONDS", "30"))
+# Как часто обновляется счетчик ответивших под вопросом. Telegram ограничивает
+# бота примерно 20 сообщениями и правками в минуту на группу, поэтому счетчик
+# правится не на каждый ответ, а не чаще раза в интервал
+GROUP_TALLY_INTERVAL = int(os.getenv("GROUP_TALLY_INTERVAL", "5"))
+# Сколько строк в итоговой таблице игры и общем зачете чата
+GROUP_TOP_SIZE = 10
+
+OPTION_EMOJI = ("1️⃣", "2️⃣", "3️⃣", "4️⃣")
+
+# chat_id -> GroupGame. В чате идет не больше одной игры; игры живут только в памяти
+group_games = BotLocal(dict)
+_round_ids = itertools.count(1)
+
+group_answers = registry.register(
+    Counter(
+        "quiz_group_answers_total",
+        "Нажатия на кнопки групповых викторин: принятые, повторные и опоздавшие",
+        ("result",),
+    )
+)
+group_tally_edits = registry.register(
+    Counter(
+        "quiz_group_tally_edits_total",
+        "Правки счетчика ответивших под вопросами групповых викторин",
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_group_games",
+        "Идущие групповые викторины",
+        function=lambda: sum(len(games) for games in group_games.instances()),
+    )
+)
+
+
+class GroupRound:
+    """Один вопрос групповой викторины.
+
+    Ответы копятся в словаре user_id -> (вариант, время ответа, имя):
+    засчитывается первый ответ каждого участника, обработчик нажатия не
+    ходит ни в базу, ни в Telegram, кроме всплывающего подтверждения.
+    """
+
+    def __init__(self, round_id: int, index: int):
+        self.id = round_id
+        self.index = index
+        self.message_id = None
+        self.started_at = time.monotonic()
+        self.answers = {}
+        # Сколько ответивших показано в сообщении с вопросом
+        self.shown = 0
+
+    def record(self, user_id: int, username: str, option: int) -> bool:
+        if user_id in self.answers:
+            return False
+        self.answers[user_id] = (option, time.monotonic() - self.started_at, username)
+        return True
+
+
+class GroupGame:
+    def __init__(self, chat_id: int, level: str, questions, started_by: int):
+        self.chat_id = chat_id
+        self.level = level
+        self.questions = questions
+        self.started_by = started_by
+        self.round = None
+        self.next_index = 0
+        # user_id -> {"username", "correct", "time"}: итоги этой игры
+        self.scores = {}
+
+
+def _answer_keyboard(round_id: int):
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(emoji, callback_data=f"group_answer_{round_id}_{option}")
+                for option, emoji in enumerate(OPTION_EMOJI, start=1)
+            ]
+        ]
+    )
+
+
+def _question_text(question, index: int, total_questions: int) -> str:
+    return (
+        f"🎲 Вопрос {index + 1}/{total_questions}:\n\n"
+        f"{question['question_text']}\n\n"
+        f"Варианты ответов:\n"
+        f"1️⃣ {question['option1']}\n"
+        f"2️⃣ {question['option2']}\n"
+        f"3️⃣ {question['option3']}\n"
+        f"4️⃣ {question['option4']}"
+    )
+
+
+def _tally_text(game: GroupGame, rnd: GroupRound) -> str:
+    return (
+        f"{_question_text(game.questions[rnd.index], rnd.index, len(game.questions))}\n\n"
+        f"⏳ На ответ {GROUP_ROUND_SECONDS} сек. 👥 Ответили: {len(rnd.answers)}"
+    )
+
+
+def save_round_results(chat_id: int, results):
+    """Записывает итоги раунда: results - user_id -> (имя, верно ли).
+
+    Одно чтение существующих строк, по одному executemany на вставку и
+    обновление и один commit на весь раунд, сколько бы участников ни ответило.
+    """
+    if not results:
+        return
+    now = datetime.utcnow()
+    with get_db() as db:
+        existing = {
+            row.user_id: row
+            for row in db.execute(
+                select(
+                    GroupScore.id,
+                    GroupScore.user_id,
+                    GroupScore.answered,
+                    GroupScore.correct_answers,
+                ).where(
+                    GroupScore.chat_id == chat_id,
+                    GroupScore.user_id.in_(list(results)),
+                )
+            )
+        }
+        inserts = []
+        updates = []
+        for user_id, (username, is_correct) in results.items():
+            row = existing.get(user_id)
+            if row is None:
+                inserts.append(
+                    {
+                        "chat_id": chat_id,
+                        "user_id": user_id,
+                        "username": username,
+                        "answered": 1,
+                        "correct_answers": int(is_correct),
+                        "updated_at": now,
+                    }
+                )
+            else:
+                updates.append(
+                    {
+                        "id": row.id,
+                        "username": username,
+                        "answered": row.answered + 1,
+                        "correct_answers": row.correct_answers + int(is_correct),
+                        "updated_at": now,
+                    }
+                )
+        if inserts:
+            db.execute(insert(GroupScore), inserts)
+        # Массовое обновление по первичному ключу (executemany)
+        if updates:
+            db.execute(update(GroupScore), updates)
+        db.commit()
+
+
+async def start_group_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/quiz [язык] [уровень] в группе запускает викторину, /quiz stop - останавливает"""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    args = [arg.lower() for arg in context.args or []]
+
+    if args[:1] == ["stop"]:
+        await stop_group_quiz(update, context)
+        return
+
+    if chat_id in group_games:
+        await update.message.reply_text(
+            "🎲 Викторина уже идет. Остановить ее: /quiz stop"
+        )
+        return
+
+    language = next((arg for arg in args if arg in LANGUAGES), "python")
+    level = next((arg for arg in args if arg in LEVELS), "junior")
+    level_key = f"{level}_{language}"
+    with get_read_db() as db:
+        questions = pick_questions(db, level_key, GROUP_QUIZ_QUESTIONS)
+    if not questions:
+        await update.message.reply_text("❌ Для этого уровня нет вопросов.")
+        return
+
+    game = GroupGame(chat_id, level_key, questions, user_id)
+    group_games[chat_id] = game
+    logging.info(f"Групповая викторина ({level_key}) в чате {chat_id}")
+    await update.message.reply_text(
+        f"🎲 Викторина: {LANGUAGES[language]} {level.capitalize()}, "
+        f"вопросов: {len(questions)}.\n"
+        f"На каждый вопрос {GROUP_ROUND_SECONDS} сек., засчитывается первый ответ. "
+        "Правильные ответы откроются, когда время выйдет."
+    )
+    await _start_round(context.bot, game)
+
+
+async def stop_group_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    game = group_games.get(chat_id)
+    if game is None:
+        await update.message.reply_text("Викторина не идет. Начать: /quiz")
+        return
+
+    if user_id != game.started_by:
+        member = await context.bot.get_chat_member(chat_id, user_id)
+        if member.status not in ("creator", "administrator"):
+            await update.message.reply_text(
+                "Остановить викторину может тот, кто ее начал, или администратор чата."
+            )
+            return
+        if group_games.get(chat_id) is not game:
+            return  # Пока проверяли права, игра закончилась сама
+
+    if game.round is not None:
+        await _close_round(context.bot, game)
+    await _finish_game(context.bot, game, stopped=True)
+
+
+async def _start_round(bot, game: GroupGame):
+    rnd = GroupRound(next(_round_ids), game.next_index)
+    game.next_index += 1
+    game.round = rnd
+    message = await bot.send_message(
+        chat_id=game.chat_id,
+        text=_tally_text(game, rnd),
+        reply_markup=_answer_keyboard(rnd.id),
+    )
+    rnd.message_id = message.message_id
+    question_timers.schedule(("group", game.chat_id), GROUP_ROUND_SECONDS, rnd.id)
+
+
+async def handle_group_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Нажатие на вариант ответа в группе: только запоминает ответ в памяти"""
+    query = update.callback_query
+    # group_answer_<раунд>_<вариант>
+    _, _, round_id, selected_option = query.data.split("_")
+    game = group_games.get(update.effective_chat.id)
+    rnd = game.round if game else None
+
+    if rnd is None or rnd.id != int(round_id):
+        group_answers.inc("late")
+        await query.answer("⏰ Этот вопрос уже закрыт.")
+        return
+
+    user_id = query.from_user.id
+    username = query.from_user.username or f"User{user_id}"
+    if rnd.record(user_id, username, int(selected_option)):
+        group_answers.inc("accepted")
+        await query.answer(f"Ответ {OPTION_EMOJI[int(selected_option) - 1]} принят")
+    else:
+        group_answers.inc("duplicate")
+        await query.answer("Вы уже ответили на этот вопрос, изменить ответ нельзя.")
+
+
+async def flush_group_tallies(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: одна правка сообщения с вопросом за интервал и только
+    если с прошлой правки кто-то ответил"""
+    for game in list(group_games.values()):
+        rnd = game.round
+        if rnd is None or rnd.message_id is None or rnd.shown == len(rnd.answers):
+            continue
+        rnd.shown = len(rnd.answers)
+        try:
+            await context.bot.edit_message_text(
+                chat_id=game.chat_id,
+                message_id=rnd.message_id,
+                text=_tally_text(game, rnd),
+                reply_markup=_answer_keyboard(rnd.id),
+            )
+            group_tally_edits.inc()
+        except Exception as e:
+            logging.warning(f"Не удалось обновить счетчик в чате {game.chat_id}: {e}")
+
+
+async def _close_round(bot, game: GroupGame):
+    """Закрывает текущий раунд: одна запись итогов в базу и одна правка вопроса"""
+    rnd = game.round
+    game.round = None
+    question_timers.cancel(("group", game.chat_id))
+    question = game.questions[rnd.index]
+    correct_option = question["correct_option"]
+
+    results = {}
+    votes = [0] * len(OPTION_EMOJI)
+    fastest = None
+    for user_id, (option, elapsed, username) in rnd.answers.items():
+        is_correct = option == correct_option
+        results[user_id] = (username, is_correct)
+        votes[option - 1] += 1
+        score = game.scores.setdefault(
+            user_id, {"username": username, "correct": 0, "time": 0.0}
+        )
+        score["username"] = username
+        if is_correct:
+            score["correct"] += 1
+            score["time"] += elapsed
+            if fastest is None or elapsed < fastest[1]:
+                fastest = (username, elapsed)
+
+    try:
+        save_round_results(game.chat_id, results)
+    except Exception as e:
+        logging.error(f"Ошибка при сохранении итогов раунда {rnd.id} в чате {game.chat_id}: {e}")
+
+    correct_count = sum(1 for _, is_correct in results.values() if is_correct)
+    text = (
+        f"{_question_text(question, rnd.index, len(game.questions))}\n\n"
+        f"✅ Правильный ответ: {OPTION_EMOJI[correct_option - 1]} "
+        f"{question[f'option{correct_option}']}\n"
+        + " · ".join(
+            f"{emoji} {count}" for emoji, count in zip(OPTION_EMOJI, votes)
+        )
+        + f"\nВерно ответили: {correct_count} из {len(results)}"
+    )
+    if fastest:
+        text += f"\n⚡ Быстрее всех: {fastest[0]} ({fastest[1]:.1f} сек.)"
+    try:
+        await bot.edit_message_text(
+            chat_id=game.chat_id, message_id=rnd.message_id, text=text
+        )
+    except Exception as e:
+        logging.warning(f"Не удалось подвести итог раунда в чате {game.chat_id}: {e}")
+
+
+async def _finish_game(bot, game: GroupGame, stopped: bool = False):
+    group_games.pop(game.chat_id, None)
+
+    ranking = sorted(
+        game.scores.values(), key=lambda score: (-score["correct"], score["time"])
+    )[:GROUP_TOP_SIZE]
+    text = "🏁 Викторина остановлена.\n\n" if stopped else "🏁 Викторина завершена!\n\n"
+    if ranking:
+        text += "Итоги игры:\n"
+        for i, score in enumerate(ranking, 1):
+            medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(i, "👤")
+            text += (
+                f"{medal} {score['username']}: {score['correct']}/{len(game.questions)}\n"
+            )
+    else:
+        text += "Никто не ответил ни на один вопрос.\n"
+
+    try:
+        with get_db() as db:
+            chat_top = db.execute(
+                select(GroupScore.username, GroupScore.correct_answers)
+                .where(GroupScore.chat_id == game.chat_id)
+                .order_by(desc(GroupScore.correct_answers))
+                .limit(GROUP_TOP_SIZE)
+            ).all()
+        if chat_top:
+            text += "\n📊 Общий зачет чата:\n" + "\n".join(
+                f"{i}. {row.username}: {row.correct_answers}"
+                for i, row in enumerate(chat_top, 1)
+            )
+    except Exception as e:
+        logging.error(f"Ошибка при чтении общего зачета чата {game.chat_id}: {e}")
+
+    await bot.send_message(
+        chat_id=game.chat_id, text=f"{text}\n\nНовая викторина: /quiz [язык] [уровень]"
+    )
+
+
+async def group_round_timeout(application, chat_id: int, round_id: int):
+    """Время раунда вышло (вызывается колесом таймеров): итоги и следующий вопрос"""
+    game = group_games.get(chat_id)
+    if game is None or game.round is None or game.round.id != round_id:
+        return
+    await _close_round(application.bot, game)
+    if group_games.get(chat_id) is not game:
+        return  # Игру остановили, пока подводился итог раунда
+    if game.next_index < len(game.questions):
+        await _start_round(application.bot, game)
+    else:
+        await _finish_game(application.bot, game)
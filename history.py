@@ -0,0 +1,192 @@
+import json
+from datetime import datetime
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from database import get_read_db, TestResult, UserSummary
+
+# Сколько последних тестов и точек графика MMR хранится в сводке
+RECENT_RESULTS = 5
+MMR_HISTORY = 20
+
+LANGUAGE_NAMES = {"java": "Java", "python": "Python", "sql": "SQL", "custom": "Свои тесты"}
+KIND_NAMES = {"standard": "Тест", "custom": "Тест", "duel": "Дуэль"}
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+# Значение по умолчанию для сводки, которую вызывающий еще не читал
+_NOT_LOADED = object()
+
+
+def empty_summary():
+    return {
+        "tests": 0,
+        # язык -> {"tests", "answered", "correct", "best": [верных, вопросов]}
+        "languages": {},
+        "mmr": [],
+        # [{"title", "correct", "total", "mmr_change", "duration", "at"}], новые первыми
+        "recent": [],
+    }
+
+
+def _language(kind: str, level: str) -> str:
+    if kind == "custom" or not level:
+        return "custom"
+    return level.split("_")[-1]
+
+
+def result_title(kind: str, level: str = None, name: str = None) -> str:
+    if kind == "custom":
+        return f"«{name or 'Без названия'}»"
+    difficulty, _, language = (level or "").partition("_")
+    return (
+        f"{KIND_NAMES.get(kind, 'Тест')} {LANGUAGE_NAMES.get(language, language)} "
+        f"{difficulty.capitalize()}"
+    )
+
+
+def record_result(
+    db,
+    user_id: int,
+    kind: str,
+    correct_answers: int,
+    total_questions: int,
+    mmr_before: int,
+    mmr_after: int,
+    level: str = None,
+    custom_test_id: int = None,
+    name: str = None,
+    duration_seconds: float = None,
+    summary=_NOT_LOADED,
+):
+    """Добавляет результат в историю и обновляет сводку пользователя.
+
+    Работает в транзакции вызывающего (commit делает он): результат и сводка
+    записываются вместе, поэтому сводка не расходится с историей. summary -
+    строка UserSummary, если вызывающий уже прочитал ее (None - строки нет).
+    """
+    now = datetime.utcnow()
+    db.add(
+        TestResult(
+            user_id=user_id,
+            kind=kind,
+            level=level,
+            custom_test_id=custom_test_id,
+            correct_answers=correct_answers,
+            total_questions=total_questions,
+            duration_seconds=duration_seconds,
+            mmr_before=mmr_before,
+            mmr_after=mmr_after,
+            created_at=now,
+        )
+    )
+
+    if summary is _NOT_LOADED:
+        summary = db.get(UserSummary, user_id)
+    data = json.loads(summary.data) if summary else empty_summary()
+    data["tests"] += 1
+
+    language = data["languages"].setdefault(
+        _language(kind, level),
+        {"tests": 0, "answered": 0, "correct": 0, "best": [0, 0]},
+    )
+    language["tests"] += 1
+    language["answered"] += total_questions
+    language["correct"] += correct_answers
+    best_correct, best_total = language["best"]
+    if total_questions and (
+        not best_total or correct_answers / total_questions > best_correct / best_total
+    ):
+        language["best"] = [correct_answers, total_questions]
+
+    data["mmr"] = (data["mmr"] + [mmr_after])[-MMR_HISTORY:]
+    data["recent"] = [
+        {
+            "title": result_title(kind, level, name),
+            "correct": correct_answers,
+            "total": total_questions,
+            "mmr_change": mmr_after - mmr_before,
+            "duration": round(duration_seconds) if duration_seconds is not None else None,
+            "at": now.strftime("%d.%m %H:%M"),
+        }
+    ] + data["recent"][: RECENT_RESULTS - 1]
+
+    encoded = json.dumps(data, ensure_ascii=False)
+    if summary is None:
+        db.add(UserSummary(user_id=user_id, data=encoded, updated_at=now))
+    else:
+        summary.data = encoded
+        summary.updated_at = now
+
+
+def sparkline(values) -> str:
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+
+def _format_duration(seconds) -> str:
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(seconds, 60)
+    return f", {minutes} мин {seconds} с" if minutes else f", {seconds} с"
+
+
+def render_summary(data) -> str:
+    if not data or not data["tests"]:
+        return (
+            "📈 Ваша статистика\n\n"
+            "Пока нет пройденных тестов. Результаты появятся здесь после первого теста."
+        )
+
+    mmr = data["mmr"]
+    text = (
+        "📈 Ваша статистика\n\n"
+        f"MMR: {mmr[-1]}  {sparkline(mmr)}\n"
+        f"Пройдено тестов и дуэлей: {data['tests']}\n\n"
+        "По языкам:\n"
+    )
+    for language, stats in data["languages"].items():
+        accuracy = stats["correct"] / stats["answered"] * 100 if stats["answered"] else 0
+        best_correct, best_total = stats["best"]
+        text += (
+            f"• {LANGUAGE_NAMES.get(language, language)}: {accuracy:.0f}% верных "
+            f"({stats['correct']}/{stats['answered']}), тестов {stats['tests']}, "
+            f"лучший результат {best_correct}/{best_total}\n"
+        )
+
+    text += "\nПоследние тесты:\n"
+    for result in data["recent"]:
+        change = result["mmr_change"]
+        symbol = "🔺" if change > 0 else "🔻" if change < 0 else "➖"
+        text += (
+            f"• {result['at']} {result['title']}: {result['correct']}/{result['total']}, "
+            f"{symbol}{abs(change)} MMR{_format_duration(result['duration'])}\n"
+        )
+    return text
+
+
+def load_summary(user_id: int):
+    with get_read_db() as db:
+        summary = db.get(UserSummary, user_id)
+    return json.loads(summary.data) if summary else None
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats - личная статистика"""
+    await update.message.reply_text(render_summary(load_summary(update.effective_user.id)))
+
+
+async def show_my_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Личная статистика из главного меню"""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        render_summary(load_summary(query.from_user.id)),
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
+        ),
+    )
@@ -0,0 +1,224 @@
+"""Несколько ботов в одном процессе на общем event loop.
+
+Боты описываются в JSON-файле BOTS_CONFIG:
+
+    [
+        {"name": "java", "token_env": "JAVA_BOT_TOKEN", "database_url": "sqlite:///bot_java.db"},
+        {"name": "python", "token": "123:ABC", "database_url": "sqlite:///bot_python.db",
+         "archive_database_url": "sqlite:///bot_python_archive.db"}
+    ]
+
+Банк вопросов, индексы уровней, каталог кастомных тестов и кэши отрисовки
+общие: они живут в основной базе DATABASE_URL и в памяти процесса в одном
+экземпляре. У каждого бота своя база (статистика, прогресс, история,
+лидерборды, user_data) и свое состояние в памяти (дуэли, групповые игры,
+таймеры, вызов дня) - см. bot_scope.py. Сервер метрик, слежение за банком,
+резервные копии и обслуживание баз запускаются один раз на процесс.
+
+Пример:
+    BOTS_CONFIG=bots.json python hosting.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from dotenv import load_dotenv
+from telegram import Update
+
+import sql_audit
+from backup import BACKUP_INTERVAL_SECONDS, backup_job, backups_supported, stop_backups
+from bank_reload import QUESTION_BANK_WATCH_SECONDS, watch_question_bank
+from bot import build_application
+from bot_scope import current_bot
+from database import engine, read_engine, BotDatabase
+from maintenance import MAINTENANCE_INTERVAL_SECONDS, maintenance_job, stop_maintenance
+from metrics import METRICS_PORT, instrument_engine, start_metrics_server
+from seed import prepare_database
+
+load_dotenv()
+
+BOTS_CONFIG = os.getenv("BOTS_CONFIG", "bots.json")
+
+
+class HostingConfigError(Exception):
+    pass
+
+
+def load_bots_config(path: str = BOTS_CONFIG) -> list:
+    """Читает и проверяет список ботов: имя, токен и база у каждого свои"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            bots = json.load(f)
+    except (OSError, ValueError) as e:
+        raise HostingConfigError(f"не удалось прочитать {path}: {e}")
+    if not isinstance(bots, list) or not bots:
+        raise HostingConfigError(f"{path}: ожидается непустой список ботов")
+
+    seen_names, seen_urls = set(), set()
+    for index, bot in enumerate(bots):
+        name = bot.get("name") if isinstance(bot, dict) else None
+        if not name:
+            raise HostingConfigError(f"{path}: у бота #{index + 1} нет name")
+        token = bot.get("token") or os.getenv(bot.get("token_env") or "")
+        if not token:
+            raise HostingConfigError(f"Бот {name}: не задан token или token_env")
+        if not bot.get("database_url"):
+            raise HostingConfigError(f"Бот {name}: не задан database_url")
+        if name in seen_names:
+            raise HostingConfigError(f"Бот {name} описан дважды")
+        if bot["database_url"] in seen_urls:
+            raise HostingConfigError(f"Бот {name}: database_url уже занят другим ботом")
+        seen_names.add(name)
+        seen_urls.add(bot["database_url"])
+        bot["token"] = token
+    return bots
+
+
+def rss_bytes() -> int:
+    """Текущий resident set процесса (Linux), 0 - если узнать нельзя"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+async def run_bot(scope: BotDatabase, token: str, started: asyncio.Event, stop: asyncio.Event):
+    """Жизненный цикл одного бота, как в run_polling, но без своего event loop.
+
+    Бот выставляется в переменной контекста этой задачи до сборки Application:
+    задачи обработки апдейтов, JobQueue и таймеры создаются из нее и
+    наследуют бота.
+    """
+    current_bot.set(scope)
+    application = build_application(token, standalone=False)
+    try:
+        await application.initialize()
+        await application.post_init(application)
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logging.info(f"Бот {scope.name} (@{application.bot.username}) запущен")
+        started.set()
+        await stop.wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        logging.info(f"Бот {scope.name} остановлен")
+
+
+async def repeat_for_databases(job, interval: float, first: float, scopes: list):
+    """Задача процесса по расписанию для основной базы и баз всех ботов по очереди"""
+    await asyncio.sleep(first)
+    while True:
+        for scope in [None, *scopes]:
+            current_bot.set(scope)
+            await job(None)
+        current_bot.set(None)
+        await asyncio.sleep(interval)
+
+
+async def repeat(job, interval: float, first: float):
+    await asyncio.sleep(first)
+    while True:
+        await job(None)
+        await asyncio.sleep(interval)
+
+
+def process_tasks(scopes: list) -> list:
+    """Общие для процесса периодические задачи (в bot.py их ставит JobQueue)"""
+    tasks = []
+    if QUESTION_BANK_WATCH_SECONDS:
+        tasks.append(repeat(watch_question_bank, QUESTION_BANK_WATCH_SECONDS, 0))
+    if BACKUP_INTERVAL_SECONDS and backups_supported():
+        tasks.append(
+            repeat_for_databases(
+                backup_job, BACKUP_INTERVAL_SECONDS, BACKUP_INTERVAL_SECONDS, scopes
+            )
+        )
+    if MAINTENANCE_INTERVAL_SECONDS:
+        tasks.append(
+            repeat_for_databases(
+                maintenance_job,
+                MAINTENANCE_INTERVAL_SECONDS,
+                MAINTENANCE_INTERVAL_SECONDS,
+                scopes,
+            )
+        )
+    return [asyncio.create_task(task) for task in tasks]
+
+
+async def host(bots: list):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    server = await start_metrics_server() if METRICS_PORT else None
+    bot_tasks = []
+    scopes = []
+    try:
+        for bot in bots:
+            rss_before = rss_bytes()
+            scope = BotDatabase(bot["name"], bot["database_url"], bot.get("archive_database_url"))
+            scope.create_tables()
+            for db_engine in (scope.engine, scope.read_engine):
+                instrument_engine(db_engine)
+                sql_audit.install(db_engine)
+            scopes.append(scope)
+
+            started = asyncio.Event()
+            task = asyncio.create_task(run_bot(scope, bot["token"], started, stop))
+            bot_tasks.append(task)
+            waiter = asyncio.create_task(started.wait())
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if not started.is_set():
+                # Бот не запустился: останавливаем уже запущенных и выходим
+                stop.set()
+                break
+            logging.info(
+                f"Бот {scope.name}: +{(rss_bytes() - rss_before) / 1024 / 1024:.1f} МБ памяти, "
+                f"всего {rss_bytes() / 1024 / 1024:.1f} МБ"
+            )
+
+        background = process_tasks(scopes) if not stop.is_set() else []
+        await stop.wait()
+        for task in background:
+            task.cancel()
+    finally:
+        stop.set()
+        stop_backups()
+        stop_maintenance()
+        results = await asyncio.gather(*bot_tasks, return_exceptions=True)
+        for bot, result in zip(bots, results):
+            if isinstance(result, Exception):
+                logging.error(f"Бот {bot['name']} завершился с ошибкой: {result!r}")
+        if server:
+            server.close()
+            await server.wait_closed()
+
+
+def main():
+    try:
+        bots = load_bots_config()
+    except HostingConfigError as e:
+        raise SystemExit(f"Ошибка конфигурации ботов: {e}")
+
+    # Основная база: банк вопросов, кастомные тесты и метаданные общие для всех ботов
+    prepare_database()
+    for db_engine in {engine, read_engine}:
+        instrument_engine(db_engine)
+        sql_audit.install(db_engine)
+
+    asyncio.run(host(bots))
+
+
+if __name__ == "__main__":
+    main()
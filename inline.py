@@ -0,0 +1,167 @@
+import logging
+import os
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
+from telegram.ext import ContextTypes
+
+import custom_tests
+
+# Сколько секунд Telegram может отдавать закешированный ответ на тот же запрос
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+# Сколько разных запросов держим в локальном кеше
+INLINE_CACHE_SIZE = 1024
+# Результатов на одну порцию ответа (Bot API допускает не больше 50)
+INLINE_RESULTS_PER_PAGE = 20
+# Не больше стольких результатов на запрос вообще
+MAX_INLINE_RESULTS = 200
+
+# Префикс параметра /start, по которому открывается тест из инлайн-сообщения
+TEST_LINK_PREFIX = "test_"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(text: str):
+    return _TERM_RE.findall(text.lower())
+
+
+class TestNameIndex:
+    """Префиксный индекс по словам названий кастомных тестов.
+
+    Хранит отсортированный список пар (слово, id теста): все слова с заданным
+    префиксом лежат в нем подряд и находятся двумя бинарными поисками.
+    Индекс строится из каталога custom_tests и перестраивается, только когда
+    меняется версия каталога.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.version = None
+
+    def rebuild(self, tests, version):
+        self.entries = sorted(
+            {(term, test["id"]) for test in tests for term in _terms(test["name"])}
+        )
+        self.version = version
+
+    def _prefix_ids(self, prefix: str):
+        start = bisect_left(self.entries, (prefix,))
+        ids = set()
+        for term, test_id in self.entries[start:]:
+            if not term.startswith(prefix):
+                break
+            ids.add(test_id)
+        return ids
+
+    def search(self, query_text: str, limit: int):
+        """ID тестов, в названии которых на каждое слово запроса есть слово с
+        таким префиксом; сначала самые новые"""
+        terms = sorted(set(_terms(query_text)), key=len, reverse=True)
+        if not terms:
+            return []
+        # Самый длинный префикс обычно самый избирательный - с него и начинаем
+        ids = self._prefix_ids(terms[0])
+        for term in terms[1:]:
+            if not ids:
+                break
+            ids &= self._prefix_ids(term)
+        return sorted(ids, reverse=True)[:limit]
+
+
+name_index = TestNameIndex()
+# Нормализованный запрос -> кортеж ID тестов (LRU)
+_results_cache = OrderedDict()
+
+
+def find_tests_for_inline(query_text: str):
+    """ID тестов для инлайн-запроса: из кеша или из префиксного индекса"""
+    storage = custom_tests.get_custom_tests_storage()
+    version = custom_tests.catalog_version
+    if name_index.version != version:
+        name_index.rebuild(custom_tests.custom_tests_by_id.values(), version)
+        _results_cache.clear()
+
+    key = " ".join(_terms(query_text))
+    cached = _results_cache.get(key)
+    if cached is not None:
+        _results_cache.move_to_end(key)
+        return cached
+
+    if key:
+        test_ids = tuple(name_index.search(key, MAX_INLINE_RESULTS))
+    else:
+        # Пустой запрос - просто самые новые тесты
+        test_ids = tuple(
+            sorted(
+                (test["id"] for tests in storage.values() for test in tests),
+                reverse=True,
+            )[:MAX_INLINE_RESULTS]
+        )
+    _results_cache[key] = test_ids
+    if len(_results_cache) > INLINE_CACHE_SIZE:
+        _results_cache.popitem(last=False)
+    return test_ids
+
+
+def _test_result(test, bot_username: str):
+    test_name = test.get("name", "Без названия")
+    author_name = test.get("author_username") or f"User_{test['author_id']}"
+    questions_count = len(test.get("questions", []))
+    link = f"https://t.me/{bot_username}?start={TEST_LINK_PREFIX}{test['id']}"
+    return InlineQueryResultArticle(
+        id=str(test["id"]),
+        title=test_name,
+        description=f"{questions_count} вопр. · автор {author_name}",
+        input_message_content=InputTextMessageContent(
+            f"📚 Тест '{test_name}' от {author_name}\n"
+            f"Вопросов: {questions_count}. Нажмите кнопку ниже, чтобы пройти его."
+        ),
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("▶️ Пройти тест", url=link)]]
+        ),
+    )
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@bot <запрос> - поиск кастомных тестов по началу слов в названии.
+
+    Обращений к базе нет: ответ собирается из каталога в памяти, а одинаковые
+    запросы (в том числе от разных пользователей) отдаются из кеша. Telegram
+    тоже кеширует ответ на INLINE_CACHE_TIME секунд.
+    """
+    query = update.inline_query
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    try:
+        test_ids = find_tests_for_inline(query.query)
+    except Exception as e:
+        logging.error(f"Ошибка инлайн-поиска по запросу '{query.query}': {e}")
+        await query.answer([], cache_time=0)
+        return
+
+    page = test_ids[offset : offset + INLINE_RESULTS_PER_PAGE]
+    results = []
+    for test_id in page:
+        test = custom_tests.custom_tests_by_id.get(test_id)
+        if test is not None:
+            results.append(_test_result(test, context.bot.username))
+
+    next_offset = offset + INLINE_RESULTS_PER_PAGE
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset < len(test_ids) else "",
+    )
@@ -0,0 +1,538 @@
+"""Нагрузочный тест бота против локального фейкового Telegram Bot API.
+
+Поднимает настоящий Application (setup_handlers из bot.py) с base_url,
+указывающим на локальный HTTP-сервер, который отвечает на getUpdates,
+sendMessage, editMessageText и другие методы заготовленными ответами с
+настраиваемой задержкой. Виртуальные пользователи проходят полные сценарии
+(язык -> уровень -> 10 ответов, каталог, кастомный тест, таблица лидеров,
+вызов дня),
+нажимая кнопки из клавиатур, которые присылает бот.
+
+Фейковый API работает в том же процессе и event loop, что и бот, поэтому
+полученная пропускная способность - нижняя оценка. Рабочая база не
+используется: данные создаются во временном каталоге.
+
+Пример:
+    python loadtest.py --users 2000 --ramp-up 10 --api-latency 0.03
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl
+
+TOKEN = "123456:LOADTEST"
+BOT_USER = {
+    "id": 123456,
+    "is_bot": True,
+    "first_name": "Quiz Bot",
+    "username": "loadtest_quiz_bot",
+}
+
+# Сценарии и их доли в нагрузке
+SCENARIOS = {
+    "standard_test": 0.5,
+    "catalog": 0.2,
+    "custom_test": 0.15,
+    "leaderboard": 0.15,
+    "daily": 0.1,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class FakeBotApi:
+    """Минимальный HTTP/1.1 сервер (keep-alive), изображающий Bot API"""
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.pending_updates = deque()
+        self.updates_available = asyncio.Event()
+        self.users = {}  # chat_id -> VirtualUser
+        self.calls = defaultdict(int)
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def next_message_id(self):
+        self._next_message_id += 1
+        return self._next_message_id
+
+    def push_update(self, payload: dict):
+        payload["update_id"] = self._next_update_id
+        self._next_update_id += 1
+        self.pending_updates.append(payload)
+        self.updates_available.set()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.split()[1].decode()
+                api_method = path.rsplit("/", 1)[-1]
+
+                params = {}
+                for key, value in parse_qsl(body.decode()):
+                    try:
+                        params[key] = json.loads(value)
+                    except ValueError:
+                        params[key] = value
+
+                result = await self._dispatch(api_method, params)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            ConnectionResetError,
+            asyncio.CancelledError,  # Остановка сервера во время long polling
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, api_method: str, params: dict):
+        self.calls[api_method] += 1
+
+        if api_method == "getUpdates":
+            return await self._get_updates(params)
+        if api_method == "getMe":
+            return BOT_USER
+
+        if self.latency:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = (
+                int(params["message_id"])
+                if api_method == "editMessageText"
+                else self.next_message_id()
+            )
+            message = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if params.get("reply_markup"):
+                message["reply_markup"] = params["reply_markup"]
+            user = self.users.get(chat_id)
+            if user:
+                user.on_bot_message(message)
+            return message
+
+        # answerCallbackQuery, deleteWebhook и прочее
+        return True
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        while self.pending_updates and self.pending_updates[0]["update_id"] < offset:
+            self.pending_updates.popleft()
+
+        if not self.pending_updates and timeout:
+            self.updates_available.clear()
+            try:
+                await asyncio.wait_for(self.updates_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        return [
+            update
+            for _, update in zip(range(limit), self.pending_updates)
+            if update["update_id"] >= offset
+        ]
+
+
+class VirtualUser:
+    def __init__(self, api: FakeBotApi, user_id: int, stats, step_timeout: float):
+        self.api = api
+        self.user_id = user_id
+        self.user = {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"Load{user_id}",
+            "username": f"load{user_id}",
+        }
+        self.stats = stats
+        self.step_timeout = step_timeout
+        self._expected = None  # (regex, future)
+        api.users[user_id] = self
+
+    # --- Сообщения от бота ---
+
+    def on_bot_message(self, message: dict):
+        if not self._expected:
+            return
+        pattern, future = self._expected
+        for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+            for button in row:
+                if pattern.match(button.get("callback_data", "")):
+                    if not future.done():
+                        future.set_result(message)
+                    return
+
+    async def _step(self, name: str, payload: dict, expect: str):
+        """Отправляет апдейт и ждет сообщение с кнопкой, подходящей под expect"""
+        future = asyncio.get_running_loop().create_future()
+        self._expected = (re.compile(expect), future)
+        start = time.perf_counter()
+        self.api.push_update(payload)
+        try:
+            message = await asyncio.wait_for(future, self.step_timeout)
+        except asyncio.TimeoutError:
+            self.stats.record_error(name)
+            raise
+        finally:
+            self._expected = None
+        self.stats.record(name, time.perf_counter() - start)
+        return message
+
+    def _command(self, text: str):
+        return {
+            "message": {
+                "message_id": self.api.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": self.user_id, "type": "private"},
+                "from": self.user,
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+            }
+        }
+
+    def _click(self, message: dict, data: str):
+        return {
+            "callback_query": {
+                "id": str(random.getrandbits(40)),
+                "from": self.user,
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": {
+                    "message_id": message["message_id"],
+                    "date": int(time.time()),
+                    "chat": {"id": self.user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": message.get("text", ""),
+                },
+            }
+        }
+
+    @staticmethod
+    def _buttons(message: dict, prefix: str):
+        return [
+            button["callback_data"]
+            for row in message.get("reply_markup", {}).get("inline_keyboard", [])
+            for button in row
+            if button.get("callback_data", "").startswith(prefix)
+        ]
+
+    # --- Сценарии ---
+
+    async def _open_menu(self):
+        return await self._step("start", self._command("/start"), "^start_test$")
+
+    async def standard_test(self):
+        menu = await self._open_menu()
+        languages = await self._step(
+            "language_menu", self._click(menu, "start_test"), "^lang_"
+        )
+        language = random.choice(self._buttons(languages, "lang_"))
+        levels = await self._step(
+            "language_selection", self._click(languages, language), "^level_"
+        )
+        level = random.choice(self._buttons(levels, "level_"))
+        message = await self._step(
+            "level_selection", self._click(levels, level), "^answer_"
+        )
+        while self._buttons(message, "answer_"):
+            message = await self._step(
+                "answer",
+                self._click(message, random.choice(self._buttons(message, "answer_"))),
+                "^(answer_|leaderboard$)",
+            )
+
+    async def catalog(self):
+        menu = await self._open_menu()
+        page = await self._step(
+            "catalog_page", self._click(menu, "test_catalog"), "^main_menu$"
+        )
+        for _ in range(random.randint(0, 3)):
+            next_pages = [
+                data
+                for data in self._buttons(page, "test_catalog_")
+                if int(data.rsplit("_", 1)[1]) > 0
+            ]
+            if not next_pages:
+                break
+            page = await self._step(
+                "catalog_page", self._click(page, next_pages[-1]), "^main_menu$"
+            )
+
+    async def custom_test(self):
+        menu = await self._open_menu()
+        page = await self._step(
+            "catalog_page", self._click(menu, "test_catalog"), "^main_menu$"
+        )
+        tests = self._buttons(page, "run_custom_")
+        if not tests:
+            return
+        message = await self._step(
+            "custom_start",
+            self._click(page, random.choice(tests)),
+            "^(custom_answer_|test_catalog$)",
+        )
+        while self._buttons(message, "custom_answer_"):
+            message = await self._step(
+                "custom_answer",
+                self._click(
+                    message, random.choice(self._buttons(message, "custom_answer_"))
+                ),
+                "^(custom_answer_|test_catalog$)",
+            )
+
+    async def leaderboard(self):
+        menu = await self._open_menu()
+        await self._step("leaderboard", self._click(menu, "leaderboard"), "^start_test$")
+
+    async def daily(self):
+        menu = await self._open_menu()
+        screen = await self._step("daily_menu", self._click(menu, "daily"), "^daily_top$")
+        if not self._buttons(screen, "daily_start"):
+            return  # Вызов дня уже пройден
+        message = await self._step(
+            "daily_start", self._click(screen, "daily_start"), "^daily_answer_"
+        )
+        while self._buttons(message, "daily_answer_"):
+            message = await self._step(
+                "daily_answer",
+                self._click(message, random.choice(self._buttons(message, "daily_answer_"))),
+                "^(daily_answer_|daily_top$)",
+            )
+
+    async def run(self, scenario: str):
+        try:
+            await getattr(self, scenario)()
+            self.stats.completed[scenario] += 1
+        except asyncio.TimeoutError:
+            self.stats.failed[scenario] += 1
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.completed = defaultdict(int)
+        self.failed = defaultdict(int)
+
+    def record(self, step: str, seconds: float):
+        self.latencies[step].append(seconds)
+
+    def record_error(self, step: str):
+        self.errors[step] += 1
+
+    def report(self, elapsed: float, api: FakeBotApi):
+        total_steps = sum(len(v) for v in self.latencies.values())
+        total_errors = sum(self.errors.values())
+        print(f"\nДлительность: {elapsed:.1f} с")
+        print(
+            f"Шагов: {total_steps}, ошибок: {total_errors}, "
+            f"пропускная способность: {total_steps / elapsed:.1f} шагов/с, "
+            f"апдейтов: {api._next_update_id - 1}"
+        )
+        print(
+            f"\n{'шаг':<20}{'кол-во':>8}{'ошибки':>8}"
+            f"{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'max мс':>10}"
+        )
+        for step in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies[step]
+            print(
+                f"{step:<20}{len(values):>8}{self.errors[step]:>8}"
+                f"{percentile(values, 0.5) * 1000:>10.1f}"
+                f"{percentile(values, 0.9) * 1000:>10.1f}"
+                f"{percentile(values, 0.99) * 1000:>10.1f}"
+                f"{(max(values) if values else 0) * 1000:>10.1f}"
+            )
+        print("\nСценарии (успешно / с ошибкой):")
+        for scenario in SCENARIOS:
+            print(
+                f"  {scenario:<16}{self.completed[scenario]:>8} / {self.failed[scenario]}"
+            )
+        print("\nВызовы Bot API:")
+        for api_method, count in sorted(api.calls.items()):
+            print(f"  {api_method:<24}{count:>8}")
+
+
+def prepare_database(custom_tests_count: int):
+    """Создает таблицы, заполняет банк вопросов и несколько кастомных тестов"""
+    from seed import prepare_database
+
+    prepare_database()
+
+    import custom_tests
+
+    for index in range(custom_tests_count):
+        custom_tests.add_custom_test(
+            {
+                "name": f"Нагрузочный тест {index}",
+                "author_id": 1_000_000 + index,
+                "author_username": f"author{index}",
+                "questions": [
+                    {
+                        "text": f"Вопрос {n} теста {index}?",
+                        "option1": "Первый",
+                        "option2": "Второй",
+                        "option3": "Третий",
+                        "option4": "Четвертый",
+                        "correct_option": random.randint(1, 4),
+                    }
+                    for n in range(5)
+                ],
+            }
+        )
+    custom_tests.reload_custom_tests()
+
+
+async def run_load(args):
+    import logging
+
+    from telegram import Update
+    from telegram.ext import Application
+
+    import bot
+    import daily
+    import database
+    import metrics
+    import sql_audit
+    from persistence import SQLitePersistence
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for engine in {database.engine, database.read_engine}:
+        metrics.instrument_engine(engine)
+        sql_audit.install(engine)
+
+    api = FakeBotApi(args.api_latency, args.api_jitter)
+    port = await api.start()
+    base_url = f"http://127.0.0.1:{port}/bot"
+
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(base_url)
+        .base_file_url(base_url)
+        .request(metrics.InstrumentedHTTPXRequest(connection_pool_size=256))
+        .concurrent_updates(args.concurrent_updates or False)
+    )
+    if args.persistence:
+        builder = builder.persistence(SQLitePersistence())
+    application = builder.build()
+    bot.setup_handlers(application)
+    # В боте вызов дня загружает post_init, который здесь не вызывается
+    daily.ensure_daily_challenge()
+
+    stats = Stats()
+    scenarios = list(SCENARIOS)
+    weights = list(SCENARIOS.values())
+
+    async with application:
+        await application.start()
+        await application.updater.start_polling(
+            poll_interval=0, timeout=1, allowed_updates=Update.ALL_TYPES
+        )
+
+        started = time.perf_counter()
+        tasks = []
+        for index in range(args.users):
+            user = VirtualUser(api, 10_000 + index, stats, args.step_timeout)
+            scenario = random.choices(scenarios, weights)[0]
+            tasks.append(asyncio.create_task(user.run(scenario)))
+            if args.ramp_up:
+                await asyncio.sleep(args.ramp_up / args.users)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        await application.updater.stop()
+        await application.stop()
+
+    await api.stop()
+    stats.report(elapsed, api)
+
+    print("\nSQL-запросы по обработчикам (всего):")
+    for (handler,), count in sorted(metrics.handler_db_queries._values.items()):
+        print(f"  {handler:<28}{int(count):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument(
+        "--ramp-up", type=float, default=5.0, help="за сколько секунд стартуют все"
+    )
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--api-jitter", type=float, default=0.01)
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--concurrent-updates",
+        type=int,
+        default=0,
+        help="параллельная обработка апдейтов в Application (0 - последовательно)",
+    )
+    parser.add_argument("--custom-tests", type=int, default=20)
+    parser.add_argument("--persistence", action="store_true")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # База создается во временном каталоге, рабочая asu_quiz.db не трогается
+    workdir = tempfile.mkdtemp(prefix="quiz_loadtest_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ.setdefault("METRICS_PORT", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    prepare_database(args.custom_tests)
+    asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Обслуживание базы: перенос старых строк в архив и постепенное освобождение места.
+
+Старые строки истории (test_results, daily_results, daily_challenges, завершенные
+рассылки) и давно законченные тесты в user_progress переносятся в архивную базу
+ARCHIVE_DATABASE_URL пачками. Размер пачки подбирается так, чтобы транзакция
+удаления держала блокировку записи не дольше MAINTENANCE_LOCK_BUDGET_MS.
+Освободившиеся страницы возвращаются файлу через PRAGMA incremental_vacuum
+такими же короткими шагами.
+
+Примеры:
+    python maintenance.py run                        # один проход обслуживания
+    python maintenance.py enable-incremental-vacuum  # один раз, при остановленном боте
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, create_engine, delete, insert, select, tuple_
+from telegram.ext import ContextTypes
+
+from bot_scope import current_bot
+from database import (
+    current_engine,
+    get_db,
+    Base,
+    Broadcast,
+    DailyChallenge,
+    DailyResult,
+    TestResult,
+    UserProgress,
+)
+from metrics import registry, Counter, Gauge
+
+# Как часто (в секундах) запускать обслуживание; 0 - не запускать по расписанию
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# Сколько дней история остается в основной базе
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "180"))
+# Сколько дней хранится строка user_progress законченного теста
+PROGRESS_RETENTION_DAYS = int(os.getenv("PROGRESS_RETENTION_DAYS", "7"))
+ARCHIVE_DATABASE_URL = os.getenv("ARCHIVE_DATABASE_URL", "sqlite:///asu_quiz_archive.db")
+# Сколько миллисекунд одна транзакция обслуживания может держать блокировку записи
+MAINTENANCE_LOCK_BUDGET_MS = float(os.getenv("MAINTENANCE_LOCK_BUDGET_MS", "50"))
+# Пауза между пачками: в нее успевают записать обработчики
+MAINTENANCE_PAUSE_SECONDS = 0.05
+# Границы размера пачки строк и шага освобождения страниц
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 5000
+INITIAL_BATCH_SIZE = 100
+
+# Одновременно идет не больше одного прохода
+_maintenance_lock = threading.Lock()
+# Выставляется при остановке бота, проход прерывается между пачками
+_stop = threading.Event()
+# URL архивной базы -> engine; у каждого бота процесса (hosting.py) свой архив
+_archive_engines = {}
+
+archived_rows = registry.register(
+    Counter(
+        "quiz_maintenance_archived_rows_total",
+        "Строки, перенесенные обслуживанием в архивную базу",
+        ("table",),
+    )
+)
+reclaimed_pages = registry.register(
+    Counter(
+        "quiz_maintenance_reclaimed_pages_total",
+        "Страницы, возвращенные файлу базы через incremental_vacuum",
+    )
+)
+max_lock_ms = registry.register(
+    Gauge(
+        "quiz_maintenance_max_lock_milliseconds",
+        "Самая долгая транзакция записи последнего прохода обслуживания",
+    )
+)
+
+
+def retention_rules(now: datetime):
+    """Таблица и условие, по которому ее строки считаются старыми"""
+    cutoff = now - timedelta(days=RETENTION_DAYS)
+    cutoff_day = cutoff.strftime("%Y-%m-%d")
+    return [
+        (TestResult, TestResult.created_at < cutoff),
+        (DailyResult, DailyResult.day < cutoff_day),
+        (DailyChallenge, DailyChallenge.day < cutoff_day),
+        (
+            Broadcast,
+            and_(Broadcast.status != "running", Broadcast.finished_at < cutoff),
+        ),
+        (
+            UserProgress,
+            and_(
+                UserProgress.is_testing == False,  # noqa: E712
+                UserProgress.last_answer_time
+                < now - timedelta(days=PROGRESS_RETENTION_DAYS),
+            ),
+        ),
+    ]
+
+
+def archive_engine():
+    """Архивная база с теми же таблицами, что и архивируемые в основной"""
+    scope = current_bot.get()
+    url = scope.archive_url if scope is not None else ARCHIVE_DATABASE_URL
+    archive = _archive_engines.get(url)
+    if archive is None:
+        archive = _archive_engines[url] = create_engine(url)
+        Base.metadata.create_all(
+            archive,
+            tables=[model.__table__ for model, _ in retention_rules(datetime.utcnow())],
+        )
+    return archive
+
+
+def next_batch_size(size: int, elapsed_ms: float) -> int:
+    """Размер следующей пачки по времени удержания блокировки предыдущей:
+    с запасом 20% до бюджета, рост не больше чем вдвое за шаг"""
+    target = size * 2
+    if elapsed_ms > 0:
+        target = min(target, int(size * MAINTENANCE_LOCK_BUDGET_MS * 0.8 / elapsed_ms))
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, target))
+
+
+def archive_table(model, condition, stats: dict) -> int:
+    """Переносит старые строки таблицы в архив пачками.
+
+    Пачка сначала записывается в архив (повтор после сбоя не создаст дублей
+    благодаря OR IGNORE), затем удаляется из основной базы. Условие повторяется
+    в DELETE, поэтому строка, изменившаяся между чтением и удалением, остается.
+    """
+    table = model.__table__
+    primary_key = list(table.primary_key.columns)
+    archive_insert = insert(table).prefix_with("OR IGNORE", dialect="sqlite")
+    batch_size = INITIAL_BATCH_SIZE
+    moved = 0
+    while not _stop.is_set():
+        with get_db() as db:
+            rows = db.execute(
+                select(table).where(condition).order_by(*primary_key).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            with archive_engine().begin() as archive:
+                archive.execute(archive_insert, [row._asdict() for row in rows])
+
+            keys = [tuple(getattr(row, column.name) for column in primary_key) for row in rows]
+            start = time.perf_counter()
+            db.execute(delete(table).where(tuple_(*primary_key).in_(keys), condition))
+            db.commit()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+        stats["max_lock_ms"] = max(stats["max_lock_ms"], elapsed_ms)
+        moved += len(rows)
+        archived_rows.inc(table.name, amount=len(rows))
+        if len(rows) < batch_size:
+            break
+        batch_size = next_batch_size(batch_size, elapsed_ms)
+        time.sleep(MAINTENANCE_PAUSE_SECONDS)
+    return moved
+
+
+def _sqlite_connection():
+    return sqlite3.connect(current_engine().url.database, isolation_level=None)
+
+
+def reclaim_free_pages(stats: dict) -> int:
+    """Возвращает свободные страницы файлу шагами, укладывающимися в бюджет.
+
+    Работает, только если в базе включен auto_vacuum=INCREMENTAL: новые базы
+    создаются с ним, для существующих нужен enable_incremental_vacuum.
+    """
+    if current_engine().dialect.name != "sqlite":
+        return 0
+    connection = _sqlite_connection()
+    try:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logging.warning(
+                "В базе выключен auto_vacuum=INCREMENTAL, место не освобождается. "
+                "Включите его: python maintenance.py enable-incremental-vacuum"
+            )
+            return 0
+        step = INITIAL_BATCH_SIZE
+        reclaimed = 0
+        while not _stop.is_set():
+            free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            pages = min(step, free)
+            start = time.perf_counter()
+            # execute выполнил бы только первый шаг прагмы (одна страница),
+            # executescript доводит ее до конца
+            connection.executescript(f"PRAGMA incremental_vacuum({pages})")
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stats["max_lock_ms"] = max(stats["max_lock_ms"], elapsed_ms)
+            reclaimed += pages
+            reclaimed_pages.inc(amount=pages)
+            step = next_batch_size(step, elapsed_ms)
+            time.sleep(MAINTENANCE_PAUSE_SECONDS)
+        return reclaimed
+    finally:
+        connection.close()
+
+
+def run_maintenance() -> dict:
+    """Один проход обслуживания; блокирующий, для потока или CLI"""
+    if not _maintenance_lock.acquire(blocking=False):
+        return {}
+    try:
+        stats = {"archived": {}, "reclaimed_pages": 0, "max_lock_ms": 0.0}
+        for model, condition in retention_rules(datetime.utcnow()):
+            moved = archive_table(model, condition, stats)
+            if moved:
+                stats["archived"][model.__tablename__] = moved
+        stats["reclaimed_pages"] = reclaim_free_pages(stats)
+        max_lock_ms.set(value=stats["max_lock_ms"])
+        if stats["archived"] or stats["reclaimed_pages"]:
+            archived = ", ".join(f"{name}: {count}" for name, count in stats["archived"].items())
+            logging.info(
+                f"Обслуживание базы: в архив перенесено {archived or 'ничего'}, "
+                f"освобождено страниц {stats['reclaimed_pages']}, "
+                f"самая долгая транзакция {stats['max_lock_ms']:.1f} мс"
+            )
+        return stats
+    finally:
+        _maintenance_lock.release()
+
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: проход обслуживания в отдельном потоке"""
+    try:
+        await asyncio.to_thread(run_maintenance)
+    except Exception as e:
+        logging.error(f"Ошибка обслуживания базы: {e}")
+
+
+def stop_maintenance():
+    """Прерывает проход обслуживания при остановке бота"""
+    _stop.set()
+
+
+def enable_incremental_vacuum():
+    """Переводит существующую базу в auto_vacuum=INCREMENTAL.
+
+    Для уже созданной базы режим меняется только полным VACUUM, который
+    переписывает весь файл и блокирует запись, - запускать при остановленном боте.
+    """
+    connection = _sqlite_connection()
+    try:
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("VACUUM")
+        return connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="выполнить один проход обслуживания")
+    subparsers.add_parser(
+        "enable-incremental-vacuum",
+        help="включить auto_vacuum=INCREMENTAL (полный VACUUM, бот должен быть остановлен)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if current_engine().dialect.name != "sqlite" and args.command == "enable-incremental-vacuum":
+        raise SystemExit("incremental_vacuum поддерживается только для SQLite")
+
+    start = time.perf_counter()
+    if args.command == "enable-incremental-vacuum":
+        if not enable_incremental_vacuum():
+            raise SystemExit("Не удалось включить auto_vacuum=INCREMENTAL")
+        print(f"Готово: auto_vacuum=INCREMENTAL ({time.perf_counter() - start:.2f} с)")
+        return
+
+    stats = run_maintenance()
+    archived = sum(stats["archived"].values())
+    print(
+        f"Готово: в архив перенесено {archived} строк, освобождено страниц "
+        f"{stats['reclaimed_pages']}, самая долгая транзакция {stats['max_lock_ms']:.1f} мс "
+        f"({time.perf_counter() - start:.2f} с)"
+    )
+
+
+if __name__ == "__main__":
+    main()
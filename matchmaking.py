@@ -0,0 +1,267 @@
+import heapq
+import random
+import time
+from collections import OrderedDict
+
+# Начальная ширина окна подбора: соперник отличается по MMR не больше чем на столько
+BASE_MMR_BAND = 50
+# На сколько MMR окно расширяется за каждую секунду ожидания
+BAND_WIDEN_PER_SECOND = 10
+# Дальше окно не расширяется
+MAX_MMR_BAND = 500
+
+_MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ("key", "value", "forward")
+
+    def __init__(self, key, value, level: int):
+        self.key = key
+        self.value = value
+        self.forward = [None] * level
+
+
+class SkipList:
+    """Упорядоченный словарь на списке с пропусками.
+
+    Вставка, удаление и поиск соседей ключа - O(log n) в среднем, обход по
+    порядку ключей - O(n). Ключи должны быть уникальными и сравнимыми.
+    """
+
+    def __init__(self, seed=None):
+        self._head = _Node(None, None, _MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random(seed).random
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.forward[0]
+        while node is not None:
+            yield node.key, node.value
+            node = node.forward[0]
+
+    def _path(self, key):
+        """Для каждого уровня - последний узел с ключом меньше key"""
+        update = [self._head] * _MAX_LEVEL
+        node = self._head
+        for level in range(self._level - 1, -1, -1):
+            while node.forward[level] is not None and node.forward[level].key < key:
+                node = node.forward[level]
+            update[level] = node
+        return update
+
+    def insert(self, key, value):
+        update = self._path(key)
+        level = 1
+        while level < _MAX_LEVEL and self._random() < 0.5:
+            level += 1
+        self._level = max(self._level, level)
+        node = _Node(key, value, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+        self._size += 1
+
+    def remove(self, key) -> bool:
+        return self.pop_between(key) is not None
+
+    def pop_between(self, key):
+        """Удаляет ключ и возвращает его соседей, ставших соседями друг
+        другу, как в neighbours; None - если ключа не было"""
+        update = self._path(key)
+        node = update[0].forward[0]
+        if node is None or node.key != key:
+            return None
+        for i in range(len(node.forward)):
+            update[i].forward[i] = node.forward[i]
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        left = update[0] if update[0] is not self._head else None
+        right = node.forward[0]
+        return (
+            (left.key, left.value) if left else None,
+            (right.key, right.value) if right else None,
+        )
+
+    def neighbours(self, key):
+        """Ближайшие элементы слева (< key) и справа (>= key) как (key, value)"""
+        update = self._path(key)
+        left = update[0] if update[0] is not self._head else None
+        right = update[0].forward[0]
+        return (
+            (left.key, left.value) if left else None,
+            (right.key, right.value) if right else None,
+        )
+
+
+class Matchmaker:
+    """Очереди на дуэль по уровням, упорядоченные по MMR.
+
+    Каждая очередь - SkipList с ключом (mmr, user_id). Пара подходит, если
+    разница MMR укладывается в окно дольше ждущего из двоих: окно растет со
+    временем ожидания (band). Новый игрок сразу сравнивается с двумя
+    соседями по MMR - O(log n).
+
+    Для каждой пары соседей в очереди заранее известно, когда окно станет
+    достаточно широким: эти сроки лежат в куче _deadlines. match_waiting
+    снимает с кучи только наступившие сроки и не обходит очереди, поэтому тик
+    стоит O(k log n), где k - число сведенных пар и устаревших записей.
+    Записи не удаляются при изменении очереди, а проверяются при снятии:
+    пара еще ждет и по-прежнему соседствует.
+    """
+
+    def __init__(
+        self,
+        clock=time.monotonic,
+        base_band: float = BASE_MMR_BAND,
+        widen_per_second: float = BAND_WIDEN_PER_SECOND,
+        max_band: float = MAX_MMR_BAND,
+    ):
+        self._clock = clock
+        self.base_band = base_band
+        self.widen_per_second = widen_per_second
+        self.max_band = max_band
+        self._queues = {}
+        # user_id -> (уровень, mmr, время постановки); порядок - порядок постановки
+        self._waiting = OrderedDict()
+        # (срок, уровень, ключ левого, ключ правого) для пар соседей по MMR
+        self._deadlines = []
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def __contains__(self, user_id):
+        return user_id in self._waiting
+
+    def band(self, enqueued_at: float, now: float) -> float:
+        """Допустимая разница MMR для игрока, который ждет с момента enqueued_at"""
+        return min(
+            self.max_band, self.base_band + self.widen_per_second * (now - enqueued_at)
+        )
+
+    def _acceptable(self, mmr: int, enqueued_at: float, other, now: float) -> bool:
+        (other_mmr, _), other_enqueued_at = other
+        # Окно растет со временем, поэтому шире оно у того, кто ждет дольше
+        oldest = min(enqueued_at, other_enqueued_at)
+        return abs(mmr - other_mmr) <= self.band(oldest, now)
+
+    def _pair_deadline(self, left, right):
+        """Когда пара соседей (key, время постановки) станет допустимой;
+        None - никогда (разница больше максимального окна)"""
+        (left_key, left_enqueued_at), (right_key, right_enqueued_at) = left, right
+        difference = right_key[0] - left_key[0]
+        oldest = min(left_enqueued_at, right_enqueued_at)
+        if difference <= self.base_band:
+            return oldest
+        if difference > self.max_band or self.widen_per_second <= 0:
+            return None
+        return oldest + (difference - self.base_band) / self.widen_per_second
+
+    def _push_pair(self, level: str, left, right):
+        if left is None or right is None:
+            return
+        deadline = self._pair_deadline(left, right)
+        if deadline is not None:
+            heapq.heappush(self._deadlines, (deadline, level, left[0], right[0]))
+
+    def _is_adjacent_pair(self, level: str, left_key, right_key) -> bool:
+        """Запись кучи актуальна: оба игрока ждут в этой очереди и соседствуют"""
+        for mmr, user_id in (left_key, right_key):
+            entry = self._waiting.get(user_id)
+            if entry is None or entry[0] != level or entry[1] != mmr:
+                return False
+        left, _ = self._queues[level].neighbours(right_key)
+        return left is not None and left[0] == left_key
+
+    def _compact_deadlines(self):
+        """Пересобирает кучу из очередей, когда устаревших записей стало
+        больше живых: O(n), но не чаще чем раз в O(n) изменений очереди"""
+        self._deadlines = []
+        for level, queue in self._queues.items():
+            previous = None
+            for item in queue:
+                self._push_pair(level, previous, item)
+                previous = item
+
+    def add(self, user_id: int, level: str, mmr: int):
+        """Ставит игрока в очередь уровня. Если подходящий соперник уже ждет,
+        игрок в очередь не попадает, а соперник из нее удаляется: возвращается
+        его user_id. Иначе возвращается None."""
+        self.remove(user_id)
+        now = self._clock()
+        queue = self._queues.get(level)
+        if queue is None:
+            queue = self._queues[level] = SkipList()
+        key = (mmr, user_id)
+
+        candidates = [
+            neighbour
+            for neighbour in queue.neighbours(key)
+            if neighbour is not None and self._acceptable(mmr, now, neighbour, now)
+        ]
+        if candidates:
+            (_, partner_id), _ = min(
+                candidates, key=lambda neighbour: abs(neighbour[0][0] - mmr)
+            )
+            self.remove(partner_id)
+            return partner_id
+
+        left, right = queue.neighbours(key)
+        queue.insert(key, now)
+        self._waiting[user_id] = (level, mmr, now)
+        self._push_pair(level, left, (key, now))
+        self._push_pair(level, (key, now), right)
+        if len(self._deadlines) > 4 * len(self._waiting) + 64:
+            self._compact_deadlines()
+        return None
+
+    def remove(self, user_id: int) -> bool:
+        entry = self._waiting.pop(user_id, None)
+        if entry is None:
+            return False
+        level, mmr, _ = entry
+        # Соседи удаленного теперь соседствуют друг с другом
+        self._push_pair(level, *self._queues[level].pop_between((mmr, user_id)))
+        return True
+
+    def match_waiting(self):
+        """Сводит ждущих игроков, чьи окна за время ожидания стали достаточно
+        широкими. Возвращает список (уровень, user_id, user_id)."""
+        now = self._clock()
+        pairs = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, level, left_key, right_key = heapq.heappop(self._deadlines)
+            if not self._is_adjacent_pair(level, left_key, right_key):
+                continue
+            left = (left_key, self._waiting[left_key[1]][2])
+            right = (right_key, self._waiting[right_key[1]][2])
+            if not self._acceptable(left_key[0], left[1], right, now):
+                # Срок посчитан при других параметрах окна или округлился
+                deadline = self._pair_deadline(left, right)
+                if deadline is not None:
+                    heapq.heappush(
+                        self._deadlines, (max(deadline, now + 1e-3), level, left_key, right_key)
+                    )
+                continue
+            pairs.append((level, left_key[1], right_key[1]))
+            # remove сам ставит в кучу пару, ставшую соседней
+            self.remove(left_key[1])
+            self.remove(right_key[1])
+        return pairs
+
+    def pop_expired(self, max_wait: float):
+        """Убирает из очередей тех, кто ждет дольше max_wait секунд"""
+        cutoff = self._clock() - max_wait
+        expired = []
+        while self._waiting:
+            user_id, (_, _, enqueued_at) = next(iter(self._waiting.items()))
+            if enqueued_at > cutoff:
+                break
+            self.remove(user_id)
+            expired.append(user_id)
+        return expired
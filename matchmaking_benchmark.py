@@ -0,0 +1,145 @@
+"""Бенчмарк очереди подбора соперников для дуэлей.
+
+Очередь заполняется N игроками с MMR из нормального распределения
+(подбор на время заполнения отключен отрицательным окном), после чего
+замеряются отдельные операции на очереди такого размера:
+    add_no_match - постановка игрока, для которого пары нет;
+    add_match    - постановка игрока, который сразу находит соперника;
+    cancel       - отмена поиска случайным игроком;
+    match_pass_idle - проход match_waiting, когда ни один срок не наступил;
+    match_pass   - один проход match_waiting, когда окна всех игроков
+                   расширились (сводит почти всю очередь).
+После каждой операции размер очереди восстанавливается, и это время в
+замер не входит.
+
+Пример:
+    python matchmaking_benchmark.py --players 1000,10000,100000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from matchmaking import Matchmaker
+
+LEVELS = ("junior_java", "middle_python", "senior_sql")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def random_mmr(rng) -> int:
+    return max(0, min(3000, int(rng.gauss(1200, 350))))
+
+
+@contextmanager
+def no_matching(matchmaker):
+    """Отрицательное окно: никто никому не подходит, игроки только копятся"""
+    band = matchmaker.base_band
+    matchmaker.base_band = -1
+    try:
+        yield
+    finally:
+        matchmaker.base_band = band
+
+
+def fill(matchmaker, rng, players: int):
+    with no_matching(matchmaker):
+        for user_id in range(players):
+            matchmaker.add(user_id, rng.choice(LEVELS), random_mmr(rng))
+
+
+def percentile(samples, fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[int(fraction * (len(samples) - 1))]
+
+
+def run_size(players: int, iterations: int, seed: int):
+    rng = random.Random(seed)
+    clock = FakeClock()
+    matchmaker = Matchmaker(clock=clock)
+    fill(matchmaker, rng, players)
+    next_user_id = players
+    results = {}
+
+    # Постановка без пары
+    samples = []
+    for _ in range(iterations):
+        with no_matching(matchmaker):
+            start = time.perf_counter()
+            matchmaker.add(next_user_id, rng.choice(LEVELS), random_mmr(rng))
+            samples.append(time.perf_counter() - start)
+        matchmaker.remove(next_user_id)
+        next_user_id += 1
+    results["add_no_match"] = samples
+
+    # Постановка с немедленным подбором соперника
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        partner_id = matchmaker.add(next_user_id, rng.choice(LEVELS), random_mmr(rng))
+        samples.append(time.perf_counter() - start)
+        next_user_id += 1
+        if partner_id is None:
+            matchmaker.remove(next_user_id - 1)
+        else:
+            # Возвращаем соперника в очередь, чтобы ее размер не менялся
+            with no_matching(matchmaker):
+                matchmaker.add(partner_id, rng.choice(LEVELS), random_mmr(rng))
+    results["add_match"] = samples
+
+    # Отмена поиска
+    samples = []
+    for _ in range(iterations):
+        user_id = rng.randrange(players)  # Исходные игроки все еще в очереди
+        start = time.perf_counter()
+        matchmaker.remove(user_id)
+        samples.append(time.perf_counter() - start)
+        with no_matching(matchmaker):
+            matchmaker.add(user_id, rng.choice(LEVELS), random_mmr(rng))
+    results["cancel"] = samples
+
+    # Проход по очереди, в которой никто никому не подходит (обычный тик).
+    # Первый проход не замеряется: он снимает с кучи сроки пар, которые
+    # замеры выше сделали соседними и которые без no_matching были бы сведены
+    with no_matching(matchmaker):
+        matchmaker.match_waiting()
+        start = time.perf_counter()
+        matchmaker.match_waiting()
+        results["match_pass_idle"] = [time.perf_counter() - start]
+
+    # Проход по очереди, когда окна расширились
+    clock.now += 3600
+    start = time.perf_counter()
+    pairs = matchmaker.match_waiting()
+    results["match_pass"] = [time.perf_counter() - start]
+
+    return results, len(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", default="1000,10000,100000")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'случай':<28}{'медиана мкс':>14}{'p99 мкс':>12}")
+    for players in (int(size) for size in args.players.split(",")):
+        results, paired = run_size(players, args.iterations, args.seed)
+        for name, samples in results.items():
+            median = statistics.median(samples) * 1e6
+            p99 = percentile(samples, 0.99) * 1e6
+            print(f"{f'{players}/{name}':<28}{median:>14.1f}{p99:>12.1f}")
+        print(f"{f'{players}/match_pass':<28} свел пар: {paired}")
+
+
+if __name__ == "__main__":
+    main()
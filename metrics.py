@@ -0,0 +1,327 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import event
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Порт HTTP-сервера с метриками в формате Prometheus (0 - не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = ""):
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    """Значение гауджа либо выставляется через set, либо вычисляется функцией
+    в момент сбора метрик (для значений, которые дешевле посчитать по запросу)."""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = function
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        if self._function is not None:
+            try:
+                yield f"{self.name} {self._function()}"
+            except Exception as e:
+                logging.error(f"Не удалось вычислить метрику {self.name}: {e}")
+            return
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам..., +Inf], сумма
+        self._counts: Dict[Tuple[str, ...], list] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, *labels, value: float):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        # Храним не накопленные значения, а попадания в корзину - так observe дешевле
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                label_str = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{label_str} {cumulative}"
+            label_str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {self._sums[labels]}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+updates_total = registry.register(
+    Counter("quiz_updates_total", "Количество полученных апдейтов")
+)
+handler_duration = registry.register(
+    Histogram(
+        "quiz_handler_duration_seconds",
+        "Время выполнения обработчиков",
+        ("handler",),
+    )
+)
+handler_errors = registry.register(
+    Counter("quiz_handler_errors_total", "Исключения в обработчиках", ("handler",))
+)
+handler_db_queries = registry.register(
+    Counter(
+        "quiz_handler_db_queries_total", "SQL-запросы, выполненные обработчиком", ("handler",)
+    )
+)
+handler_db_seconds = registry.register(
+    Counter(
+        "quiz_handler_db_seconds_total",
+        "Время SQL-запросов, выполненных обработчиком",
+        ("handler",),
+    )
+)
+db_queries = registry.register(
+    Counter("quiz_db_queries_total", "Все SQL-запросы, включая фоновые задачи")
+)
+telegram_api_duration = registry.register(
+    Histogram(
+        "quiz_telegram_api_duration_seconds",
+        "Время запросов к Telegram Bot API",
+        ("method",),
+    )
+)
+telegram_api_errors = registry.register(
+    Counter(
+        "quiz_telegram_api_errors_total",
+        "Ошибки запросов к Telegram Bot API",
+        ("method",),
+    )
+)
+
+
+# --- Учет запросов к базе в разрезе обработчиков ---
+
+
+class HandlerScope:
+    """Обработчик (и апдейт), в контексте которого сейчас выполняется код"""
+
+    __slots__ = ("name", "update_id", "queries", "db_time")
+
+    def __init__(self, name: str, update_id: Optional[int] = None):
+        self.name = name
+        self.update_id = update_id
+        self.queries = 0
+        self.db_time = 0.0
+
+
+current_scope: contextvars.ContextVar[Optional[HandlerScope]] = contextvars.ContextVar(
+    "current_scope", default=None
+)
+
+# Функции, вызываемые с HandlerScope после успешного завершения обработчика
+# (например, проверка бюджета запросов в sql_audit.py)
+scope_exit_hooks = []
+
+
+# Время начала запроса хранится в контексте выполнения, а не в соединении:
+# after_cursor_execute не вызывается для упавшего запроса, и отметка на
+# соединении из пула досталась бы следующему запросу. context бывает None
+# у служебных запросов SQLAlchemy - они считаются, но без времени.
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start", None)
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    db_queries.inc()
+    scope = current_scope.get()
+    if scope is not None:
+        scope.queries += 1
+        scope.db_time += elapsed
+
+
+def instrument_engine(engine):
+    """Подключает подсчет SQL-запросов к движку SQLAlchemy"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Обработчики ---
+
+
+def track_handler(callback, name: str = None):
+    """Оборачивает корутину обработчика: время, ошибки и запросы к базе"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        scope = HandlerScope(name, getattr(update, "update_id", None))
+        token = current_scope.set(scope)
+        start = time.perf_counter()
+        try:
+            result = await callback(update, context)
+            for hook in scope_exit_hooks:
+                hook(scope)
+            return result
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(name, value=time.perf_counter() - start)
+            if scope.queries:
+                handler_db_queries.inc(name, amount=scope.queries)
+                handler_db_seconds.inc(name, amount=scope.db_time)
+            current_scope.reset(token)
+
+    return wrapper
+
+
+def _iter_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+            yield from _iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def instrument_handlers(application):
+    """Оборачивает все зарегистрированные обработчики приложения в track_handler"""
+    for group_handlers in application.handlers.values():
+        for handler in _iter_handlers(group_handlers):
+            if not getattr(handler.callback, "__wrapped__", None):
+                handler.callback = track_handler(handler.callback)
+
+
+async def count_update(update, context):
+    """Обработчик TypeHandler в группе -1: считает входящие апдейты"""
+    updates_total.inc()
+
+
+# --- Bot API ---
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий время каждого метода Bot API"""
+
+    __slots__ = ()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            telegram_api_errors.inc(api_method)
+            raise
+        finally:
+            telegram_api_duration.observe(
+                api_method, value=time.perf_counter() - start
+            )
+
+
+# --- HTTP-сервер ---
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса нам не нужны, но их надо дочитать
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b"/"
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logging.error(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Запускает HTTP-сервер, отдающий /metrics. Возвращает asyncio.Server"""
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
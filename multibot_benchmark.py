@@ -0,0 +1,108 @@
+"""Замер памяти на каждого дополнительного бота в одном процессе (hosting.py).
+
+Процесс поднимает основную базу с банком вопросов, загружает общие для всех
+ботов структуры (индексы уровней, каталог кастомных тестов), а затем по
+одному добавляет ботов так же, как hosting.py: своя база BotDatabase,
+Application с обработчиками и JobQueue и свое состояние в памяти (вызов дня,
+трекер сессий, колесо таймеров, очередь дуэлей). Бот не подключается к
+Telegram: замеряется только то, что остается в памяти процесса.
+
+Для каждого бота печатаются прирост RSS и объем памяти Python (tracemalloc).
+Общие структуры замеряются отдельно - это то, что не дублируется.
+
+Пример:
+    python multibot_benchmark.py --bots 10
+"""
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+
+def run(bots: int):
+    import logging
+
+    logging.getLogger().setLevel(logging.ERROR)
+    tmp = tempfile.mkdtemp(prefix="multibot-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/main.db"
+
+    from seed import prepare_database
+
+    prepare_database()
+
+    import custom_tests
+    import daily
+    import duels
+    import seen
+    import sessions
+    import timers
+    from bot import build_application
+    from bot_scope import current_bot
+    from database import BotDatabase
+    from hosting import rss_bytes
+
+    tracemalloc.start()
+
+    def measure():
+        gc.collect()
+        return rss_bytes(), tracemalloc.get_traced_memory()[0]
+
+    rss_before, py_before = measure()
+    seen.install_level_indexes(seen.build_level_indexes())
+    custom_tests.get_custom_tests_storage()
+    rss_after, py_after = measure()
+    print(
+        f"общие структуры: RSS +{(rss_after - rss_before) / 1024:.0f} КБ, "
+        f"Python +{(py_after - py_before) / 1024:.0f} КБ"
+    )
+
+    applications = []  # Держим ссылки, как hosting.py
+    rss_deltas, py_deltas = [], []
+    for index in range(bots):
+        rss_before, py_before = measure()
+        scope = BotDatabase(f"bot{index}", f"sqlite:///{tmp}/bot{index}.db")
+        scope.create_tables()
+        token = current_bot.set(scope)
+        try:
+            applications.append(build_application(f"{index + 1}:MULTIBOT", standalone=False))
+            daily.ensure_daily_challenge()
+            sessions.session_tracker.current()
+            timers.question_timers.current()
+            duels.matchmaker.current()
+            # Соединения пулов открываются при первом запросе
+            with scope.engine.connect(), scope.read_engine.connect():
+                pass
+        finally:
+            current_bot.reset(token)
+        rss_after, py_after = measure()
+        rss_deltas.append(rss_after - rss_before)
+        py_deltas.append(py_after - py_before)
+        print(
+            f"бот {index + 1}: RSS +{rss_deltas[-1] / 1024:.0f} КБ, "
+            f"Python +{py_deltas[-1] / 1024:.0f} КБ, всего RSS {rss_after / 1024 / 1024:.1f} МБ"
+        )
+
+    # Первый бот дополнительно прогревает импорты и кэши SQLAlchemy
+    extra = rss_deltas[1:] or rss_deltas
+    extra_py = py_deltas[1:] or py_deltas
+    print(
+        f"на дополнительного бота (медиана): RSS {statistics.median(extra) / 1024:.0f} КБ, "
+        f"Python {statistics.median(extra_py) / 1024:.0f} КБ"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bots", type=int, default=5, help="сколько ботов добавить")
+    args = parser.parse_args()
+    if args.bots < 1:
+        sys.exit("--bots должно быть не меньше 1")
+    run(args.bots)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import and_, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import get_db, PersistedUserData, PersistedConversation
+
+# Как часто Application сбрасывает изменения в персистентность (секунды)
+PERSISTENCE_UPDATE_INTERVAL = 30
+# Сколько пользователей без сохраненных ключей помним, чтобы не читать их из базы
+EMPTY_USER_DATA_CACHE_SIZE = 10000
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит context.user_data и состояния диалогов в SQLite.
+
+    В отличие от PicklePersistence, пишет только изменившиеся ключи:
+    для каждого пользователя запоминается хэш последнего записанного значения
+    каждого ключа, и при очередном update_persistence в базу уходят только
+    ключи с новым хэшем. Все изменения одного цикла пишутся одной транзакцией
+    через executemany.
+
+    user_data не загружается при старте: данные пользователя читаются из базы
+    при первом обращении (refresh_user_data вызывается перед обработкой
+    каждого апдейта), поэтому время запуска не зависит от числа пользователей.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        # user_id -> {ключ: хэш последнего записанного значения}
+        # Наличие user_id означает, что данные пользователя уже загружены.
+        # Пользователь без сохраненных ключей переносится в _empty_users, чтобы
+        # словарь не рос на каждого, кто когда-либо писал боту
+        self._digests: Dict[int, Dict[str, bytes]] = {}
+        # Пользователи, у которых в базе точно ничего нет (LRU: старые в начале).
+        # Для них refresh_user_data не ходит в базу на каждом апдейте
+        self._empty_users: "OrderedDict[int, None]" = OrderedDict()
+        # Изменения, ожидающие записи
+        self._pending_upserts: Dict[Tuple[int, str], bytes] = {}
+        self._pending_deletes: Set[Tuple[int, str]] = set()
+        self._pending_drops: Set[int] = set()
+        self._pending_conversations: Dict[Tuple[str, str], Optional[bytes]] = {}
+        self._write_scheduled = False
+
+    # --- user_data ---
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Данные подгружаются лениво в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._digests:
+            return
+        if user_id in self._pending_drops or user_id in self._empty_users:
+            # Данные удалены (возможно, удаление еще не записано) или их не было:
+            # из базы не читаем
+            self._empty_users.pop(user_id, None)
+            self._digests[user_id] = {}
+            return
+
+        digests = {}
+        with get_db() as db:
+            rows = db.query(PersistedUserData.key, PersistedUserData.value).filter(
+                PersistedUserData.user_id == user_id
+            )
+            for key, blob in rows:
+                if (user_id, key) in self._pending_deletes:
+                    continue  # Ключ удален, удаление еще не записано
+                try:
+                    value = pickle.loads(blob)
+                except Exception as e:
+                    logging.error(
+                        f"Не удалось загрузить user_data[{key!r}] для user_id={user_id}: {e}"
+                    )
+                    continue
+                # Значения, появившиеся в памяти до загрузки, не перезаписываем
+                user_data.setdefault(key, value)
+                digests[key] = _digest(blob)
+
+        self._digests[user_id] = digests
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if user_id in self._empty_users:
+            # В базе пусто - это то же самое, что загруженные пустые данные
+            del self._empty_users[user_id]
+            self._digests[user_id] = {}
+        loaded = user_id in self._digests
+        digests = self._digests.setdefault(user_id, {})
+
+        for key, value in data.items():
+            if not isinstance(key, str):
+                logging.warning(
+                    f"Ключ user_data {key!r} не является строкой и не будет сохранен"
+                )
+                continue
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = _digest(blob)
+            if digests.get(key) != digest:
+                digests[key] = digest
+                self._pending_upserts[(user_id, key)] = blob
+                self._pending_deletes.discard((user_id, key))
+
+        # Удаляем ключи, которых больше нет. Если данные пользователя не
+        # загружались, мы не знаем, что лежит в базе, и ничего не удаляем.
+        if loaded:
+            for key in [k for k in digests if k not in data]:
+                del digests[key]
+                self._pending_upserts.pop((user_id, key), None)
+                self._pending_deletes.add((user_id, key))
+        if not digests:
+            # В базе для пользователя ничего не останется. Если данные
+            # загружались, это известно точно, и при возвращении пользователя
+            # в базу можно не ходить
+            del self._digests[user_id]
+            if loaded:
+                self._remember_empty(user_id)
+
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_upserts = {
+            k: v for k, v in self._pending_upserts.items() if k[0] != user_id
+        }
+        self._pending_deletes = {k for k in self._pending_deletes if k[0] != user_id}
+        self._pending_drops.add(user_id)
+        self._digests.pop(user_id, None)
+        self._remember_empty(user_id)
+        self._schedule_write()
+
+    def _remember_empty(self, user_id: int) -> None:
+        self._empty_users[user_id] = None
+        self._empty_users.move_to_end(user_id)
+        if len(self._empty_users) > EMPTY_USER_DATA_CACHE_SIZE:
+            self._empty_users.popitem(last=False)
+
+    # --- Диалоги ---
+
+    async def get_conversations(self, name: str) -> dict:
+        # В базе хранятся только незавершенные диалоги, их немного
+        conversations = {}
+        with get_db() as db:
+            rows = db.query(PersistedConversation.key, PersistedConversation.state).filter(
+                PersistedConversation.name == name
+            )
+            for key, state in rows:
+                conversations[tuple(json.loads(key))] = pickle.loads(state)
+        return conversations
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        state = None if new_state is None else pickle.dumps(new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_write()
+
+    # --- Данные, которые бот не использует ---
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        self._write_pending()
+
+    # --- Запись в базу ---
+
+    def _schedule_write(self):
+        """Откладывает запись до конца текущей итерации event loop.
+
+        Application.update_persistence вызывает update_* для всех измененных
+        пользователей в одном asyncio.gather, поэтому все они успевают
+        отработать до call_soon и попадают в одну транзакцию.
+        """
+        if self._write_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_pending()
+            return
+        self._write_scheduled = True
+        loop.call_soon(self._write_pending)
+
+    def _write_pending(self):
+        self._write_scheduled = False
+        if not (
+            self._pending_upserts
+            or self._pending_deletes
+            or self._pending_drops
+            or self._pending_conversations
+        ):
+            return
+
+        upserts, self._pending_upserts = self._pending_upserts, {}
+        deletes, self._pending_deletes = self._pending_deletes, set()
+        drops, self._pending_drops = self._pending_drops, set()
+        conversations, self._pending_conversations = self._pending_conversations, {}
+
+        user_table = PersistedUserData.__table__
+        conv_table = PersistedConversation.__table__
+
+        try:
+            with get_db() as db:
+                if drops:
+                    db.execute(
+                        user_table.delete().where(user_table.c.user_id.in_(drops))
+                    )
+                if deletes:
+                    db.execute(
+                        user_table.delete().where(
+                            and_(
+                                user_table.c.user_id == bindparam("b_user_id"),
+                                user_table.c.key == bindparam("b_key"),
+                            )
+                        ),
+                        [{"b_user_id": u, "b_key": k} for u, k in deletes],
+                    )
+                if upserts:
+                    now = datetime.utcnow()
+                    stmt = sqlite_insert(user_table)
+                    db.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=["user_id", "key"],
+                            set_={
+                                "value": stmt.excluded.value,
+                                "updated_at": stmt.excluded.updated_at,
+                            },
+                        ),
+                        [
+                            {"user_id": u, "key": k, "value": blob, "updated_at": now}
+                            for (u, k), blob in upserts.items()
+                        ],
+                    )
+
+                finished = [k for k, state in conversations.items() if state is None]
+                active = [(k, state) for k, state in conversations.items() if state]
+                if finished:
+                    db.execute(
+                        conv_table.delete().where(
+                            and_(
+                                conv_table.c.name == bindparam("b_name"),
+                                conv_table.c.key == bindparam("b_key"),
+                            )
+                        ),
+                        [{"b_name": n, "b_key": k} for n, k in finished],
+                    )
+                if active:
+                    stmt = sqlite_insert(conv_table)
+                    db.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=["name", "key"],
+                            set_={"state": stmt.excluded.state},
+                        ),
+                        [{"name": n, "key": k, "state": s} for (n, k), s in active],
+                    )
+
+                db.commit()
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении персистентных данных: {e}")
+            # Возвращаем изменения в очередь, более свежие значения не трогаем
+            for key, blob in upserts.items():
+                if key not in self._pending_deletes:
+                    self._pending_upserts.setdefault(key, blob)
+            self._pending_deletes |= deletes - self._pending_upserts.keys()
+            self._pending_drops |= drops
+            for key, state in conversations.items():
+                self._pending_conversations.setdefault(key, state)
@@ -0,0 +1,205 @@
+"""Банк вопросов в файлах questions/*.json и его синхронизация с базой.
+
+Каждый файл - отдельный банк (java.json, python.json, ...), список вопросов
+со стабильным ключом вида "<банк>/<уровень>/<номер>". Синхронизация сравнивает
+хеш содержимого каждого вопроса с сохраненным в базе и выполняет только
+нужные вставки, обновления и вывод из оборота - массово, через executemany.
+
+Примеры:
+    python question_bank.py sync                    # все файлы из questions/
+    python question_bank.py sync questions/sql.json --dry-run
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import insert, select, update
+
+from database import get_db, Question
+
+QUESTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions")
+
+# Поля вопроса, которые хранятся в базе и входят в хеш содержимого
+CONTENT_FIELDS = (
+    "level",
+    "question_text",
+    "option1",
+    "option2",
+    "option3",
+    "option4",
+    "correct_option",
+)
+
+
+class QuestionBankError(Exception):
+    pass
+
+
+def bank_files():
+    """Файлы банка вопросов в стабильном порядке"""
+    return sorted(glob.glob(os.path.join(QUESTIONS_DIR, "*.json")))
+
+
+def bank_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def content_hash(question: dict) -> str:
+    payload = json.dumps(
+        [question[field] for field in CONTENT_FIELDS], ensure_ascii=False
+    ).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def read_bank_file(path: str):
+    """Читает и проверяет файл банка, возвращает словарь key -> вопрос"""
+    name = bank_name(path)
+    with open(path, encoding="utf-8") as f:
+        try:
+            items = json.load(f)
+        except json.JSONDecodeError as e:
+            raise QuestionBankError(f"{path}: некорректный JSON: {e}") from e
+
+    if not isinstance(items, list):
+        raise QuestionBankError(f"{path}: ожидается список вопросов")
+
+    questions = {}
+    for position, item in enumerate(items):
+        where = f"{path}, вопрос #{position + 1}"
+        if not isinstance(item, dict):
+            raise QuestionBankError(f"{where}: ожидается объект")
+        missing = [field for field in ("key",) + CONTENT_FIELDS if field not in item]
+        if missing:
+            raise QuestionBankError(f"{where}: нет полей {', '.join(missing)}")
+        key = item["key"]
+        if not str(key).startswith(f"{name}/"):
+            raise QuestionBankError(f"{where}: ключ {key} должен начинаться с '{name}/'")
+        if key in questions:
+            raise QuestionBankError(f"{where}: повторяющийся ключ {key}")
+        if item["correct_option"] not in (1, 2, 3, 4):
+            raise QuestionBankError(f"{where}: correct_option должен быть от 1 до 4")
+        questions[key] = {field: item[field] for field in CONTENT_FIELDS}
+    return questions
+
+
+def sync_question_bank(paths=None, dry_run: bool = False) -> dict:
+    """Приводит вопросы в базе к содержимому файлов банка.
+
+    - новые ключи вставляются;
+    - вопросы с изменившимся хешем (или возвращенные в банк) обновляются;
+    - ключи банка, которых больше нет в его файле, помечаются retired.
+    Вопросы, залитые до появления ключей, сопоставляются по уровню и тексту и
+    получают ключ, сохраняя свой id (на него ссылаются начатые тесты).
+    """
+    paths = bank_files() if paths is None else list(paths)
+    bank = {}
+    names = set()
+    for path in paths:
+        bank.update(read_bank_file(path))
+        names.add(bank_name(path))
+
+    stats = {"inserted": 0, "updated": 0, "retired": 0, "unchanged": 0}
+    with get_db() as db:
+        existing = {}
+        legacy = {}
+        for row in db.execute(
+            select(
+                Question.id,
+                Question.key,
+                Question.content_hash,
+                Question.retired,
+                Question.level,
+                Question.question_text,
+            )
+        ):
+            if row.key is None:
+                legacy[(row.level, row.question_text)] = row.id
+            else:
+                existing[row.key] = row
+
+        inserts, updates = [], []
+        for key, question in bank.items():
+            digest = content_hash(question)
+            row = existing.get(key)
+            if row is None:
+                legacy_id = legacy.pop((question["level"], question["question_text"]), None)
+                if legacy_id is None:
+                    inserts.append(
+                        {**question, "key": key, "content_hash": digest, "retired": False}
+                    )
+                    continue
+                updates.append(
+                    {**question, "id": legacy_id, "key": key, "content_hash": digest, "retired": False}
+                )
+            elif row.content_hash != digest or row.retired:
+                updates.append(
+                    {**question, "id": row.id, "content_hash": digest, "retired": False}
+                )
+            else:
+                stats["unchanged"] += 1
+
+        # Выводим из оборота только вопросы тех банков, файлы которых загружены
+        retirements = [
+            {"id": row.id, "retired": True}
+            for key, row in existing.items()
+            if key not in bank and not row.retired and key.split("/", 1)[0] in names
+        ]
+
+        stats["inserted"] = len(inserts)
+        stats["updated"] = len(updates)
+        stats["retired"] = len(retirements)
+        if dry_run:
+            return stats
+
+        if inserts:
+            db.execute(insert(Question), inserts)
+        # Массовое обновление по первичному ключу (executemany)
+        if updates:
+            db.execute(update(Question), updates)
+        if retirements:
+            db.execute(update(Question), retirements)
+        db.commit()
+
+    logging.info(
+        f"Банк вопросов синхронизирован: добавлено {stats['inserted']}, "
+        f"обновлено {stats['updated']}, выведено {stats['retired']}, "
+        f"без изменений {stats['unchanged']}"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="синхронизировать базу с файлами банка")
+    sync_parser.add_argument("paths", nargs="*", help="файлы банка (по умолчанию все)")
+    sync_parser.add_argument(
+        "--dry-run", action="store_true", help="только показать, что изменится"
+    )
+    args = parser.parse_args()
+
+    from database import create_tables
+
+    create_tables()
+    start = time.perf_counter()
+    try:
+        stats = sync_question_bank(args.paths or None, dry_run=args.dry_run)
+    except QuestionBankError as e:
+        raise SystemExit(f"Ошибка в банке вопросов: {e}")
+    elapsed = time.perf_counter() - start
+
+    prefix = "Будет" if args.dry_run else "Готово"
+    print(
+        f"{prefix}: добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+        f"выведено из оборота {stats['retired']}, без изменений {stats['unchanged']} "
+        f"({elapsed:.2f} с)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from database import get_db, get_read_db, Question, ReviewItem
+
+# Вопросов в одной сессии повторения
+REVIEW_SESSION_SIZE = 10
+# Оценки SM-2 для ответа кнопкой: кнопки различают только "верно" и "неверно"
+QUALITY_CORRECT = 4
+QUALITY_WRONG = 1
+
+
+def _menu_keyboard():
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("🔁 Повторение", callback_data="review")],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
+        ]
+    )
+
+
+def record_miss(db, user_id: int, question_id: int, now: datetime = None):
+    """Ставит вопрос, на который пользователь ошибся в тесте, на повторение.
+
+    Вызывается внутри транзакции обработчика ответа, commit делает он. Ошибка
+    в тесте сбрасывает расписание, а повторить вопрос можно сразу. Один
+    upsert вместо чтения и записи: ответ входит в бюджет запросов обработчика.
+    """
+    now = now or datetime.utcnow()
+    stmt = sqlite_insert(ReviewItem).values(
+        user_id=user_id,
+        question_id=question_id,
+        repetitions=0,
+        interval_days=0,
+        ease_factor=2.5,
+        lapses=1,
+        due_at=now,
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "question_id"],
+            set_={
+                "repetitions": 0,
+                "interval_days": 0,
+                "lapses": ReviewItem.lapses + 1,
+                "due_at": func.min(ReviewItem.due_at, stmt.excluded.due_at),
+            },
+        )
+    )
+
+
+def _due_filter(user_id: int, now: datetime):
+    return (
+        ReviewItem.user_id == user_id,
+        ReviewItem.due_at <= now,
+        Question.retired == False,  # noqa: E712
+    )
+
+
+def next_due(db, user_id: int, now: datetime = None):
+    """Ближайший к повторению вопрос пользователя: (ReviewItem, Question) или None.
+
+    Идет по индексу (user_id, due_at) с начала диапазона и останавливается на
+    первой подходящей строке.
+    """
+    now = now or datetime.utcnow()
+    return (
+        db.query(ReviewItem, Question)
+        .join(Question, Question.id == ReviewItem.question_id)
+        .filter(*_due_filter(user_id, now))
+        .order_by(ReviewItem.due_at)
+        .first()
+    )
+
+
+def _question_text(question, number: int) -> str:
+    return (
+        f"🔁 Повторение, вопрос {number}:\n\n"
+        f"{question.question_text}\n\n"
+        f"Варианты ответов:\n"
+        f"1️⃣ {question.option1}\n"
+        f"2️⃣ {question.option2}\n"
+        f"3️⃣ {question.option3}\n"
+        f"4️⃣ {question.option4}"
+    )
+
+
+async def show_review_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сколько вопросов ждет повторения и когда следующий повтор"""
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    now = datetime.utcnow()
+
+    with get_read_db() as db:
+        due = (
+            db.query(func.count(ReviewItem.id))
+            .join(Question, Question.id == ReviewItem.question_id)
+            .filter(*_due_filter(user_id, now))
+            .scalar()
+        )
+        total, next_due_at = (
+            db.query(func.count(ReviewItem.id), func.min(ReviewItem.due_at))
+            .filter(ReviewItem.user_id == user_id)
+            .one()
+        )
+
+    text = (
+        "🔁 Повторение ошибок\n\n"
+        "Вопросы, на которые вы ошиблись в тестах, возвращаются по расписанию: "
+        "после верного ответа интервал растет (1 день, 6 дней и дальше), "
+        "после ошибки начинается заново.\n\n"
+    )
+    keyboard = []
+    if not total:
+        text += "Пока повторять нечего: ошибки из тестов появятся здесь."
+    elif due:
+        text += f"К повторению сейчас: {due}\nВсего в расписании: {total}"
+        keyboard.append(
+            [InlineKeyboardButton("▶️ Начать повторение", callback_data="review_start")]
+        )
+    else:
+        text += (
+            f"Все вопросы повторены. Всего в расписании: {total}\n"
+            f"Следующий повтор: {next_due_at.strftime('%d.%m.%Y %H:%M')} UTC"
+        )
+    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def start_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data["review"] = {"done": 0, "correct": 0, "item_id": None}
+    await query.edit_message_text(
+        f"🔁 Начинаем повторение: до {REVIEW_SESSION_SIZE} вопросов, "
+        "сначала те, что ждут дольше всех."
+    )
+    await _send_review_question(context, query.from_user.id)
+
+
+async def _send_review_question(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    state = context.user_data.get("review")
+    if state is None:
+        return
+    row = None
+    if state["done"] < REVIEW_SESSION_SIZE:
+        with get_db() as db:
+            row = next_due(db, user_id)
+    if row is None:
+        await _finish_review(context, user_id)
+        return
+
+    item, question = row
+    state["item_id"] = item.id
+    keyboard = [
+        [
+            InlineKeyboardButton(emoji, callback_data=f"review_answer_{item.id}_{option}")
+            for option, emoji in enumerate(("1️⃣", "2️⃣", "3️⃣", "4️⃣"), start=1)
+        ],
+        [InlineKeyboardButton("⏹ Закончить", callback_data="review_stop")],
+    ]
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=_question_text(question, state["done"] + 1),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def handle_review_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    # review_answer_<id элемента>_<вариант>
+    _, _, item_id, selected_option = query.data.split("_")
+    state = context.user_data.get("review")
+    if state is None or state["item_id"] != int(item_id):
+        return  # Повторное нажатие или сессия уже закончена
+
+    with get_db() as db:
+        row = (
+            db.query(ReviewItem, Question)
+            .join(Question, Question.id == ReviewItem.question_id)
+            .filter(ReviewItem.id == int(item_id), ReviewItem.user_id == user_id)
+            .first()
+        )
+        if row is None:
+            return
+        item, question = row
+        is_correct = question.correct_option == int(selected_option)
+        item.apply_review(QUALITY_CORRECT if is_correct else QUALITY_WRONG)
+        db.commit()
+
+    state["item_id"] = None
+    state["done"] += 1
+    state["correct"] += int(is_correct)
+
+    if is_correct:
+        feedback = "✅ Правильно!"
+    else:
+        correct_answer_text = getattr(question, f"option{question.correct_option}")
+        feedback = f"❌ Неправильно! Правильный ответ: {correct_answer_text}"
+    days = item.interval_days
+    await query.edit_message_text(
+        f"{_question_text(question, state['done'])}\n\n{feedback}\n"
+        f"Следующий повтор через {days} дн."
+    )
+    await _send_review_question(context, user_id)
+
+
+async def stop_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=None)
+    await _finish_review(context, query.from_user.id)
+
+
+async def _finish_review(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    state = context.user_data.pop("review", None)
+    if state is None:
+        return
+    if state["done"]:
+        text = f"🏁 Повторение завершено: верно {state['correct']} из {state['done']}."
+    else:
+        text = "Сейчас повторять нечего."
+    await context.bot.send_message(chat_id=user_id, text=text, reply_markup=_menu_keyboard())
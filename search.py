@@ -0,0 +1,198 @@
+import logging
+import re
+
+from sqlalchemy import text
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from custom_tests import find_custom_test, TESTS_PER_PAGE
+from database import current_read_engine, get_read_db, CustomTest, CustomQuestion
+
+# Совпадение в названии теста весит больше, чем совпадение в тексте вопроса
+NAME_WEIGHT = 2.0
+# Сколько совпадений из каждого индекса учитывается (самые новые по rowid)
+MAX_SEARCH_HITS = 2000
+# Не больше стольких слов из запроса попадает в поиск
+MAX_QUERY_TERMS = 8
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(query_text: str):
+    """Превращает ввод пользователя в запрос FTS5: должны встретиться все слова.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (AND, NEAR, *, ...) из
+    ввода не интерпретируются. Префиксный поиск (слово*) не используется:
+    для частых слов FTS5 собирает такой запрос из всех подходящих списков
+    документов, и он становится на порядок медленнее. Возвращает None, если
+    слов нет.
+    """
+    terms = _TERM_RE.findall(query_text.lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def _index_hits(db, index_name: str, match_query: str):
+    """Совпадения в FTS5-индексе: rowid -> балл bm25 (чем меньше, тем лучше).
+
+    bm25 считает, в скольких документах встречается слово, а для этого FTS5
+    читает весь список документов слова. Поэтому сначала дешево (ORDER BY
+    rowid с LIMIT) выясняем, не слишком ли слово частое. Если совпадений
+    больше MAX_SEARCH_HITS, ранжирование по ним мало что дает: берем самые
+    новые совпадения без баллов.
+    """
+    rowids = (
+        db.execute(
+            text(
+                f"SELECT rowid FROM {index_name} WHERE {index_name} MATCH :query "
+                "ORDER BY rowid DESC LIMIT :limit"
+            ),
+            {"query": match_query, "limit": MAX_SEARCH_HITS + 1},
+        )
+        .scalars()
+        .all()
+    )
+    if len(rowids) > MAX_SEARCH_HITS:
+        return dict.fromkeys(rowids[:MAX_SEARCH_HITS], 0.0)
+    if not rowids:
+        return {}
+    return dict(
+        db.execute(
+            text(
+                f"SELECT rowid, rank FROM {index_name} WHERE {index_name} MATCH :query"
+            ),
+            {"query": match_query},
+        ).all()
+    )
+
+
+def search_custom_tests(query_text: str, limit: int, offset: int = 0):
+    """Возвращает ID тестов, подходящих под запрос, от самых релевантных"""
+    match_query = build_match_query(query_text)
+    if match_query is None:
+        return []
+
+    with get_read_db() as db:
+        if current_read_engine().dialect.name != "sqlite":
+            # FTS5 есть только в SQLite: на других базах ищем только по названию
+            pattern = f"%{query_text.strip()}%"
+            rows = (
+                db.query(CustomTest.id)
+                .filter(CustomTest.name.ilike(pattern))
+                .order_by(CustomTest.id)
+                .limit(limit)
+                .offset(offset)
+            )
+            return [row.id for row in rows]
+
+        # test_id -> [лучший балл, число совпавших вопросов]
+        scores = {}
+        for test_id, score in _index_hits(db, "custom_tests_fts", match_query).items():
+            scores[test_id] = [score * NAME_WEIGHT, 0]
+
+        question_hits = _index_hits(db, "custom_questions_fts", match_query)
+        if question_hits:
+            rows = db.query(CustomQuestion.id, CustomQuestion.test_id).filter(
+                CustomQuestion.id.in_(list(question_hits))
+            )
+            for question_id, test_id in rows:
+                entry = scores.setdefault(test_id, [0.0, 0])
+                entry[0] = min(entry[0], question_hits[question_id])
+                entry[1] += 1
+
+    # Лучший балл, затем больше совпавших вопросов, затем более новые тесты
+    ranked = sorted(
+        scores, key=lambda test_id: (scores[test_id][0], -scores[test_id][1], -test_id)
+    )
+    return ranked[offset : offset + limit]
+
+
+async def _show_results(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
+    query_text = context.user_data.get("search_query", "")
+    # Берем на один результат больше, чтобы понять, есть ли следующая страница
+    test_ids = search_custom_tests(
+        query_text, limit=TESTS_PER_PAGE + 1, offset=page * TESTS_PER_PAGE
+    )
+    has_next = len(test_ids) > TESTS_PER_PAGE
+
+    lines, keyboard = [], []
+    for test_id in test_ids[:TESTS_PER_PAGE]:
+        test = find_custom_test(test_id)
+        if test is None:
+            continue  # Тест есть в базе, но еще не попал в каталог
+        author_name = test.get("author_username") or f"User_{test['author_id']}"
+        test_name = test.get("name", "Без названия")
+        lines.append(
+            f"🔹 '{test_name}' от {author_name} ({len(test.get('questions', []))} вопр.)"
+        )
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"▶️ Запустить '{test_name}'", callback_data=f"run_test_{test_id}"
+                )
+            ]
+        )
+
+    pagination_buttons = []
+    if page > 0:
+        pagination_buttons.append(
+            InlineKeyboardButton("◀️ Назад", callback_data=f"search_page_{page - 1}")
+        )
+    if has_next:
+        pagination_buttons.append(
+            InlineKeyboardButton("Вперед ▶️", callback_data=f"search_page_{page + 1}")
+        )
+    if pagination_buttons:
+        keyboard.append(pagination_buttons)
+    keyboard.append(
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+    )
+
+    if lines:
+        text_message = (
+            f"🔎 Результаты по запросу '{query_text}' (страница {page + 1}):\n\n"
+            + "\n".join(lines)
+        )
+    else:
+        text_message = f"🔎 По запросу '{query_text}' ничего не найдено."
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if update.callback_query:
+        await update.callback_query.edit_message_text(
+            text_message, reply_markup=reply_markup
+        )
+    else:
+        await update.message.reply_text(text_message, reply_markup=reply_markup)
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search <запрос> - поиск кастомных тестов по названию и тексту вопросов"""
+    query_text = " ".join(context.args or []).strip()
+    if not build_match_query(query_text):
+        await update.message.reply_text(
+            "Напишите, что искать, например: /search python списки"
+        )
+        return
+
+    context.user_data["search_query"] = query_text
+    try:
+        await _show_results(update, context, page=0)
+    except Exception as e:
+        logging.error(f"Ошибка поиска по запросу '{query_text}': {e}")
+        await update.message.reply_text("❌ Поиск временно недоступен.")
+
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает результаты последнего поиска пользователя"""
+    query = update.callback_query
+    await query.answer()
+    if "search_query" not in context.user_data:
+        await query.edit_message_text(
+            "Поиск устарел, повторите его командой /search.",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
+            ),
+        )
+        return
+    await _show_results(update, context, page=int(query.data.split("_")[-1]))
@@ -0,0 +1,105 @@
+import glob
+import hashlib
+import logging
+import os
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from database import engine, create_tables, get_db, Base, AppMetadata, SEARCH_INDEX_DDL
+
+SCHEMA_KEY = "schema_fingerprint"
+QUESTION_BANK_KEY = "question_bank_fingerprint"
+
+# Совпадает с question_bank.QUESTIONS_DIR; сам модуль импортируется только
+# когда банк действительно нужно синхронизировать
+QUESTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions")
+
+
+def schema_fingerprint() -> str:
+    """Отпечаток схемы: хеш DDL всех таблиц и индексов, включая поисковые"""
+    digest = hashlib.blake2b(digest_size=16)
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(
+                str(CreateIndex(index).compile(dialect=engine.dialect)).encode()
+            )
+    for statement in SEARCH_INDEX_DDL:
+        digest.update(statement.encode())
+    return digest.hexdigest()
+
+
+def question_bank_fingerprint() -> str:
+    """Отпечаток банка вопросов: хеш файлов questions/*.json.
+
+    Файлы читаются как байты, без разбора JSON - это на порядки дешевле
+    синхронизации, которой он позволяет избежать.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(glob.glob(os.path.join(QUESTIONS_DIR, "*.json"))):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode())
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _read_fingerprints():
+    try:
+        with get_db() as db:
+            rows = db.execute(
+                select(AppMetadata.key, AppMetadata.value).where(
+                    AppMetadata.key.in_((SCHEMA_KEY, QUESTION_BANK_KEY))
+                )
+            )
+            return dict(rows.all())
+    except OperationalError:
+        # Таблицы app_metadata еще нет: новая база или созданная до ее появления
+        return {}
+
+
+def _write_fingerprints(values):
+    with get_db() as db:
+        for key, value in values.items():
+            db.merge(AppMetadata(key=key, value=value))
+        db.commit()
+
+
+def save_question_bank_fingerprint(fingerprint: str):
+    """Запоминает отпечаток банка, уже синхронизированного с базой
+    (после перезагрузки без перезапуска, см. bank_reload.py)"""
+    _write_fingerprints({QUESTION_BANK_KEY: fingerprint})
+
+
+def seed_questions():
+    """Синхронизирует базу с банком вопросов (только изменившиеся вопросы)"""
+    from question_bank import sync_question_bank
+
+    sync_question_bank()
+
+
+def prepare_database():
+    """Готовит базу к запуску бота.
+
+    Сохраненные отпечатки схемы и банка вопросов читаются одним запросом по
+    первичному ключу app_metadata. Если оба совпадают с текущими, create_tables
+    не вызывается, а файлы банка вопросов даже не разбираются.
+    """
+    stored = _read_fingerprints()
+    current = {
+        SCHEMA_KEY: schema_fingerprint(),
+        QUESTION_BANK_KEY: question_bank_fingerprint(),
+    }
+    changed = {key: value for key, value in current.items() if stored.get(key) != value}
+    if not changed:
+        return
+
+    if SCHEMA_KEY in changed:
+        logging.info("Схема базы изменилась, создаем недостающие таблицы и индексы")
+        create_tables()
+    if QUESTION_BANK_KEY in changed:
+        logging.info("Банк вопросов изменился или еще не залит, синхронизируем")
+        seed_questions()
+
+    _write_fingerprints(changed)
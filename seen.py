@@ -0,0 +1,176 @@
+import random
+from datetime import datetime
+
+from sqlalchemy import select
+
+from database import get_db, Question, SeenQuestions
+from metrics import registry, Gauge
+
+# Уровень -> LevelIndex. Недостающие уровни строятся при первом обращении,
+# после перезагрузки банка словарь целиком заменяется новым (install_level_indexes)
+_level_indexes = {}
+# Значение по умолчанию для строки, которую вызывающий еще не читал
+_NOT_LOADED = object()
+
+registry.register(
+    Gauge(
+        "quiz_seen_bitmap_bytes",
+        "Наибольший размер битовых карт просмотренных вопросов одного "
+        "пользователя, сумма по загруженным уровням",
+        function=lambda: sum(index.nbytes for index in _level_indexes.values()),
+    )
+)
+
+
+class LevelIndex:
+    """Плотная нумерация вопросов уровня: позиция - номер вопроса в порядке id.
+
+    Вопросы не удаляются, а только выводятся из оборота, новые получают
+    большие id - поэтому позиции не сдвигаются и битовые карты пользователей
+    при обновлении банка остаются верными. Карта пользователя занимает не
+    больше nbytes = ceil(вопросов уровня / 8) байт.
+    """
+
+    def __init__(self, rows):
+        self.ids = [row.id for row in rows]
+        self.positions = {question_id: pos for pos, question_id in enumerate(self.ids)}
+        # Позиции действующих вопросов: из них выбирается случайная за O(1)
+        self.active = [pos for pos, row in enumerate(rows) if not row.retired]
+        self.active_mask = int.from_bytes(set_bits(b"", self.active, len(self.ids)), "little")
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.ids) + 7) // 8
+
+
+def level_index(db, level: str) -> LevelIndex:
+    indexes = _level_indexes
+    index = indexes.get(level)
+    if index is None:
+        rows = db.execute(
+            select(Question.id, Question.retired)
+            .where(Question.level == level)
+            .order_by(Question.id)
+        ).all()
+        index = indexes[level] = LevelIndex(rows)
+    return index
+
+
+def build_level_indexes() -> dict:
+    """Строит индексы всех уровней одним запросом, не трогая текущие.
+
+    Не обращается к состоянию event loop, поэтому вызывается в отдельном
+    потоке (см. bank_reload.py).
+    """
+    rows_by_level = {}
+    with get_db() as db:
+        for row in db.execute(
+            select(Question.level, Question.id, Question.retired).order_by(
+                Question.level, Question.id
+            )
+        ):
+            rows_by_level.setdefault(row.level, []).append(row)
+    return {level: LevelIndex(rows) for level, rows in rows_by_level.items()}
+
+
+def install_level_indexes(indexes: dict):
+    """Подменяет индексы всех уровней одним присваиванием.
+
+    Обработчик, уже получивший индекс, дорабатывает со старым: позиции
+    вопросов в новом индексе те же, добавляются только новые в конце.
+    """
+    global _level_indexes
+    _level_indexes = indexes
+
+
+def is_set(bitmap: bytes, pos: int) -> bool:
+    byte = pos >> 3
+    return byte < len(bitmap) and bool(bitmap[byte] >> (pos & 7) & 1)
+
+
+def set_bits(bitmap: bytes, positions, size: int) -> bytes:
+    result = bytearray(bitmap)
+    result.extend(b"\0" * ((size + 7) // 8 - len(result)))
+    for pos in positions:
+        result[pos >> 3] |= 1 << (pos & 7)
+    return bytes(result)
+
+
+def choose_unseen(index: LevelIndex, seen: bytes, count: int, rng=random):
+    """Выбирает count позиций действующих вопросов, которых нет в карте seen.
+
+    Возвращает (позиции, reset). Если непросмотренных меньше count, круг
+    начинается заново (reset=True) и выбор идет из всех вопросов уровня.
+    Список непросмотренных не строится: пока их не меньше половины, случайная
+    позиция принимается, если ее бит не установлен, - в среднем не больше двух
+    попыток на вопрос, то есть O(count). Когда непросмотренных мало, они
+    перечисляются по установленным битам маски - O(непросмотренных).
+    """
+    active_total = len(index.active)
+    count = min(count, active_total)
+    unseen_mask = index.active_mask & ~int.from_bytes(seen, "little")
+    unseen_count = unseen_mask.bit_count()
+    reset = unseen_count < count
+    if reset:
+        seen = b""
+        unseen_mask = index.active_mask
+        unseen_count = active_total
+
+    if unseen_count * 2 >= active_total:
+        chosen = []
+        taken = set()
+        while len(chosen) < count:
+            pos = rng.choice(index.active)
+            if pos not in taken and not is_set(seen, pos):
+                taken.add(pos)
+                chosen.append(pos)
+        return chosen, reset
+
+    positions = []
+    while unseen_mask:
+        lowest = unseen_mask & -unseen_mask
+        positions.append(lowest.bit_length() - 1)
+        unseen_mask ^= lowest
+    return rng.sample(positions, count), reset
+
+
+def select_questions(db, user_id: int, level: str, count: int, rng=random):
+    """ID вопросов для нового теста, в первую очередь непросмотренные.
+
+    Начало нового круга сохраняется в той же транзакции, commit делает
+    вызывающий.
+    """
+    index = level_index(db, level)
+    row = db.get(SeenQuestions, (user_id, level))
+    positions, reset = choose_unseen(index, row.bitmap if row else b"", count, rng)
+    if reset and row is not None:
+        row.bitmap = b""
+        row.updated_at = datetime.utcnow()
+    return [index.ids[pos] for pos in positions]
+
+
+def record_seen(db, user_id: int, level: str, question_ids, row=_NOT_LOADED):
+    """Отмечает вопросы завершенного теста как просмотренные (commit делает вызывающий).
+
+    row - строка SeenQuestions, если вызывающий уже прочитал ее вместе с
+    другими данными (None - строки нет); иначе она читается здесь.
+    """
+    index = level_index(db, level)
+    positions = [
+        index.positions[question_id]
+        for question_id in question_ids
+        if question_id in index.positions
+    ]
+    if row is _NOT_LOADED:
+        row = db.get(SeenQuestions, (user_id, level))
+    if row is None:
+        db.add(
+            SeenQuestions(
+                user_id=user_id,
+                level=level,
+                bitmap=set_bits(b"", positions, len(index.ids)),
+            )
+        )
+    else:
+        row.bitmap = set_bits(row.bitmap, positions, len(index.ids))
+        row.updated_at = datetime.utcnow()
@@ -0,0 +1,289 @@
+import heapq
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from telegram.ext import ContextTypes
+
+from bot_scope import BotLocal
+from database import get_db, get_read_db, UserProgress, PersistedUserData
+from metrics import registry, Counter, Gauge
+
+# Сессия без ответов дольше этого времени считается брошенной
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 30 * 60))
+# Как часто запускается сборщик брошенных сессий
+REAP_INTERVAL_SECONDS = 60
+# Сколько строк удаляется из базы за одну транзакцию
+REAP_BATCH_SIZE = 500
+# Общий бюджет памяти на состояния кастомных тестов (байты)
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 64 * 1024 * 1024))
+
+
+def estimate_state_size(state) -> int:
+    """Приблизительный размер состояния пользователя в байтах"""
+    return len(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class SessionTracker:
+    """Следит за активными кастомными тестами в context.user_data.
+
+    Время последней активности хранится в min-куче, поэтому сборщик
+    достает только просроченные сессии, не перебирая все. Устаревшие записи
+    кучи (после повторного touch) пропускаются при извлечении.
+    Порядок LRU и размер состояний нужны для соблюдения общего бюджета памяти.
+    """
+
+    def __init__(self, ttl_seconds: int, memory_budget: int):
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget = memory_budget
+        self._heap: List[Tuple[float, int]] = []
+        self._last_activity: Dict[int, float] = {}
+        self._sizes: "OrderedDict[int, int]" = OrderedDict()  # LRU: старые в начале
+        self.memory_used = 0
+
+    def __len__(self):
+        return len(self._last_activity)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._last_activity
+
+    def touch(self, application, user_id: int, timestamp: float, size: int = None):
+        """Отмечает активность пользователя и при необходимости вытесняет
+        самые давние сессии, чтобы уложиться в бюджет памяти."""
+        self._last_activity[user_id] = timestamp
+        heapq.heappush(self._heap, (timestamp, user_id))
+
+        if size is not None:
+            self.memory_used += size - self._sizes.get(user_id, 0)
+            self._sizes[user_id] = size
+        if user_id in self._sizes:
+            self._sizes.move_to_end(user_id)
+
+        while self.memory_used > self.memory_budget and len(self._sizes) > 1:
+            oldest_user_id = next(iter(self._sizes))
+            if oldest_user_id == user_id:
+                break
+            self.forget(oldest_user_id)
+            _drop_custom_test(application, oldest_user_id)
+            sessions_evicted.inc()
+            logging.info(
+                f"Кастомный тест user_id={oldest_user_id} вытеснен: превышен бюджет памяти"
+            )
+
+        # Куча копит устаревшие записи, периодически перестраиваем ее
+        if len(self._heap) > 4 * len(self._last_activity) + 1024:
+            self._heap = [(ts, uid) for uid, ts in self._last_activity.items()]
+            heapq.heapify(self._heap)
+
+    def forget(self, user_id: int):
+        self._last_activity.pop(user_id, None)
+        self.memory_used -= self._sizes.pop(user_id, 0)
+
+    def pop_expired(self, now: float) -> List[int]:
+        """Возвращает пользователей, чьи сессии простаивают дольше TTL"""
+        cutoff = now - self.ttl_seconds
+        expired = []
+        while self._heap and self._heap[0][0] < cutoff:
+            timestamp, user_id = heapq.heappop(self._heap)
+            if self._last_activity.get(user_id) != timestamp:
+                continue  # Запись устарела: был более поздний touch
+            self.forget(user_id)
+            expired.append(user_id)
+        return expired
+
+
+session_tracker = BotLocal(
+    lambda: SessionTracker(SESSION_TTL_SECONDS, SESSION_MEMORY_BUDGET)
+)
+
+
+class StandardSessions:
+    """Пользователи с начатым стандартным тестом (UserProgress.is_testing).
+
+    Держатся в памяти, чтобы метрика не считала строки в базе на каждом
+    опросе. Список читается из базы при запуске бота, дальше обновляется
+    при начале, завершении и очистке тестов.
+    """
+
+    def __init__(self):
+        self._user_ids = set()
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def load(self):
+        with get_read_db() as db:
+            self._user_ids = {
+                row.user_id
+                for row in db.query(UserProgress.user_id).filter(
+                    UserProgress.is_testing == True  # noqa: E712
+                )
+            }
+
+    def started(self, user_id: int):
+        self._user_ids.add(user_id)
+
+    def finished(self, user_id: int):
+        self._user_ids.discard(user_id)
+
+
+standard_sessions = BotLocal(StandardSessions)
+
+
+sessions_expired = registry.register(
+    Counter(
+        "quiz_sessions_expired_total",
+        "Сессии, завершенные сборщиком по TTL",
+        ("kind",),
+    )
+)
+sessions_evicted = registry.register(
+    Counter(
+        "quiz_sessions_evicted_total",
+        "Кастомные тесты, вытесненные из памяти по LRU из-за бюджета",
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_active_custom_sessions",
+        "Активные кастомные тесты",
+        function=lambda: sum(len(tracker) for tracker in session_tracker.instances()),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_active_standard_sessions",
+        "Активные стандартные тесты",
+        function=lambda: sum(len(sessions) for sessions in standard_sessions.instances()),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_session_memory_bytes",
+        "Оценка памяти, занятой состояниями кастомных тестов",
+        function=lambda: sum(
+            tracker.memory_used for tracker in session_tracker.instances()
+        ),
+    )
+)
+
+
+def is_session_expired(test_state: dict, now: float = None) -> bool:
+    """Проверяет состояние кастомного теста, загруженное, например, после перезапуска"""
+    last_activity = test_state.get("last_activity")
+    if last_activity is None:
+        return False
+    return (now or time.time()) - last_activity > SESSION_TTL_SECONDS
+
+
+def _drop_custom_test(application, user_id: int):
+    user_data = application.user_data.get(user_id)
+    if user_data is None or user_data.pop("custom_test", None) is None:
+        return
+    if not user_data:
+        # Больше ничего не хранится: убираем пользователя из памяти Application
+        # и персистентности целиком, а не оставляем пустые записи
+        application.drop_user_data(user_id)
+    else:
+        # Удаление ключа должно попасть и в персистентность
+        application.mark_data_for_update_persistence(user_ids=user_id)
+
+
+def _reap_standard_sessions(cutoff: datetime) -> int:
+    """Удаляет брошенные стандартные тесты пачками по индексу last_answer_time"""
+    removed = 0
+    with get_db() as db:
+        while True:
+            rows = (
+                db.query(UserProgress.id, UserProgress.user_id)
+                .filter(
+                    UserProgress.last_answer_time < cutoff,
+                    UserProgress.is_testing == True,  # noqa: E712
+                )
+                .order_by(UserProgress.last_answer_time)
+                .limit(REAP_BATCH_SIZE)
+                .all()
+            )
+            if not rows:
+                break
+            db.query(UserProgress).filter(
+                UserProgress.id.in_([row.id for row in rows])
+            ).delete(synchronize_session=False)
+            db.commit()
+            for row in rows:
+                standard_sessions.finished(row.user_id)
+            removed += len(rows)
+            if len(rows) < REAP_BATCH_SIZE:
+                break
+    return removed
+
+
+async def _reap_persisted_custom_tests(application, cutoff: datetime) -> int:
+    """Завершает сохраненные кастомные тесты, не менявшиеся дольше TTL.
+
+    Покрывает пользователей, которые не вернулись после перезапуска бота и
+    чьи данные поэтому так и не были загружены в память. Данные загружаются
+    через персистентность и удаляются так же, как брошенные сессии в памяти,
+    поэтому персистентность знает об удалении и не расходится с базой.
+    """
+    if application.persistence is None:
+        return 0
+    with get_db() as db:
+        user_ids = [
+            row.user_id
+            for row in db.query(PersistedUserData.user_id)
+            .filter(
+                PersistedUserData.key == "custom_test",
+                PersistedUserData.updated_at < cutoff,
+            )
+            .order_by(PersistedUserData.updated_at)
+            .limit(REAP_BATCH_SIZE)
+        ]
+
+    removed = 0
+    for user_id in user_ids:
+        if user_id in session_tracker:
+            continue  # Тест в памяти, его завершит трекер
+        context = application.context_types.context(
+            application, chat_id=user_id, user_id=user_id
+        )
+        await context.refresh_data()
+        test_state = context.user_data.get("custom_test")
+        if test_state is None or not is_session_expired(test_state):
+            continue
+        _drop_custom_test(application, user_id)
+        removed += 1
+    return removed
+
+
+async def reap_sessions(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: завершает сессии, простаивающие дольше TTL"""
+    now = time.time()
+    expired_custom = 0
+    for user_id in session_tracker.pop_expired(now):
+        _drop_custom_test(context.application, user_id)
+        expired_custom += 1
+
+    cutoff = datetime.utcnow() - timedelta(seconds=SESSION_TTL_SECONDS)
+    expired_standard = expired_persisted = 0
+    try:
+        expired_standard = _reap_standard_sessions(cutoff)
+        expired_persisted = await _reap_persisted_custom_tests(context.application, cutoff)
+    except Exception as e:
+        logging.error(f"Ошибка при очистке брошенных сессий: {e}")
+
+    sessions_expired.inc("custom", amount=expired_custom)
+    sessions_expired.inc("standard", amount=expired_standard)
+    sessions_expired.inc("persisted", amount=expired_persisted)
+
+    if expired_custom or expired_standard or expired_persisted:
+        logging.info(
+            f"Завершены брошенные сессии: стандартных {expired_standard}, "
+            f"кастомных {expired_custom}, сохраненных {expired_persisted}. "
+            f"Память кастомных тестов: {session_tracker.memory_used} "
+            f"из {session_tracker.memory_budget} байт"
+        )
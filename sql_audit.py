@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+
+from sqlalchemy import event
+
+from metrics import current_scope, scope_exit_hooks
+
+logger = logging.getLogger(__name__)
+
+# Запросы дольше этого порога попадают в лог вместе с параметрами
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+# Бюджет SQL-запросов на один апдейт для обработчиков без явного бюджета
+DEFAULT_QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 10))
+# В строгом режиме (тесты, бенчмарки) превышение бюджета - ошибка, иначе - warning
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+
+# Бюджеты обработчиков, которым по делу нужно больше запросов, чем по умолчанию
+QUERY_BUDGETS = {}
+
+# Параметры в логе обрезаются до этой длины
+_MAX_PARAMS_LENGTH = 500
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _describe_scope():
+    scope = current_scope.get()
+    if scope is None:
+        return "вне обработчика"
+    return f"{scope.name}, update_id={scope.update_id}"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # На контексте выполнения: у упавшего запроса after не вызывается (см. metrics.py)
+    if context is not None:
+        context._audit_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_audit_query_start", None)
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        params = repr(parameters)
+        if len(params) > _MAX_PARAMS_LENGTH:
+            params = params[:_MAX_PARAMS_LENGTH] + "..."
+        logger.warning(
+            f"Медленный запрос {elapsed_ms:.1f} мс [{_describe_scope()}]: "
+            f"{statement} | параметры: {params}"
+        )
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"SQL {elapsed_ms:.2f} мс [{_describe_scope()}]: {statement}")
+
+
+def check_query_budget(scope):
+    """Сравнивает число запросов обработчика с его бюджетом"""
+    budget = QUERY_BUDGETS.get(scope.name, DEFAULT_QUERY_BUDGET)
+    if scope.queries <= budget:
+        return
+
+    message = (
+        f"Обработчик {scope.name} (update_id={scope.update_id}) выполнил "
+        f"{scope.queries} SQL-запросов при бюджете {budget}"
+    )
+    if QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def install(engine):
+    """Подключает лог медленных запросов и проверку бюджета запросов"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if check_query_budget not in scope_exit_hooks:
+        scope_exit_hooks.append(check_query_budget)
@@ -0,0 +1,185 @@
+"""Замер времени запуска бота по фазам.
+
+Каждый запуск выполняется в новом процессе интерпретатора, чтобы замерять
+холодный импорт модулей. Сценарии:
+    cold - пустая база: создаются таблицы и заливается банк вопросов;
+    warm - база уже подготовлена: отпечатки в app_metadata совпадают,
+           create_tables и синхронизация банка вопросов пропускаются.
+
+Фазы: импорт database, prepare_database, импорт bot (telegram, custom_tests и
+остальные модули), сборка Application с обработчиками и первая загрузка
+каталога кастомных тестов (она ленивая и происходит при первом обращении).
+
+Пример:
+    python startup_benchmark.py --runs 10 --custom-tests 1000
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PHASES = (
+    "import_database",
+    "prepare_database",
+    "import_bot",
+    "build_application",
+    "load_catalog",
+)
+BANK_MODULES = ("question_bank",)
+
+
+def run_child():
+    """Выполняется в дочернем процессе: проходит все фазы запуска"""
+    import logging
+
+    logging.getLogger().setLevel(logging.ERROR)
+    timings = {}
+
+    # Фаза замеряет сам импорт модуля, имя database дальше не нужно
+    start = time.perf_counter()
+    importlib.import_module("database")
+
+    timings["import_database"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from seed import prepare_database
+
+    prepare_database()
+    timings["prepare_database"] = time.perf_counter() - start
+    bank_loaded = any(name in sys.modules for name in BANK_MODULES)
+
+    start = time.perf_counter()
+    import bot
+
+    timings["import_bot"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from telegram.ext import Application
+
+    from persistence import SQLitePersistence
+
+    application = (
+        Application.builder()
+        .token("123456:STARTUP-BENCHMARK")
+        .persistence(SQLitePersistence())
+        .build()
+    )
+    bot.setup_handlers(application)
+    timings["build_application"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import custom_tests
+
+    custom_tests.get_custom_tests_storage()
+    timings["load_catalog"] = time.perf_counter() - start
+
+    print(json.dumps({"timings": timings, "bank_loaded": bank_loaded}))
+
+
+def seed_catalog(custom_tests_count: int):
+    """Выполняется в дочернем процессе: готовит базу для сценария warm"""
+    import database
+    from database import CustomQuestion, CustomTest
+    from seed import prepare_database
+
+    prepare_database()
+    with database.engine.begin() as conn:
+        conn.execute(
+            CustomTest.__table__.insert(),
+            [
+                {"name": f"Тест {i}", "author_id": 1_000_000 + i, "author_username": f"author{i}"}
+                for i in range(custom_tests_count)
+            ],
+        )
+        test_ids = [row[0] for row in conn.execute(CustomTest.__table__.select().with_only_columns(CustomTest.id))]
+        conn.execute(
+            CustomQuestion.__table__.insert(),
+            [
+                {
+                    "test_id": test_id,
+                    "question_text": f"Вопрос {n}?",
+                    "option1": "1",
+                    "option2": "2",
+                    "option3": "3",
+                    "option4": "4",
+                    "correct_option": 1,
+                }
+                for test_id in test_ids
+                for n in range(5)
+            ],
+        )
+
+
+def spawn(db_path: str, *extra):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", METRICS_PORT="0")
+    command = [sys.executable, os.path.abspath(__file__), *extra]
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit("Дочерний процесс бенчмарка упал")
+    return completed.stdout, elapsed
+
+
+def run_scenario(name: str, runs: int, workdir: str, custom_tests_count: int):
+    warm_db = os.path.join(workdir, "warm.db")
+    if name == "warm":
+        spawn(warm_db, "--seed-catalog", str(custom_tests_count))
+
+    samples = {phase: [] for phase in PHASES}
+    process_times = []
+    bank_loaded = False
+    for run in range(runs):
+        db_path = warm_db if name == "warm" else os.path.join(workdir, f"cold_{run}.db")
+        stdout, elapsed = spawn(db_path, "--child")
+        result = json.loads(stdout.strip().splitlines()[-1])
+        for phase in PHASES:
+            samples[phase].append(result["timings"][phase] * 1000)
+        process_times.append(elapsed * 1000)
+        bank_loaded = bank_loaded or result["bank_loaded"]
+
+    print(f"\nСценарий {name} ({runs} запусков), банк вопросов загружался: "
+          f"{'да' if bank_loaded else 'нет'}")
+    print(f"{'фаза':<24}{'медиана мс':>12}{'max мс':>10}")
+    total = 0.0
+    for phase in PHASES:
+        median = statistics.median(samples[phase])
+        total += median
+        print(f"{phase:<24}{median:>12.1f}{max(samples[phase]):>10.1f}")
+    print(f"{'сумма фаз':<24}{total:>12.1f}")
+    print(f"{'процесс целиком':<24}{statistics.median(process_times):>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--custom-tests", type=int, default=100, help="размер каталога в сценарии warm"
+    )
+    parser.add_argument("--scenarios", default="cold,warm")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed-catalog", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child or args.seed_catalog is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        if args.child:
+            run_child()
+        else:
+            seed_catalog(args.seed_catalog)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="quiz_startup_") as workdir:
+        for name in args.scenarios.split(","):
+            run_scenario(name, args.runs, workdir, args.custom_tests)
+
+
+if __name__ == "__main__":
+    main()
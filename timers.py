@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+from bot_scope import BotLocal
+from metrics import registry, Counter, Gauge
+
+# Время на ответ на один вопрос в секундах (0 - без ограничения)
+QUESTION_TIME_LIMIT = int(os.getenv("QUESTION_TIME_LIMIT", "0"))
+# Точность дедлайнов: колесо проворачивается раз в столько секунд
+TIMER_TICK_SECONDS = 1.0
+# Число ячеек колеса; дедлайны дальше одного оборота ждут в ячейке свой круг
+TIMER_WHEEL_SLOTS = 512
+
+
+class TimerWheel:
+    """Хешированное колесо таймеров.
+
+    Дедлайн округляется вверх до тика и попадает в ячейку tick % slots.
+    Ячейка - словарь key -> (тик дедлайна, payload), а отдельный словарь
+    помнит ячейку каждого ключа, поэтому постановка, замена и отмена таймера
+    стоят O(1) независимо от числа активных таймеров. За один тик
+    просматривается только одна ячейка; таймеры, чей дедлайн через несколько
+    оборотов, в ней просто остаются.
+    """
+
+    def __init__(self, tick_seconds: float, slots: int, clock=time.monotonic):
+        self.tick_seconds = tick_seconds
+        self._clock = clock
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._tick = self._current_tick()
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _current_tick(self, now: float = None) -> int:
+        return int((self._clock() if now is None else now) / self.tick_seconds)
+
+    def schedule(self, key, delay: float, payload=None):
+        """Ставит (или переставляет) таймер key через delay секунд"""
+        self.cancel(key)
+        deadline = math.ceil((self._clock() + delay) / self.tick_seconds)
+        deadline = max(deadline, self._tick + 1)
+        slot = deadline % len(self._slots)
+        self._slots[slot][key] = (deadline, payload)
+        self._slot_of[key] = slot
+
+    def cancel(self, key) -> bool:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def advance(self, now: float = None):
+        """Проворачивает колесо до текущего момента, возвращает сработавшие
+        таймеры списком (key, payload)"""
+        target = self._current_tick(now)
+        if target <= self._tick:
+            return []
+        expired = []
+        # Если цикл отстал больше чем на оборот, достаточно обойти колесо один раз
+        steps = min(target - self._tick, len(self._slots))
+        for tick in range(self._tick + 1, self._tick + 1 + steps):
+            bucket = self._slots[tick % len(self._slots)]
+            if not bucket:
+                continue
+            due = [key for key, (deadline, _) in bucket.items() if deadline <= target]
+            for key in due:
+                _, payload = bucket.pop(key)
+                del self._slot_of[key]
+                expired.append((key, payload))
+        self._tick = target
+        return expired
+
+
+# Ключ таймера - (вид, id): для вопросов это (вид теста, user_id) - у
+# пользователя не больше одного активного вопроса каждого вида, для дуэлей
+# ("duel", id дуэли)
+question_timers = BotLocal(lambda: TimerWheel(TIMER_TICK_SECONDS, TIMER_WHEEL_SLOTS))
+# Вид -> корутина handler(application, id, payload); заполняется в bot.py
+TIMEOUT_HANDLERS = {}
+
+question_timeouts = registry.register(
+    Counter(
+        "quiz_question_timeouts_total",
+        "Сработавшие таймеры: вопросы, время на которые истекло, и дуэли",
+        ("kind",),
+    )
+)
+registry.register(
+    Gauge(
+        "quiz_question_timers",
+        "Активные таймеры вопросов",
+        function=lambda: sum(len(wheel) for wheel in question_timers.instances()),
+    )
+)
+
+
+def start_question_timer(kind: str, user_id: int, payload):
+    """Запускает отсчет времени на вопрос, если время ограничено"""
+    if QUESTION_TIME_LIMIT:
+        question_timers.schedule((kind, user_id), QUESTION_TIME_LIMIT, payload)
+
+
+def cancel_question_timer(kind: str, user_id: int):
+    question_timers.cancel((kind, user_id))
+
+
+async def _fire(application, kind: str, target_id: int, payload):
+    handler = TIMEOUT_HANDLERS.get(kind)
+    if handler is None:
+        return
+    question_timeouts.inc(kind)
+    try:
+        await handler(application, target_id, payload)
+    except Exception as e:
+        logging.error(f"Ошибка при срабатывании таймера ({kind}, {target_id}): {e}")
+
+
+async def run_question_timers(application):
+    """Фоновая задача: одна на все сессии и дуэли, раз в тик проворачивает колесо.
+
+    Таймеры живут только в памяти: после перезапуска бота текущий вопрос
+    остается без дедлайна, следующий получит его как обычно.
+    """
+    while True:
+        await asyncio.sleep(TIMER_TICK_SECONDS)
+        for (kind, target_id), payload in question_timers.advance():
+            application.create_task(_fire(application, kind, target_id, payload))